@@ -11,15 +11,21 @@ QString = str
 # go on with regular importing, etc.
 import csv
 import gettext
+import hashlib
+import json
 import logging
 from distutils.version import LooseVersion
 import os
+import tempfile
+import time
 import itertools
+import weakref
 
 __version__ = '1.8.0.dev1'
 
 import matplotlib
-matplotlib.use("qt5agg")
+if not os.environ.get('MPLBACKEND'):  # the backend can be set from outside, e.g., for the headless batch mode
+    matplotlib.use("qt5agg")
 #print matplotlib.get_backend()
 
 from . import cogstat_config as csc
@@ -33,12 +39,9 @@ cs_util.get_versions()
 import numpy as np
 from scipy import stats
 import pandas as pd
-import matplotlib.pyplot as plt
 from matplotlib import rcParams
 from matplotlib.figure import Figure
 
-from PyQt5 import QtGui
-
 logging.root.setLevel(logging.INFO)
 
 rcParams['figure.figsize'] = csc.fig_size_x, csc.fig_size_y
@@ -56,9 +59,13 @@ output_type = 'ipnb'  # if run from GUI, this is switched to 'gui'
 
 app_devicePixelRatio = 1.0 # this will be overwritten from cogstat_gui; this is needed for high dpi screens
 
+
+class AnalysisCancelled(Exception):
+    """The import or the analysis was cancelled by the progress callback of the CogStatData instance."""
+
 class CogStatData:
     """Class to process data."""
-    def __init__(self, data='', measurement_level=''):
+    def __init__(self, data='', measurement_level='', downcast=None, float32=None, progress_callback=None):
         """
         In the input data:
         - First line should be the variable name
@@ -67,12 +74,12 @@ class CogStatData:
         - Second line could be the measuring level
 
         Data structure:
-        self.data_frame - pandas DataFrame
+        self.data_frame - pandas DataFrame, the filtered data (see filter_outlier()); use it for the analyses
         self.data_measlevs - dictionary storing level of measurement of the variables (name:level):
                 'nom', 'ord' or 'int'(ratio is included in 'int')
                 'unk' - unknown: if no other level is given
-        self.orig_data_frame # TODO
-        self.filtering_status # TODO
+        self.orig_data_frame - pandas DataFrame, the imported data without filtering
+        self.filtering_status - text info about the filtering, or None if filtering is off
 
         self.import_source - text info about the import source
         self.import_message - any text warning about the imported data
@@ -86,39 +93,401 @@ class CogStatData:
         - if measurement level is set,then use it
         - otherwise look for it in the file/multiline string
         - otherwise set the types to nom and unk
+
+        downcast: store integer variables in the smallest integer type that can hold their values
+        float32: store interval variables in 32 bit floats, if all their values can be stored exactly; calculations
+                 still use 64 bit floats
+        If they are not set, csc.import_downcast and csc.import_float32 are used.
+
+        progress_callback: function called with the name of the actual stage during the import and the analyses (see
+                           _progress()); it may raise AnalysisCancelled to stop the running import or analysis
         """
 
-        self.orig_data_frame = None
-        self.data_frame = None
+        self._data = None  # the imported data; filtering does not copy it
+        self._filter_mask = None  # boolean array of the cases to keep, or None if filtering is off
+        self._filtered_frames = weakref.WeakValueDictionary()  # filtered data in use, see _filtered_columns()
         self.data_measlevs = None
         self.import_source = ''
         self.import_message = ''  # can't return anything to caller,
                                 #  since we're in an __init__ method, so store the message here
         self.filtering_status = None
+        self._data_version = 0  # increased whenever the data change; results computed earlier are invalid then
+        self._cache = cs_util.LRUCache(csc.analysis_cache_size)
+        self._column_catalog = {}  # properties of the variables of the current data, see _column_info()
+        self._ranks = None  # sort orders of the variables of the current data, see _rank_cache()
+        self.progress_callback = progress_callback
 
-        self._import_data(data=data, param_measurement_level=measurement_level.lower())
+        self._import_data(data=data, param_measurement_level=measurement_level.lower(),
+                          downcast=csc.import_downcast if downcast is None else downcast,
+                          float32=csc.import_float32 if float32 is None else float32)
 
     ### Import and handle the data ###
 
-    def _import_data(self, data='', param_measurement_level=''):
+    @property
+    def orig_data_frame(self):
+        return self._data
+
+    @property
+    def data_frame(self):
+        """The data with the filters applied.
+
+        With filtering, all variables are copied whenever this is called; the analyses use _filtered_columns().
+        """
+        return self._filtered_columns(self._data.columns)
+
+    @data_frame.setter
+    def data_frame(self, data_frame):
+        """Store new data; filtering is switched off."""
+        self._data = data_frame
+        self._filter_mask = None
+
+    def _filtered_column(self, var_name):
+        """Return a variable with the filters applied.
+
+        :param var_name: name of the variable
+        :return: pandas Series; the stored variable itself if filtering is off
+        """
+        column = self._data[var_name]
+        if self._filter_mask is None:
+            return column
+        column = column[self._filter_mask]
+        if column.dtype == 'category':  # values that do not occur in the filtered data are removed
+            column = column.cat.remove_unused_categories()
+        return column
+
+    def _filtered_columns(self, var_names):
+        """Return the variables needed by an analysis with the filters applied.
+
+        Only the rows of the listed variables are selected, and the filtered data are not kept after the analysis, so
+        the filtered data are never stored beside the whole imported data.
+
+        :param var_names: names of the variables (list of str)
+        :return: pandas DataFrame; the stored data without copying if filtering is off
+        """
+        if self._filter_mask is None:
+            return self._data
+        var_names = list(dict.fromkeys(var_names))  # drop the repeated names
+        data_frame = pd.DataFrame({var_name: self._filtered_column(var_name) for var_name in var_names},
+                                  columns=var_names)
+        self._filtered_frames[id(data_frame)] = data_frame  # so that _freeze() recognizes the data
+        return data_frame
+
+    def _import_data(self, data='', param_measurement_level='', downcast=False, float32=False):
 
         quotechar = '"'
 
-        def percent2float():
-            """ Convert x.x% str format to float in self.data_frame (pandas cannot handle this).
+        def percent2float(data_frame):
+            """ Convert x.x% str format to float in data_frame (pandas cannot handle this).
             """
-            # TODO A pandas expert could shorten this
-            for column in self.data_frame.columns:
-                if self.data_frame[column].dtype == 'object':
-                    selected_cells = self.data_frame[column].str.endswith('%')
+            for column in data_frame.columns:
+                if data_frame[column].dtype == 'object':
+                    # use  == True  to overcome the NaN values of the non-str cells
+                    selected_cells = data_frame[column].str.endswith('%') == True
                     if selected_cells.any():
-                        # use  selected_cells == True  to overcome the Nan indexes
-                        self.data_frame[column][selected_cells == True] = \
-                            self.data_frame[column][selected_cells == True].str.replace('%', '').astype('float')/100.0
+                        values = data_frame[column].copy()
+                        values[selected_cells] = values[selected_cells].str.replace('%', '').astype('float') / 100.0
                         try:
-                            self.data_frame[column] = self.data_frame[column].astype('float')
-                        except:
-                            pass
+                            data_frame[column] = values.astype('float')
+                        except ValueError:  # there are other strings in the variable, too
+                            data_frame[column] = values
+
+        def find_non_ascii_vars(data_frame, variables=()):
+            """ Return the string variables of data_frame that include non-ascii characters.
+            variables: variables to be checked, all variables are checked if empty
+            """
+            non_ascii_vars = []
+            for variable_name in (variables if variables else data_frame):
+                if data_frame[variable_name].dtype == 'object':  # check only string variables
+                    # Other values in the variable (numbers, e.g., converted percents, or booleans) are ascii anyway
+                    values = data_frame[variable_name].dropna().astype(str)
+                    # Only a mask of the values is created (Series.str.isascii() is available from pandas 3.0)
+                    ascii_values = values.str.isascii() if hasattr(values.str, 'isascii') else \
+                        values.map(str.isascii)
+                    if not ascii_values.all():
+                        non_ascii_vars.append(variable_name)
+            return non_ascii_vars
+
+        def downcast_integers(data_frame):
+            """ Store the integer variables of data_frame in the smallest possible integer type.
+            """
+            for column in data_frame.select_dtypes(include=['integer']).columns:
+                data_frame[column] = pd.to_numeric(data_frame[column], downcast='integer')
+
+        def store_float32(data_frame):
+            """ Store the interval float variables of data_frame in 32 bit floats, if all their values can be stored
+            exactly (e.g., integers with missing values, which are stored as floats).
+            """
+            for column in data_frame.select_dtypes(include=['float64']).columns:
+                if self.data_measlevs[column] in ['int', 'unk']:
+                    converted_values = data_frame[column].values.astype(np.float32)
+                    if np.array_equal(converted_values.astype(float), data_frame[column].values, equal_nan=True):
+                        data_frame[column] = converted_values
+
+        def count_lines(file_name):
+            """ Count the line breaks in a file without parsing it; used as an upper estimate of the number of cases.
+            """
+            line_n = 0
+            with open(file_name, 'rb') as f:
+                for block in iter(lambda: f.read(2**24), b''):
+                    line_n += block.count(b'\n')
+            return line_n + 1
+
+        def common_dtype(dtype1, dtype2):
+            """ Return the type that can store the values of both types, as pd.concat() would do.
+            """
+            if dtype1 == object or dtype2 == object or dtype1 == bool or dtype2 == bool:
+                return np.dtype(object)
+            return np.result_type(dtype1, dtype2)
+
+        def read_csv_in_chunks(file_name, skiprows):
+            """ Read a text file in chunks to limit the memory needed for large files.
+
+            The file is parsed once. Every chunk is preprocessed (percent conversion, non-ascii check, optional
+            downcasting) and is copied into column arrays allocated for the estimated number of cases, so the chunks are
+            not kept and concatenated. The type of a column is set by the first chunk, and it is widened only if a later
+            chunk needs it (e.g., missing values in an integer variable).
+            returns: data frame and the list of variables with non-ascii characters
+            """
+            read_params = {'delimiter': delimiter, 'quotechar': quotechar, 'skiprows': skiprows}
+            var_names = None
+            columns = []
+            case_n = 0
+            raw_dtypes = {}  # dtypes of the variables before the preprocessing, in all chunks
+            non_ascii_vars = []
+            for chunk in pd.read_csv(file_name, chunksize=csc.import_chunk_size, **read_params):
+                self._progress(_('Importing data'))
+                for column in chunk.columns:
+                    raw_dtypes.setdefault(column, set()).add(chunk[column].dtype == 'object')
+                for column in chunk.select_dtypes(include=['object']).columns:
+                    # Logical values with missing values are read as Python booleans; they are stored as strings
+                    if pd.api.types.infer_dtype(chunk[column], skipna=True) != 'string':
+                        chunk[column] = chunk[column].where(chunk[column].isna(), chunk[column].astype(str))
+                percent2float(chunk)
+                non_ascii_vars += find_non_ascii_vars(chunk, [var_name for var_name in chunk
+                                                              if var_name not in non_ascii_vars])
+                if downcast:
+                    downcast_integers(chunk)
+                if var_names is None:
+                    var_names = list(chunk.columns)
+                    allocated_n = max(count_lines(file_name), len(chunk))
+                    columns = [np.empty(allocated_n, dtype=chunk[var_name].dtype) for var_name in var_names]
+                if case_n + len(chunk) > len(columns[0]):  # the number of cases was underestimated
+                    allocated_n = 2 * (case_n + len(chunk))
+                    columns = [np.concatenate([column[:case_n], np.empty(allocated_n - case_n, dtype=column.dtype)])
+                               for column in columns]
+                for i, var_name in enumerate(var_names):
+                    values = chunk[var_name].values
+                    if values.dtype != columns[i].dtype:
+                        dtype = common_dtype(columns[i].dtype, values.dtype)
+                        if dtype != columns[i].dtype:
+                            column = np.empty(len(columns[i]), dtype=dtype)
+                            column[:case_n] = columns[i][:case_n]
+                            columns[i] = column
+                    columns[i][case_n:case_n + len(chunk)] = values
+                case_n += len(chunk)
+            if var_names is None:  # there are no cases in the file
+                data_frame = pd.read_csv(file_name, nrows=0, **read_params)
+            else:
+                data_frame = pd.DataFrame({var_name: column[:case_n] for var_name, column in zip(var_names, columns)},
+                                          columns=var_names, copy=False)
+            # Variables with numbers only in the first chunk but strings later should be strings in all cases, as if
+            # the whole file was read at once
+            for column in [column for column in raw_dtypes if len(raw_dtypes[column]) > 1]:
+                column_data = pd.read_csv(file_name, usecols=[list(data_frame.columns).index(column)], dtype=str,
+                                          **read_params)
+                column_data.columns = [column]
+                percent2float(column_data)
+                data_frame[column] = column_data[column]
+                non_ascii_vars += find_non_ascii_vars(data_frame, [column])
+            return data_frame, [var_name for var_name in data_frame if var_name in non_ascii_vars]
+
+        def import_cache_file_names(file_name):
+            """ Return the names of the data and the metadata files storing the imported file_name in the cache.
+
+            Data imported with different settings are stored in different files, so an entry is never overwritten
+            while another CogStatData uses its memory mapped data.
+            """
+            base_name = os.path.join(csc.import_cache_dir,
+                                     hashlib.sha1(os.path.abspath(file_name).encode('utf-8')).hexdigest())
+            if downcast:
+                base_name += '_downcast'
+            return base_name + '.feather', base_name + '.json'
+
+        def file_fingerprint(file_name):
+            """ Identify the current version of file_name with its modification time, size and a hash of its first
+            and last megabytes (hashing the whole file would be too slow for large files).
+            """
+            size = os.path.getsize(file_name)
+            file_hash = hashlib.sha1()
+            with open(file_name, 'rb') as f:
+                file_hash.update(f.read(2**20))
+                f.seek(max(size - 2**20, 0))
+                file_hash.update(f.read(2**20))
+            return {'source': os.path.abspath(file_name), 'mtime': os.path.getmtime(file_name), 'size': size,
+                    'hash': file_hash.hexdigest()}
+
+        def use_import_cache(file_name):
+            """ Check if file_name should be stored in or read from the import cache.
+            """
+            if not csc.import_cache or os.path.getsize(file_name) < csc.import_cache_min_size:
+                return False
+            try:
+                import pyarrow.feather
+            except ImportError:
+                return False
+            return True
+
+        def read_import_cache(file_name):
+            """ Read the preprocessed data of file_name from the import cache, if it is stored and is up to date.
+            returns: data frame, measurement level given in the file, list of variables with non-ascii characters
+                or None if the data are not available in the cache
+            """
+            if not use_import_cache(file_name):
+                return None
+            import pyarrow.feather
+            cache_data_file_name, cache_metadata_file_name = import_cache_file_names(file_name)
+            try:
+                with open(cache_metadata_file_name, 'r', encoding='utf-8') as f:
+                    metadata = json.load(f)
+                if metadata['fingerprint'] != file_fingerprint(file_name) or \
+                        metadata.get('cogstat_version') != csc.versions['cogstat']:
+                    # The file or the import has changed since the data were stored; the stale entry is removed
+                    remove_import_cache(cache_data_file_name, cache_metadata_file_name)
+                    return None
+                # The columns are stored in a single batch, so numerical columns without missing values are used
+                # directly from the memory mapped file (read-only), and only the other columns are copied
+                data_frame = pyarrow.feather.read_table(cache_data_file_name, memory_map=True).\
+                    to_pandas(split_blocks=True, self_destruct=True)
+                # The modification time of the metadata shows when the entry was used last, see prune_import_cache()
+                os.utime(cache_metadata_file_name)
+            except (OSError, ValueError, KeyError):
+                return None
+            # Missing strings are None in arrow, but NaN in CogStat
+            for column in data_frame.select_dtypes(include=['object']).columns:
+                data_frame[column] = data_frame[column].where(data_frame[column].notnull(), np.nan)
+            return data_frame, metadata['file_measurement_level'], metadata['non_ascii_vars']
+
+        def write_import_cache(file_name, file_measurement_level, non_ascii_vars):
+            """ Store the preprocessed self.data_frame of file_name in the import cache.
+            """
+            if not use_import_cache(file_name):
+                return
+            import pyarrow.feather
+            cache_data_file_name, cache_metadata_file_name = import_cache_file_names(file_name)
+            temp_file_names = []
+            try:
+                if not os.path.exists(csc.import_cache_dir):
+                    os.makedirs(csc.import_cache_dir)
+                # The files are written to temporary files and then they replace the earlier entry, so other
+                # CogStatData objects (or batch processes) that use the memory mapped earlier data keep their data,
+                # and the data and the metadata always belong together (the metadata are replaced last)
+                for suffix in ['.feather', '.json']:
+                    temp_file, temp_file_name = tempfile.mkstemp(suffix=suffix + '.tmp', dir=csc.import_cache_dir)
+                    os.close(temp_file)
+                    temp_file_names.append(temp_file_name)
+                # Uncompressed data in a single batch can be memory mapped without copying
+                pyarrow.feather.write_feather(self.data_frame, temp_file_names[0], compression='uncompressed',
+                                              chunksize=max(len(self.data_frame), 1))
+                with open(temp_file_names[1], 'w', encoding='utf-8') as f:
+                    json.dump({'fingerprint': file_fingerprint(file_name),
+                               'file_measurement_level': file_measurement_level, 'non_ascii_vars': non_ascii_vars,
+                               'cogstat_version': csc.versions['cogstat']}, f)
+                os.replace(temp_file_names[0], cache_data_file_name)
+                os.replace(temp_file_names[1], cache_metadata_file_name)
+            except Exception as e:  # e.g., variables with mixed types cannot be stored; the import itself is fine
+                logging.info('The imported data could not be stored in the cache: %s' % e)
+                for temp_file_name in temp_file_names:
+                    if os.path.exists(temp_file_name):
+                        os.remove(temp_file_name)
+            prune_import_cache()
+
+        def remove_import_cache(cache_data_file_name, cache_metadata_file_name):
+            """ Remove an entry from the import cache.
+            """
+            for cache_file_name in [cache_metadata_file_name, cache_data_file_name]:
+                try:
+                    os.remove(cache_file_name)
+                except OSError:
+                    pass
+
+        def prune_import_cache():
+            """ Keep the import cache within csc.import_cache_max_size bytes and csc.import_cache_max_age days.
+
+            The least recently used entries are removed first. Temporary files of interrupted writes are removed after
+            a day (they may belong to an import that is running in another process).
+            """
+            try:
+                cache_file_names = [os.path.join(csc.import_cache_dir, cache_file_name) for cache_file_name
+                                    in os.listdir(csc.import_cache_dir)]
+            except OSError:
+                return
+            for temp_file_name in [name for name in cache_file_names if name.endswith('.tmp')]:
+                try:
+                    if os.path.getmtime(temp_file_name) < time.time() - 24 * 60 * 60:
+                        os.remove(temp_file_name)
+                except OSError:
+                    pass
+            metadata_file_names = [name for name in cache_file_names if name.endswith('.json')]
+            entries = []  # last use, size, data file name, metadata file name
+            for metadata_file_name in metadata_file_names:
+                data_file_name = metadata_file_name[:-len('.json')] + '.feather'
+                try:
+                    entries.append((os.path.getmtime(metadata_file_name),
+                                    os.path.getsize(data_file_name) + os.path.getsize(metadata_file_name),
+                                    data_file_name, metadata_file_name))
+                except OSError:  # incomplete entry
+                    remove_import_cache(data_file_name, metadata_file_name)
+            oldest_use = time.time() - csc.import_cache_max_age * 24 * 60 * 60
+            cache_size = sum(entry[1] for entry in entries)
+            for last_use, size, data_file_name, metadata_file_name in sorted(entries):
+                if cache_size <= csc.import_cache_max_size and last_use >= oldest_use:
+                    break
+                remove_import_cache(data_file_name, metadata_file_name)
+                cache_size -= size
+
+        def read_sav(file_name):
+            """ Read an SPSS .sav file.
+
+            The cases are read in batches, and they are filled into typed column arrays, so the data are never stored
+            as a list of Python rows.
+            returns: data frame and the measurement levels of the variables
+            """
+            import savReaderWriter
+            # Get the variable names, types (0 for numeric, string length for string variables) and measurement levels
+            with savReaderWriter.SavHeaderReader(file_name, ioUtf8=True) as header:
+                metadata = header.all()
+            # Convert SPSS measurement levels to CogStat
+            spss_to_cogstat_measurement_levels = {'unknown': 'unk', 'nominal': 'nom', 'ordinal': 'ord', 'scale': 'int',
+                                                  'ratio': 'int', 'flag': 'nom', 'typeless': 'unk'}
+            measurement_level = ' '.join([spss_to_cogstat_measurement_levels[metadata.measureLevels[spss_var]]
+                                          for spss_var in metadata.varNames])
+            dtypes = [object if metadata.varTypes[spss_var] else float for spss_var in metadata.varNames]
+
+            # Get the values
+            with savReaderWriter.SavReader(file_name, ioUtf8=True) as reader:
+                case_n = reader.shape.nrows
+                cases = iter(reader)
+                if case_n >= 0:  # the number of cases is known, the columns can be allocated in advance
+                    columns = [np.empty(case_n, dtype=dtype) for dtype in dtypes]
+                else:  # the batches are concatenated at the end
+                    batches = [[] for dtype in dtypes]
+                read_case_n = 0
+                for batch in iter(lambda: list(itertools.islice(cases, csc.import_chunk_size)), []):
+                    self._progress(_('Importing data'))
+                    # missing numbers are None in the batch; they are converted to NaN in the float arrays
+                    batch_columns = [np.array(values, dtype=dtype) for values, dtype in zip(zip(*batch), dtypes)]
+                    if case_n >= 0:
+                        for column, batch_column in zip(columns, batch_columns):
+                            column[read_case_n:read_case_n + len(batch)] = batch_column
+                    else:
+                        for column_batches, batch_column in zip(batches, batch_columns):
+                            column_batches.append(batch_column)
+                    read_case_n += len(batch)
+            if case_n < 0:
+                columns = [np.concatenate(column_batches) if column_batches else np.empty(0, dtype=dtype)
+                           for column_batches, dtype in zip(batches, dtypes)]
+            data_frame = pd.DataFrame(dict(zip(metadata.varNames, columns)), columns=metadata.varNames)
+            return data_frame, measurement_level
 
         def set_measurement_level(measurement_level=''):
             """ Create self.data_measlevs
@@ -181,9 +550,11 @@ class CogStatData:
                                        + '<default>'
 
         file_measurement_level = ''
+        non_ascii_vars = None  # if it is set during the import, the data are already preprocessed
+        cache_file_name = None  # if it is set, the preprocessed data will be stored in the import cache
         # Import from pandas DataFrame
         if isinstance(data, pd.DataFrame):
-            self.data_frame = data
+            self.data_frame = data.copy()  # the import converts the variables in place; keep the caller's data intact
             self.import_source = _('pandas dataframe')
         elif isinstance(data, str):
 
@@ -193,8 +564,14 @@ class CogStatData:
             # Import from file
             if not ('\n' in data):  # Single line text, i.e., filename
                 filetype = data[data.rfind('.'):]
+                cached_import = read_import_cache(data) if filetype in ['.txt', '.csv', '.log', '.tsv', '.sav'] \
+                    else None
+                # Import the data from the cache
+                if cached_import:
+                    self.data_frame, file_measurement_level, non_ascii_vars = cached_import
+                    self.import_source = (_('SPSS file - ') if filetype == '.sav' else _('text file - ')) + data
                 # Import csv file
-                if filetype in ['.txt', '.csv', '.log', '.tsv']:
+                elif filetype in ['.txt', '.csv', '.log', '.tsv']:
                     # Check if the file exists # TODO
                     # self.import_source = _('Import failed')
                     # return
@@ -209,23 +586,14 @@ class CogStatData:
                     skiprows = [1] if file_measurement_level else None
 
                     # Read the file
-                    self.data_frame = pd.read_csv(data, delimiter=delimiter, quotechar=quotechar, skiprows=skiprows)
+                    self.data_frame, non_ascii_vars = read_csv_in_chunks(data, skiprows)
                     self.import_source = _('text file - ')+data  # filename
+                    cache_file_name = data
                 # Import SPSS .sav file
                 elif filetype == '.sav':
-                    import savReaderWriter
-                    # Get the values
-                    with savReaderWriter.SavReader(data, ioUtf8=True) as reader:
-                        spss_data = [line for line in reader]
-                    # Get the variable names and measurement levels
-                    with savReaderWriter.SavHeaderReader(data, ioUtf8=True) as header:
-                        metadata = header.all()
-                    # Create the CogStat dataframe
-                    self.data_frame = pd.DataFrame.from_records(spss_data, columns=metadata.varNames)
-                    # Convert SPSS measurement levels to CogStat
-                    spss_to_cogstat_measurement_levels = {'unknown': 'unk', 'nominal': 'nom', 'ordinal': 'ord', 'scale': 'int', 'ratio': 'int', 'flag': 'nom', 'typeless': 'unk'}
-                    file_measurement_level = ' '.join([spss_to_cogstat_measurement_levels[metadata.measureLevels[spss_var]] for spss_var in metadata.varNames])
+                    self.data_frame, file_measurement_level = read_sav(data)
                     self.import_source = _('SPSS file - ') + data  # filename
+                    cache_file_name = data
 
             # Import from multiline string, clipboard
             else:  # Multi line text, i.e., clipboard data
@@ -252,7 +620,13 @@ class CogStatData:
             return
 
         # Set other details for all import sources
-        percent2float()
+        if non_ascii_vars is None:
+            percent2float(self.data_frame)
+            # Check for unicode chars in the data to warn user not to use it
+            # TODO this might be removed with Python3 and with unicode encoding
+            non_ascii_vars = find_non_ascii_vars(self.data_frame)
+        if cache_file_name:
+            write_import_cache(cache_file_name, file_measurement_level, non_ascii_vars)
         # Convert boolean variables to string
         # True and False values should be imported as string, not as boolean - CogStat does not know boolean variables
         # Although this solution changes upper and lower cases: independent of the text, it will be 'True' and 'False'
@@ -261,21 +635,18 @@ class CogStatData:
         set_measurement_level(measurement_level=
                               (param_measurement_level if param_measurement_level else file_measurement_level))
                             # param_measurement_level overwrites file_measurement_level
-
-        # Check for unicode chars in the data to warn user not to use it
-        # TODO this might be removed with Python3 and with unicode encoding
-        non_ascii_var_names = []
-        non_ascii_vars = []
-        for variable_name in self.data_frame:
-            if not all(ord(char) < 128 for char in variable_name):  # includes non ascii char
-                non_ascii_var_names.append(variable_name)
-            if self.data_frame[variable_name].dtype == 'object':  # check only string variables
-                for ind_data in self.data_frame[variable_name]:
-                    if not(ind_data != ind_data) and not (isinstance(ind_data, bool)):
-                            # if not NaN, otherwise the next condition is invalid and if not boolean
-                        if not all(ord(char) < 128 for char in ind_data):
-                            non_ascii_vars.append(variable_name)
-                            break  # after finding the first non-ascii data, we can leave the variable
+        # Store the nominal string variables as integer codes with a table of the values (pandas categorical)
+        for var_name in self.data_frame.columns:
+            if self.data_measlevs[var_name] == 'nom' and self.data_frame[var_name].dtype == 'object':
+                self.data_frame[var_name] = self.data_frame[var_name].astype('category')
+        # Store the numerical variables in smaller types, if requested
+        if downcast:
+            downcast_integers(self.data_frame)
+        if float32:
+            store_float32(self.data_frame)
+
+        non_ascii_var_names = [variable_name for variable_name in self.data_frame
+                               if not all(ord(char) < 128 for char in variable_name)]  # includes non ascii char
         if non_ascii_var_names:
             self.import_message += '\n<warning>' + \
                                    _('Some variable name(s) include non-English characters, which will cause problems in some analyses: %s.') \
@@ -293,34 +664,38 @@ class CogStatData:
                                    % 'https://github.com/cogstat/cogstat/wiki/Handling-data' \
                                    + '<default>'
 
-        self.orig_data_frame = self.data_frame.copy()
+        self._data_changed()
 
         # Add keys with pyqt string form, too, because UI returns variable names in this form
         # TODO do we still need this?
-        from PyQt5 import QtCore
         for var_name in self.data_frame.columns:
             self.data_measlevs[QString(var_name)] = self.data_measlevs[var_name]
 
     def print_data(self, brief=False):
         """Print data."""
+        data_frame = self.data_frame
         output = csc.heading_style_begin + _('Data')+csc.heading_style_end
         output += '<default>'+_('Source: ') + self.import_source + '\n'
-        output += str(len(self.data_frame.columns))+_(' variables and ') + \
-                  str(len(self.data_frame.index))+_(' cases') + '\n'
+        output += str(len(data_frame.columns))+_(' variables and ') + \
+                  str(len(data_frame.index))+_(' cases') + '\n'
         output += self._filtering_status()
 
-        dtype_convert = {'int32': 'num', 'int64': 'num', 'float32': 'num', 'float64': 'num', 'object': 'str'}
-        data_prop = pd.DataFrame([[dtype_convert[str(self.data_frame[name].dtype)] for name in self.data_frame.columns],
-                                  [self.data_measlevs[name] for name in self.data_frame.columns]],
-                                 columns=self.data_frame.columns)
-        data_comb = pd.concat([data_prop, self.data_frame])
-        data_comb.index = [_('Type'), _('Level')]+[' ']*len(self.data_frame)
+        dtype_convert = {'int8': 'num', 'int16': 'num', 'int32': 'num', 'int64': 'num', 'float32': 'num', 'float64': 'num',
+                         'object': 'str'}
+        # for nominal variables the type of the values is shown
+        data_prop = pd.DataFrame([[dtype_convert[str(data_frame[name].cat.categories.dtype)
+                                                 if self._column_info(name, 'dtype') == 'category' else
+                                                 self._column_info(name, 'dtype')] for name in data_frame.columns],
+                                  [self.data_measlevs[name] for name in data_frame.columns]],
+                                 columns=data_frame.columns)
+        data_comb = pd.concat([data_prop, data_frame])
+        data_comb.index = [_('Type'), _('Level')]+[' ']*len(data_frame)
         output += cs_stat._format_html_table(data_comb[:12 if brief else 1001].to_html(bold_rows=False))
-        if brief and (len(self.data_frame.index) > 10):
-            output += str(len(self.data_frame.index)-10) + _(' further cases are not displayed...')+'\n'
-        if len(self.data_frame.index) > 999:
+        if brief and (len(data_frame.index) > 10):
+            output += str(len(data_frame.index)-10) + _(' further cases are not displayed...')+'\n'
+        if len(data_frame.index) > 999:
             output += _('You probably would not want to print the next %s cases...') % \
-                      (len(self.data_frame.index)-1000) + '\n'
+                      (len(data_frame.index)-1000) + '\n'
 
         return self._convert_output([output+'<default>'])
 
@@ -330,42 +705,68 @@ class CogStatData:
         :param var_names: list of name of the variable the exclusion is based on (list of str)
                         or None to include all cases
         :param mode: mode of the exclusion (str)
-                only 2sd is available at the moment
+                '2sd': cases more than 2 SD away from the mean in any of the variables
+                'mad': cases more than 2.5 MAD away from the median in any of the variables
+                'iqr': cases more than 1.5 IQR away from the quartiles in any of the variables
+                'mahalanobis': cases with too large Mahalanobis distance based on all the variables (p < 0.001)
+                Cases with missing values in the variables are excluded.
         :return:
         """
+        mode_names = {'2sd': _(' (2 SD)'), 'mad': _(' (MAD)'), 'iqr': _(' (IQR)'),
+                      'mahalanobis': _(' (Mahalanobis distance)')}
+        if mode not in mode_names:
+            raise ValueError('Unknown outlier mode: %s' % mode)
+
+        def excluded_cases_text(filter_mask):
+            """Display the excluded cases, but only the first few of them."""
+            excluded_cases = self.orig_data_frame[~filter_mask]
+            #excluded_cases.index = [' '] * len(excluded_cases)  # TODO can we cut the indexes from the html table?
+            # TODO uncomment the above line after using pivot indexes in CS data
+            if len(excluded_cases):
+                text = _('The following cases will be excluded: ')
+                text += cs_stat._format_html_table(excluded_cases[:csc.filter_report_max_cases].
+                                                   to_html(bold_rows=False), add_style=False)
+                if len(excluded_cases) > csc.filter_report_max_cases:
+                    text += str(len(excluded_cases) - csc.filter_report_max_cases) + \
+                            _(' further cases are not displayed...') + '\n'
+            else:
+                text = _('No cases were excluded.') + '\n'
+            return text
+
         title = csc.heading_style_begin + _('Filtering')+csc.heading_style_end
         if var_names is None:  # Switch off outlier filtering
-            self.data_frame = self.orig_data_frame.copy()
+            self._filter_mask = None
             self.filtering_status = None
             text_output = _('Filtering is switched off.')
-        else:  # Create a filtered dataframe based on the variable
-            filtered_data_indexes = []
+        else:  # Create a filtered dataframe based on the variables
+            # The earlier filter is switched off, so that the properties of the variables are those of all the cases
+            self._filter_mask = None
+            self._data_changed()
             text_output = ''
-            self.filtering_status = ''
-            for var_name in var_names:
-                # Currently only this simple method is used: cases with more than 2 SD difference are excluded
-                mean = np.mean(self.orig_data_frame[var_name].dropna())
-                sd = np.std(self.orig_data_frame[var_name].dropna(), ddof=1)
-                filtered_data_indexes.append(self.orig_data_frame[
-                    (self.orig_data_frame[var_name] < (mean + 2 * sd)) &
-                    (self.orig_data_frame[var_name] > (mean - 2 * sd))].index)
-                text_output += _('Filtering based on %s.\n') % (var_name + _(' (2 SD)'))
-                prec = cs_util.precision(self.orig_data_frame[var_name])+1
-                text_output += _('Cases outside of the range will be excluded: %0.*f  --  %0.*f\n') % \
-                               (prec, mean - 2 * sd, prec, mean + 2 * sd)
-                excluded_cases = \
-                    self.orig_data_frame.loc[self.orig_data_frame.index.difference(filtered_data_indexes[-1])]
-                #excluded_cases.index = [' '] * len(excluded_cases)  # TODO can we cut the indexes from the html table?
-                # TODO uncomment the above line after using pivot indexes in CS data
-                if len(excluded_cases):
-                    text_output += _('The following cases will be excluded: ')
-                    text_output += cs_stat._format_html_table(excluded_cases.to_html(bold_rows=False), add_style=False)
-                else:
-                    text_output += _('No cases were excluded.') + '\n'
-            self.data_frame = self.orig_data_frame.copy()
-            for filtered_data_index in filtered_data_indexes:
-                self.data_frame = self.data_frame.reindex(self.data_frame.index.intersection(filtered_data_index))
-            self.filtering_status = ', '.join(var_names) + _(' (2 SD)')
+            data = self.orig_data_frame[var_names].values.astype(float)
+            if mode == 'mahalanobis':
+                distances = cs_stat_num.mahalanobis_distance(data)
+                critical_distance = stats.chi2.ppf(0.999, len(var_names))
+                with np.errstate(invalid='ignore'):  # cases with missing values are excluded
+                    filter_masks = [distances < critical_distance]
+                text_output += _('Filtering based on %s.\n') % (', '.join(var_names) + mode_names[mode])
+                text_output += _('Cases with squared Mahalanobis distance above %0.3f will be excluded.\n') % \
+                               critical_distance
+                text_output += excluded_cases_text(filter_masks[0])
+            else:
+                lower_limits, upper_limits = cs_stat_num.outlier_limits(data, mode)
+                with np.errstate(invalid='ignore'):  # cases with missing values are excluded
+                    filter_masks = list(((data > lower_limits) & (data < upper_limits)).T)
+                for var_name, lower_limit, upper_limit, filter_mask in zip(var_names, lower_limits, upper_limits,
+                                                                          filter_masks):
+                    text_output += _('Filtering based on %s.\n') % (var_name + mode_names[mode])
+                    prec = self._column_info(var_name, 'precision')+1
+                    text_output += _('Cases outside of the range will be excluded: %0.*f  --  %0.*f\n') % \
+                                   (prec, lower_limit, prec, upper_limit)
+                    text_output += excluded_cases_text(filter_mask)
+            self._filter_mask = np.logical_and.reduce(filter_masks)
+            self.filtering_status = ', '.join(var_names) + mode_names[mode]
+        self._data_changed()
             # TODO Add graph about the excluded cases based on the variable
 
         return self._convert_output([title, text_output])
@@ -388,14 +789,16 @@ class CogStatData:
         def _figure_to_qimage(figure):
             """Convert matplotlib figure to pyqt qImage.
             """
+            from PyQt5 import QtGui  # PyQt is needed only with the GUI
+            # Render the figure in the resolution of the screen
+            figure.set_dpi(rcParams['figure.dpi']*app_devicePixelRatio)
             figure.canvas.draw()
-            size_x, size_y = figure.get_size_inches()*rcParams['figure.dpi']
-            # TODO is it better to use figure.canvas.width(), figure.canvas.height()
+            size_x, size_y = figure.canvas.get_width_height()  # size of the rendered image in pixels
             if LooseVersion(csc.versions['matplotlib']) < LooseVersion('1.2'):
                 string_buffer = figure.canvas.buffer_rgba(0, 0)
             else:
                 string_buffer = figure.canvas.buffer_rgba()
-            qimage = QtGui.QImage(string_buffer, size_x*app_devicePixelRatio, size_y*app_devicePixelRatio, QtGui.QImage.Format_ARGB32).rgbSwapped().copy()
+            qimage = QtGui.QImage(string_buffer, size_x, size_y, QtGui.QImage.Format_ARGB32).rgbSwapped().copy()
             QtGui.QImage.setDevicePixelRatio(qimage, app_devicePixelRatio)
             return qimage
                 # I couldn't see it documented, but seemingly the figure uses BGR, not RGB coding
@@ -422,6 +825,103 @@ class CogStatData:
 
     ### Various things ###
 
+    def _data_changed(self):
+        """Invalidate the stored results after the data have changed."""
+        self._data_version += 1
+        self._cache.clear()
+        self._column_catalog.clear()
+        self._ranks = None
+
+    def _column_info(self, var_name, item):
+        """Return a property of a variable of the current data.
+
+        The properties are computed when they are first needed, and they are kept until the data change.
+
+        :param var_name: name of the variable
+        :param item: 'dtype', 'valid_n', 'missing_n', 'unique_n' (number of different values, missing values excluded),
+            'precision' (see cs_util.precision())
+        :return: the property
+        """
+        catalog = self._column_catalog.setdefault(var_name, {})
+        if item not in catalog:
+            data = self._filtered_column(var_name)
+            if item == 'dtype':
+                catalog[item] = str(data.dtype)
+            elif item == 'valid_n':
+                catalog[item] = int(data.count())
+            elif item == 'missing_n':
+                catalog[item] = len(data) - self._column_info(var_name, 'valid_n')
+            elif item == 'unique_n':
+                catalog[item] = int(data.nunique())
+            elif item == 'precision':
+                catalog[item] = cs_util.precision(data)
+            else:
+                raise ValueError('Unknown column property: %s' % item)
+        return catalog[item]
+
+    def _rank_cache(self, data_frame):
+        """Return the sort orders and ranks of the variables of the current data.
+
+        The variables are sorted when their ranks are first needed, and the sort orders are kept until the data change,
+        so the rank-based tests and charts do not sort the same variable again.
+
+        :param data_frame: the data of the analysis (see _filtered_columns()); all of them include the same cases, so
+            the stored sort orders are valid for any of them
+        :return: cs_stat_num.RankCache
+        """
+        if self._ranks is None:
+            self._ranks = cs_stat_num.RankCache(data_frame)
+        else:
+            self._ranks.pdf = data_frame
+        return self._ranks
+
+    def _freeze(self, value):
+        """Convert an argument of an analysis function into a hashable key.
+
+        The current data and their rank cache are represented by the data version, and the results stored in the cache
+        (e.g., frequencies passed to the functions displaying them) by their own key. Other data frames cannot be part
+        of the key, in this case TypeError is raised.
+        """
+        if value is self._data or self._filtered_frames.get(id(value)) is value:
+            return 'data_frame', self._data_version
+        elif value is self._ranks and value is not None:
+            return 'rank_cache', self._data_version
+        elif isinstance(value, (tuple, list, dict, pd.DataFrame, pd.Series, np.ndarray)) and \
+                self._cache.key_of(value) is not None:
+            return 'result', self._cache.key_of(value)
+        elif isinstance(value, dict):
+            return tuple(sorted((key, self._freeze(item)) for key, item in value.items()))
+        elif isinstance(value, (list, tuple)):
+            return tuple(self._freeze(item) for item in value)
+        elif isinstance(value, (pd.DataFrame, pd.Series, np.ndarray)):
+            raise TypeError('Data other than the current data cannot be part of the key')
+        hash(value)
+        return value
+
+    def _cached(self, function, *args, **kwargs):
+        """Run function(*args, **kwargs), or return its earlier result for the same arguments and the same data.
+
+        Results (split groups, descriptives, test results, charts) are stored in an LRU cache, so repeated or
+        overlapping analyses do not compute them again. Results must not be modified by the caller.
+        """
+        try:
+            key = (function.__module__, function.__name__, self._freeze(args), self._freeze(kwargs))
+        except TypeError:  # arguments that cannot be part of the key, e.g., a subset of the data
+            return function(*args, **kwargs)
+        if key not in self._cache:
+            self._cache[key] = function(*args, **kwargs)
+        return self._cache[key]
+
+    def _progress(self, stage):
+        """Report the stage of the running import or analysis to the progress callback.
+
+        The callback may raise AnalysisCancelled, which stops the import or the analysis.
+
+        :param stage: name of the stage (str)
+        """
+        if self.progress_callback is not None:
+            self.progress_callback(stage)
+
     def _meas_lev_vars(self, variables):
         """
         arguments:
@@ -464,7 +964,7 @@ class CogStatData:
         :param central_value: Test central tendency value (float)
         :return:
         """
-        plt.close('all')
+        data_frame = self._filtered_columns([var_name])
         meas_level, unknown_type = self._meas_lev_vars([var_name])
         result_list = [csc.heading_style_begin + _('Explore variable')+csc.heading_style_end]
         result_list.append(_('Exploring variable: ') + var_name + ' (%s)\n'%meas_level)
@@ -472,44 +972,60 @@ class CogStatData:
             result_list[-1] += self._filtering_status()
 
         # 1. Raw data
+        self._progress(_('Raw data'))
         text_result = '<h4>'+_('Raw data')+'</h4>'
-        text_result2, image = cs_stat.display_variable_raw_data(self.data_frame, self.data_measlevs, var_name)
+        # The frequencies are counted once for the frequency table and for the frequency chart of nominal variables
+        freqs = self._cached(cs_stat_num.frequencies, data_frame, var_name) \
+            if frequencies or self.data_measlevs[var_name] == 'nom' else None
+        text_result2, image = self._cached(cs_stat.display_variable_raw_data,
+                                           data_frame, self.data_measlevs, var_name,
+                                           rank_cache=self._rank_cache(data_frame), freqs=freqs,
+                                           valid_n=self._column_info(var_name, 'valid_n'),
+                                           missing_n=self._column_info(var_name, 'missing_n'))
         result_list.append(text_result+text_result2)
         result_list.append(image)
 
         # 2. Sample properties
+        self._progress(_('Sample properties'))
         text_result = '<h4>\n'+_('Sample properties')+'</h4>\n'
 
         # Frequencies
         if frequencies:
             text_result += '<b>'+_('Frequencies')+'</b>\n'
-            text_result += cs_stat.frequencies(self.data_frame, var_name, meas_level) + '\n\n'
+            text_result += self._cached(cs_stat.frequencies, data_frame, var_name, meas_level, freqs) + '\n\n'
 
         # Descriptives
         if self.data_measlevs[var_name] != 'nom':  # there is no descriptive for nominal variable here
             if self.data_measlevs[var_name] in ['int', 'unk']:
-                text_result += cs_stat.print_var_stats(self.data_frame, [var_name],
-                                                       statistics=['mean', 'std', 'skew', 'kurtosis', 'ptp',
-                                                                   'amax', 'upper_quartile', 'median', 'lower_quartile', 'amin'])
+                text_result += self._cached(cs_stat.print_var_stats, data_frame, [var_name],
+                                            statistics=['mean', 'std', 'skew', 'kurtosis', 'ptp',
+                                            'amax', 'upper_quartile', 'median', 'lower_quartile', 'amin'],
+                                            precs=[self._column_info(name, 'precision') for name in [var_name]])
             elif self.data_measlevs[var_name] == 'ord':
-                text_result += cs_stat.print_var_stats(self.data_frame, [var_name],
-                                                       statistics=['amax', 'upper_quartile', 'median', 'lower_quartile', 'amin'])
+                text_result += self._cached(cs_stat.print_var_stats, data_frame, [var_name],
+                                            statistics=['amax', 'upper_quartile', 'median', 'lower_quartile', 'amin'],
+                                            precs=[self._column_info(name, 'precision') for name in [var_name]])
             # TODO boxplot also
         result_list.append(text_result)
 
         # Distribution
         if self.data_measlevs[var_name] != 'nom': # histogram for nominal variable has already been shown in raw data
-            image = cs_chart.create_histogram_chart(self.data_frame, self.data_measlevs, var_name)
+            image = self._cached(cs_chart.create_histogram_chart, data_frame, self.data_measlevs, var_name,
+                                 rank_cache=self._rank_cache(data_frame),
+                                 unique_n=self._column_info(var_name, 'unique_n'))
             result_list.append(image)
 
         # 3. Population properties
+        self._progress(_('Population properties'))
         text_result = '<h4>\n'+_('Population properties')+'</h4>\n'
 
         # Normality
         if meas_level in ['int', 'unk']:
             text_result += '<b>'+_('Normality')+'</b>\n'
-            stat_result, text_result2, image, image2 = cs_stat.normality_test(self.data_frame, self.data_measlevs,
-                                                                              var_name)
+            stat_result, text_result2, image, image2 = self._cached(cs_stat.normality_test,
+                                                                    data_frame, self.data_measlevs,
+                                                                    var_name, charts=True,
+                                                                    unique_n=self._column_info(var_name, 'unique_n'))
             text_result += text_result2
             result_list.append(text_result)
             if image:
@@ -521,13 +1037,13 @@ class CogStatData:
 
         # Test central tendency
         if meas_level in ['int', 'ord', 'unk']:
-            prec = cs_util.precision(self.data_frame[var_name]) + 1
+            prec = self._column_info(var_name, 'precision') + 1
 
         if meas_level in ['int', 'unk']:
             population_param_text = '\n<b>'+_('Population parameter estimations and tests')+'</b>\n'
             # Calculations are below, after the normality test
         elif meas_level == 'ord':
-            population_param_text = _('Median: %0.*f') % (prec, np.median(self.data_frame[var_name].dropna())) + '\n'
+            population_param_text = _('Median: %0.*f') % (prec, np.median(data_frame[var_name].dropna())) + '\n'
         else:
             population_param_text = ''
         text_result = '\n'
@@ -545,34 +1061,37 @@ class CogStatData:
                                'Choosing one-sample t-test or Wilcoxon signed-rank test depending on the assumption.') + \
                            '<default>\n'
             text_result += '<decision>' + _('Checking for normality.') + '\n<default>'
-            norm, text_result_norm, graph_dummy, graph2_dummy = cs_stat.normality_test(self.data_frame,
-                                                                                       self.data_measlevs, var_name)
+            norm, text_result_norm, graph_dummy, graph2_dummy = \
+                self._cached(cs_stat.normality_test, data_frame, self.data_measlevs, var_name,
+                             unique_n=self._column_info(var_name, 'unique_n'))
             text_result += text_result_norm
             if norm:
                 text_result += '<decision>' + _('Normality is not violated.') + ' >> ' + \
                                _('Running one-sample t-test.') + '<default>\n'
                 pdf_result = pd.DataFrame(columns=[_('Point estimation'), _('95% confidence interval')])
-                pdf_result.loc[_('Mean'), _('Point estimation')] = ('%0.*f') % (prec, np.mean(self.data_frame[var_name].dropna()))
-                ci_text, text_result2, graph = cs_stat.one_t_test(self.data_frame, self.data_measlevs, var_name,
-                                                         test_value=central_value)
+                pdf_result.loc[_('Mean'), _('Point estimation')] = ('%0.*f') % (prec, np.mean(data_frame[var_name].dropna()))
+                ci_text, text_result2, graph = cs_stat.one_t_test(data_frame, self.data_measlevs, var_name,
+                                                         test_value=central_value,
+                                                         prec=self._column_info(var_name, 'precision'),
+                                                         unique_n=self._column_info(var_name, 'unique_n'))
                 pdf_result.loc[_('Mean'), _('95% confidence interval')] = ci_text
                 pdf_result.loc[_('Standard deviation')] = \
-                    [('%0.*f') % (prec, np.std(self.data_frame[var_name].dropna(), ddof=1)), '']
+                    [('%0.*f') % (prec, np.std(data_frame[var_name].dropna(), ddof=1)), '']
                 population_param_text += cs_stat._format_html_table(pdf_result.to_html(bold_rows=False))
                 population_param_text += '\n\n'
 
             else:
                 text_result += '<decision>' + _('Normality is violated.') + ' >> ' + \
                                _('Running Wilcoxon signed-rank test.') + '<default>\n'
-                text_result += _('Median: %0.*f') % (prec, np.median(self.data_frame[var_name].dropna())) + '\n'
-                text_result2, graph = cs_stat.wilcox_sign_test(self.data_frame, self.data_measlevs, var_name,
+                text_result += _('Median: %0.*f') % (prec, np.median(data_frame[var_name].dropna())) + '\n'
+                text_result2, graph = cs_stat.wilcox_sign_test(data_frame, self.data_measlevs, var_name,
                                                                value=central_value)
 
         elif meas_level == 'ord':
             text_result += '<decision>' + _('Ordinal variable.') + ' >> ' + _(
                 'Running Wilcoxon signed-rank test.') + \
                            '<default>\n'
-            text_result2, graph = cs_stat.wilcox_sign_test(self.data_frame, self.data_measlevs, var_name,
+            text_result2, graph = cs_stat.wilcox_sign_test(data_frame, self.data_measlevs, var_name,
                                                            value=central_value)
         else:
             text_result2 = '<decision>' + _('Sorry, not implemented yet.') + '<default>\n'
@@ -592,7 +1111,7 @@ class CogStatData:
         :param y: name of y variable (str)
         :return:
         """
-        plt.close('all')
+        data_frame = self._filtered_columns([x, y])
         meas_lev, unknown_var = self._meas_lev_vars([x, y])
         title = csc.heading_style_begin + _('Explore relation of variable pair') + csc.heading_style_end
         raw_result = _('Exploring variable pair: ') + x + ' (%s), '%self.data_measlevs[x] + y + ' (%s)\n'%self.data_measlevs[y]
@@ -601,22 +1120,26 @@ class CogStatData:
             raw_result += '<decision>'+warn_unknown_variable+'\n<default>'
 
         # 1. Raw data
+        self._progress(_('Raw data'))
         raw_result += '<h4>'+_('Raw data')+'</h4>'
         # Prepare data, drop missing data
         # TODO are NaNs interesting in nominal variables?
-        data = self.data_frame[[x, y]].dropna()
+        data = data_frame[[x, y]].dropna()
+        valid_pairs = data_frame[[x, y]].notna().all(axis=1).values
+        rank_cache = self._rank_cache(data_frame)
         valid_n = len(data)
-        missing_n = len(self.data_frame[[x, y]]) - valid_n
+        missing_n = len(data_frame[[x, y]]) - valid_n
         raw_result += _('N of valid pairs') + ': %g' % valid_n + '\n'
         raw_result += _('N of missing pairs') + ': %g' % missing_n + '\n'
 
         # Raw data chart
-        temp_raw_result = cs_stat.var_pair_contingency_table(meas_lev, x, y, self.data_frame)
-        raw_graph = cs_chart.create_variable_pair_chart(data, meas_lev, 0, 0, x, y, self.data_frame,
+        temp_raw_result = cs_stat.var_pair_contingency_table(meas_lev, x, y, data_frame)
+        raw_graph = cs_chart.create_variable_pair_chart(data, meas_lev, 0, 0, x, y, data_frame,
                                                          raw_data=True)  # slope and intercept are set to 0, but they
                                                                          # are not used with raw_data
 
         # 2-3. Sample and population properties
+        self._progress(_('Sample properties'))
         sample_result = '<h4>'+_('Sample properties')+'</h4>'
         if temp_raw_result:
             sample_result += temp_raw_result
@@ -645,7 +1168,8 @@ class CogStatData:
             # TODO output with the precision of the data
             sample_result += _('Linear regression')+': y = %0.3fx + %0.3f' % (slope, intercept)
 
-            r, p = stats.spearmanr(data.iloc[:, 0], data.iloc[:, 1])
+            r, p = cs_stat_num.spearman_r(rank_cache.ranks(x, valid_pairs)[valid_pairs],
+                                          rank_cache.ranks(y, valid_pairs)[valid_pairs])
             r_ci_low, r_ci_high = cs_stat_num.corr_ci(r, df + 2)
             standardized_effect_size_result += _("Spearman's rank-order correlation") + ': <i>r<sub>s</sub></i> = %0.3f\n' % r
             pdf_result.loc[_("Spearman's rank-order correlation") + ', <i>r<sub>s</sub></i>'] = ['%0.3f' % (r), '[%0.3f, %0.3f]' % (r_ci_low, r_ci_high)]
@@ -661,7 +1185,8 @@ class CogStatData:
             population_result += '<decision>'+_('Ordinal variables.')+' >> '+_("Running Spearman's correlation.") + \
                            '\n<default>'
             df = len(data)-2
-            r, p = stats.spearmanr(data.iloc[:, 0], data.iloc[:, 1])
+            r, p = cs_stat_num.spearman_r(rank_cache.ranks(x, valid_pairs)[valid_pairs],
+                                          rank_cache.ranks(y, valid_pairs)[valid_pairs])
             r_ci_low, r_ci_high = cs_stat_num.corr_ci(r, df + 2)
             standardized_effect_size_result += _("Spearman's rank-order correlation") + ': <i>r<sub>s</sub></i> = %0.3f\n' % r
             pdf_result.loc[_("Spearman's rank-order correlation") + ', <i>r<sub>s</sub></i>'] = ['%0.3f' % (r), '[%0.3f, %0.3f]' % (r_ci_low, r_ci_high)]
@@ -676,7 +1201,7 @@ class CogStatData:
             if not(self.data_measlevs[x] == 'nom' and self.data_measlevs[y] == 'nom'):
                 population_result += '<warning>'+_('Not all variables are nominal. Consider comparing groups.')+'<default>\n'
             population_result += '<decision>'+_('Nominal variables.')+' >> '+_('Running Cramér\'s V.')+'\n<default>'
-            cramer_result, chi_result = cs_stat.chi_square_test(self.data_frame, x, y)
+            cramer_result, chi_result = cs_stat.chi_square_test(data_frame, x, y)
             standardized_effect_size_result += cramer_result
             population_result += chi_result
         sample_result += '\n'
@@ -685,8 +1210,8 @@ class CogStatData:
         # Make graph
         # extra chart is needed only for int variables, otherwise the chart would just repeat the raw data
         if meas_lev in ['int', 'unk']:
-            temp_text_result = cs_stat.var_pair_contingency_table(meas_lev, x, y, self.data_frame)
-            sample_graph = cs_chart.create_variable_pair_chart(data, meas_lev, slope, intercept, x, y, self.data_frame)
+            temp_text_result = cs_stat.var_pair_contingency_table(meas_lev, x, y, data_frame)
+            sample_graph = cs_chart.create_variable_pair_chart(data, meas_lev, slope, intercept, x, y, data_frame)
             if temp_text_result:
                 population_result += temp_text_result
         else:
@@ -696,6 +1221,60 @@ class CogStatData:
 
     #correlations(x,y)  # test
 
+    def explore_correlation_matrix(self, var_names):
+        """Explore the correlations of several variables
+
+        The correlations of all variable pairs are computed at once, with pairwise deletion of the missing values.
+
+        :param var_names: list of variable names (list of str)
+        :return:
+        """
+        title = csc.heading_style_begin + _('Explore correlation matrix') + csc.heading_style_end
+        raw_result = _('Variables: ') + ', '.join('%s (%s)' % (var_name, self.data_measlevs[var_name])
+                                                  for var_name in var_names) + '\n'
+        raw_result += self._filtering_status()
+        nominal_vars = [var_name for var_name in var_names if self.data_measlevs[var_name] == 'nom']
+        var_names = [var_name for var_name in var_names if var_name not in nominal_vars]
+        if nominal_vars:
+            raw_result += '<warning>' + _('Nominal variables are not included: %s.') % ', '.join(nominal_vars) + \
+                          '<default>\n'
+        if len(var_names) < 2:
+            raw_result += '<decision>' + _('At least two interval or ordinal variables should be set.') + \
+                          '<default>\n'
+            return self._convert_output([title, raw_result])
+        meas_lev, unknown_var = self._meas_lev_vars(var_names)
+        if unknown_var:
+            raw_result += '<decision>' + warn_unknown_variable + '\n<default>'
+
+        data_frame = self._filtered_columns(var_names)
+
+        # 1. Raw data
+        self._progress(_('Raw data'))
+        raw_result += '<h4>' + _('Raw data') + '</h4>'
+        valid_n = data_frame[var_names].notna().sum()
+        pdf_result = pd.DataFrame({_('N of valid cases'): valid_n, _('N of missing cases'): len(data_frame) - valid_n})
+        raw_result += cs_stat._format_html_table(pdf_result.to_html(bold_rows=False))
+        raw_result += _('Missing values are excluded pairwise.') + '\n'
+
+        # 2. Sample properties
+        self._progress(_('Sample properties'))
+        sample_result = '<h4>' + _('Sample properties') + '</h4>'
+        correlations = []
+        if meas_lev in ['int', 'unk']:
+            values = data_frame[var_names].values.astype(float)
+            r, n = cs_stat_num.pairwise_correlations(values, ~np.isnan(values))
+            correlations.append((_("Pearson's correlation"), '<i>r</i>', r))
+        r, n = cs_stat_num.rank_correlations(self._rank_cache(data_frame), var_names)
+        correlations.append((_("Spearman's rank-order correlation"), '<i>r<sub>s</sub></i>', r))
+        sample_graph = cs_chart.create_correlation_heatmap(correlations[0][2], var_names, rank=meas_lev == 'ord')
+
+        # 3. Population properties
+        self._progress(_('Population properties'))
+        population_result = '<h4>' + _('Population properties') + '</h4>'
+        population_result += _('Correlations of the variable pairs in decreasing order of strength') + \
+                             cs_stat.correlation_matrix_table(var_names, n, correlations)
+        return self._convert_output([title, raw_result, sample_result, sample_graph, population_result])
+
     def pivot(self, depend_names=[], row_names=[], col_names=[], page_names=[], function='Mean'):
         """ Computes pivot table
         :param row_names:
@@ -706,8 +1285,11 @@ class CogStatData:
         :return:
         """
         # TODO optionally return pandas DataFrame or Panel
+        data_frame = self._filtered_columns(list(depend_names) + list(row_names) + list(col_names) + list(page_names))
         title = csc.heading_style_begin + _('Pivot table') + csc.heading_style_end
-        pivot_result = cs_stat.pivot(self.data_frame, row_names, col_names, page_names, depend_names, function)
+        pivot_result = cs_stat.pivot(data_frame, row_names, col_names, page_names, depend_names, function,
+                                     prec=self._column_info(depend_names[0], 'precision') if len(depend_names) == 1
+                                     else None)
         return self._convert_output([title, pivot_result])
 
     def compare_variables(self, var_names):
@@ -716,7 +1298,7 @@ class CogStatData:
         :param var_names: list of variable names (list of str)
         :return:
         """
-        plt.close('all')
+        data_frame = self._filtered_columns(var_names)
         title = csc.heading_style_begin + _('Compare repeated measures variables') + csc.heading_style_end
         meas_levels = [self.data_measlevs[var_name] for var_name in var_names]
         raw_result = '<default>'+_('Variables to compare: ') + ', '.join('%s (%s)'%(var, meas) for var, meas in zip(var_names, meas_levels)) + '\n'
@@ -734,47 +1316,52 @@ class CogStatData:
             raw_result += '\n<decision>'+warn_unknown_variable+'<default>'
 
         # 1. Raw data
+        self._progress(_('Raw data'))
         raw_result += '<h4>' + _('Raw data') + '</h4>'
         # Prepare data, drop missing data
         # TODO are NaNs interesting in nominal variables?
-        data = self.data_frame[var_names].dropna()
+        data = data_frame[var_names].dropna()
         valid_n = len(data)
-        missing_n = len(self.data_frame[var_names])-valid_n
+        missing_n = len(data_frame[var_names])-valid_n
         raw_result += _('N of valid cases') +': %g\n' % valid_n
         raw_result += _('N of missing cases') + ': %g\n' % missing_n
 
         # Plot the raw data
-        raw_graph = cs_chart.create_repeated_measures_sample_chart(data, var_names, meas_level, self.data_frame, raw_data=True)
+        raw_graph = cs_chart.create_repeated_measures_sample_chart(data, var_names, meas_level, data_frame, raw_data=True)
 
         # Plot the individual data with box plot
         # There's no need to repeat the mosaic plot for nominal variables
         if meas_level in ['int', 'unk', 'ord']:
-            sample_graph = cs_chart.create_repeated_measures_sample_chart(data, var_names, meas_level, self.data_frame)
+            sample_graph = cs_chart.create_repeated_measures_sample_chart(data, var_names, meas_level, data_frame)
         else:
             sample_graph = None
 
         # 2. Sample properties
+        self._progress(_('Sample properties'))
         sample_result = '<h4>' + _('Sample properties') + '</h4>'
 
         if meas_level in ['int', 'unk']:
-            sample_result += cs_stat.print_var_stats(self.data_frame, var_names,
-                             statistics=['mean', 'std', 'amax', 'upper_quartile', 'median', 'lower_quartile', 'amin'])
+            sample_result += self._cached(cs_stat.print_var_stats, data_frame, var_names,
+                                          statistics=['mean', 'std', 'amax', 'upper_quartile', 'median', 'lower_quartile', 'amin'],
+                                          precs=[self._column_info(name, 'precision') for name in var_names])
         elif meas_level == 'ord':
-            sample_result += cs_stat.print_var_stats(self.data_frame, var_names,
-                             statistics=['amax', 'upper_quartile', 'median', 'lower_quartile', 'amin'])
+            sample_result += self._cached(cs_stat.print_var_stats, data_frame, var_names,
+                                          statistics=['amax', 'upper_quartile', 'median', 'lower_quartile', 'amin'],
+                                          precs=[self._column_info(name, 'precision') for name in var_names])
         elif meas_level == 'nom':
             import itertools
             for var_pair in itertools.combinations(var_names, 2):
-                cont_table_data = pd.crosstab(self.data_frame[var_pair[0]], self.data_frame[var_pair[1]])
+                cont_table_data = pd.crosstab(data_frame[var_pair[0]], data_frame[var_pair[1]])
                     #, rownames = [x], colnames = [y])
                 sample_result += cs_stat._format_html_table(cont_table_data.to_html(bold_rows=False))
 
         # 3. Population properties
+        self._progress(_('Population properties'))
         population_result = '<h4>' + _('Population properties') + '</h4>\n'
         mean_estimations = cs_stat.repeated_measures_estimations(data, meas_level)
         population_result += _('Means') + cs_stat._format_html_table(mean_estimations.to_html(bold_rows=False))
 
-        population_graph = cs_chart.create_repeated_measures_population_chart(data, var_names, meas_level, self.data_frame)
+        population_graph = cs_chart.create_repeated_measures_population_chart(data, var_names, meas_level, data_frame)
 
         result_ht = '<decision>' + _('Hypothesis testing: ')
         if meas_level in ['int', 'unk']:
@@ -797,26 +1384,26 @@ class CogStatData:
                 temp_diff_var_name = 'Difference of %s and %s' %tuple(var_names)
                 data[temp_diff_var_name] = data[var_names[0]] - data[var_names[1]]
                 norm, text_result, graph_dummy, graph2_dummy = \
-                    cs_stat.normality_test(self.data_frame, {temp_diff_var_name:'int'}, temp_diff_var_name, alt_data=data)
+                    cs_stat.normality_test(data_frame, {temp_diff_var_name:'int'}, temp_diff_var_name, alt_data=data)
                 result_ht += text_result
                 if not norm:
                     non_normal_vars.append(temp_diff_var_name)
 
                 if not non_normal_vars:
                     result_ht += '<decision>'+_('Normality is not violated. >> Running paired t-test.')+'\n<default>'
-                    result_ht += cs_stat.paired_t_test(self.data_frame, var_names)
+                    result_ht += cs_stat.paired_t_test(data_frame, var_names)
                 else:  # TODO should the descriptive be the mean or the median?
                     result_ht += '<decision>'+_('Normality is violated in variable(s): %s.') % ', '.\
                         join(non_normal_vars) + ' >> ' + _('Running paired Wilcoxon test.')+'\n<default>'
-                    result_ht += cs_stat.paired_wilcox_test(self.data_frame, var_names)
+                    result_ht += cs_stat.paired_wilcox_test(data_frame, var_names)
             elif meas_level == 'ord':
                 result_ht += '<decision>'+_('Ordinal variables.')+' >> '+_('Running paired Wilcoxon test.')+'\n<default>'
-                result_ht += cs_stat.paired_wilcox_test(self.data_frame, var_names)
+                result_ht += cs_stat.paired_wilcox_test(data_frame, var_names)
             else:  # nominal variables
                 if len(set(data.values.ravel())) == 2:
                     result_ht += '<decision>'+_('Nominal dichotomous variables.')+' >> ' + _('Running McNemar test.') \
                               + '\n<default>'
-                    result_ht += cs_stat.mcnemar_test(self.data_frame, var_names)
+                    result_ht += cs_stat.mcnemar_test(data_frame, var_names)
                 else:
                     result_ht += '<decision>'+_('Nominal non dichotomous variables.')+' >> ' + \
                               _('Sorry, not implemented yet.')+'\n<default>'
@@ -830,7 +1417,7 @@ class CogStatData:
                 result_ht += '<decision>'+_('Checking for normality.')+'\n<default>'
                 non_normal_vars = []
                 for var_name in var_names:
-                    norm, text_result, graph_dummy, graph2_dummy = cs_stat.normality_test(self.data_frame,
+                    norm, text_result, graph_dummy, graph2_dummy = cs_stat.normality_test(data_frame,
                                                                                           self.data_measlevs, var_name,
                                                                                           alt_data=data)
                     result_ht += text_result
@@ -840,19 +1427,19 @@ class CogStatData:
                 if not non_normal_vars:
                     result_ht += '<decision>'+_('Normality is not violated.') + ' >> ' + \
                               _('Running repeated measures one-way ANOVA.')+'\n<default>'
-                    result_ht += cs_stat.repeated_measures_anova(self.data_frame, var_names)
+                    result_ht += cs_stat.repeated_measures_anova(data_frame, var_names)
                 else:
                     result_ht += '<decision>'+_('Normality is violated in variable(s): %s.') % ', '.\
                         join(non_normal_vars) + ' >> ' + _('Running Friedman test.')+'\n<default>'
-                    result_ht += cs_stat.friedman_test(self.data_frame, var_names)
+                    result_ht += cs_stat.friedman_test(data_frame, var_names)
             elif meas_level == 'ord':
                 result_ht += '<decision>'+_('Ordinal variables.')+' >> '+_('Running Friedman test.')+'\n<default>'
-                result_ht += cs_stat.friedman_test(self.data_frame, var_names)
+                result_ht += cs_stat.friedman_test(data_frame, var_names)
             else:
                 if len(set(data.values.ravel())) == 2:
                     result_ht += '<decision>'+_('Nominal dichotomous variables.')+' >> '+_("Running Cochran's Q test.") + \
                               '\n<default>'
-                    result_ht += cs_stat.cochran_q_test(self.data_frame, var_names)
+                    result_ht += cs_stat.cochran_q_test(data_frame, var_names)
                 else:
                     result_ht += '<decision>'+_('Nominal non dichotomous variables.')+' >> ' \
                               + _('Sorry, not implemented yet.')+'\n<default>'
@@ -868,9 +1455,9 @@ class CogStatData:
         :param single_case_slope_trial: number of trials in slope calculation for single case
         :return:
         """
-        plt.close('all')
         var_names = [var_name]
         groups = grouping_variables
+        data_frame = self._filtered_columns(var_names + list(groups) + list(single_case_slope_SEs or []))
         # TODO check if there is only one dep.var.
         title = csc.heading_style_begin + _('Compare groups') + csc.heading_style_end
         meas_levels = [self.data_measlevs[var_name] for var_name in var_names]
@@ -887,53 +1474,60 @@ class CogStatData:
         # One grouping variable
         if len(groups) == 1:
             # 1. Raw data
+            self._progress(_('Raw data'))
             raw_result += '<h4>' + _('Raw data') + '</h4>'
 
-            data = self.data_frame[[groups[0], var_names[0]]].dropna()
+            data = data_frame[[groups[0], var_names[0]]].dropna()
             group_levels = sorted(set(data[groups[0]]))
             # index should be specified to work in pandas 0.11; but this way can't use _() for the labels
             pdf_result = pd.DataFrame(columns=group_levels)
             pdf_result.loc[_('N of valid cases')] = [sum(data[groups[0]] == group) for group in group_levels]
-            pdf_result.loc[_('N of missing cases')] = [sum(self.data_frame[groups[0]] == group) -
+            pdf_result.loc[_('N of missing cases')] = [sum(data_frame[groups[0]] == group) -
                                                     sum(data[groups[0]] == group) for group in group_levels]
 #            for group in group_levels:
 #                valid_n = sum(data[groups[0]]==group)
-#                missing_n = sum(self.data_frame[groups[0]]==group)-valid_n
+#                missing_n = sum(data_frame[groups[0]]==group)-valid_n
 #                raw_result += _(u'Group: %s, N of valid cases: %g, N of missing cases: %g\n') %(group, valid_n, missing_n)
             raw_result += cs_stat._format_html_table(pdf_result.to_html(bold_rows=False))
-            valid_n = len(self.data_frame[groups[0]].dropna())
-            missing_n = len(self.data_frame[groups[0]])-valid_n
+            missing_n = self._column_info(groups[0], 'missing_n')
             raw_result += '\n\n'+_('N of missing group cases') + ': %g' % missing_n +'\n'
 
             # Plot individual data
-            raw_graph = cs_chart.create_compare_groups_sample_chart(self.data_frame, meas_level, var_names, groups,
-                                                                  group_levels, raw_data_only=True)
+            raw_graph = self._cached(cs_chart.create_compare_groups_sample_chart,
+                                     data_frame, meas_level, var_names, groups,
+                                     group_levels, raw_data_only=True, rank_cache=self._rank_cache(data_frame))
 
             # Plot the individual data with boxplots
             # There's no need to repeat the mosaic plot for the nominal variables
             if meas_level in ['int', 'unk', 'ord']:
-                sample_graph = cs_chart.create_compare_groups_sample_chart(self.data_frame, meas_level, var_names, groups,
-                                                                    group_levels)
+                sample_graph = self._cached(cs_chart.create_compare_groups_sample_chart,
+                                            data_frame, meas_level, var_names, groups,
+                                            group_levels, rank_cache=self._rank_cache(data_frame))
             else:
                 sample_graph = None
 
             # 2. Descriptive data
+            self._progress(_('Sample properties'))
             sample_result = '<h4>' + _('Sample properties') + '</h4>'
 
             if meas_level in ['int', 'unk']:
-                sample_result += cs_stat.print_var_stats(self.data_frame, [var_names[0]], groups=groups,
-                                 statistics=['mean', 'std', 'amax', 'upper_quartile', 'median', 'lower_quartile', 'amin'])
+                sample_result += self._cached(cs_stat.print_var_stats, data_frame, [var_names[0]], groups=groups,
+                                              statistics=['mean', 'std', 'amax', 'upper_quartile', 'median', 'lower_quartile', 'amin'],
+                                              precs=[self._column_info(name, 'precision') for name in [var_names[0]]])
             elif meas_level == 'ord':
-                sample_result += cs_stat.print_var_stats(self.data_frame, [var_names[0]], groups=groups,
-                                statistics=['amax', 'upper_quartile', 'median', 'lower_quartile', 'amin'])
+                sample_result += self._cached(cs_stat.print_var_stats, data_frame, [var_names[0]], groups=groups,
+                                              statistics=['amax', 'upper_quartile', 'median', 'lower_quartile', 'amin'],
+                                              precs=[self._column_info(name, 'precision') for name in [var_names[0]]])
             elif meas_level == 'nom':
-                cont_table_data = pd.crosstab(self.data_frame[var_names[0]], self.data_frame[groups[0]])#, rownames = [x], colnames = [y])
+                cont_table_data = pd.crosstab(data_frame[var_names[0]], data_frame[groups[0]])#, rownames = [x], colnames = [y])
                 sample_result += cs_stat._format_html_table(cont_table_data.to_html(bold_rows=False))
 
             # 3. Population properties
+            self._progress(_('Population properties'))
             # Plot population estimations
-            mean_estimations = cs_stat.comp_group_estimations(self.data_frame, meas_level, var_names, groups)
-            population_graph = cs_chart.create_compare_groups_population_chart(self.data_frame, meas_level, var_names, groups, group_levels)
+            mean_estimations = cs_stat.comp_group_estimations(data_frame, meas_level, var_names, groups)
+            population_graph = self._cached(cs_chart.create_compare_groups_population_chart,
+                                            data_frame, meas_level, var_names, groups, group_levels)
 
             # Hypothesis testing
             population_result = '<h4>' + _('Population properties') + '</h4>\n'
@@ -957,41 +1551,43 @@ class CogStatData:
             elif len(group_levels) == 2:
                 result_ht += '<decision>'+_('Two groups. ')+'<default>'
                 if meas_level == 'int':
-                    group_levels, [var1, var2] = cs_stat._split_into_groups(self.data_frame, var_names[0], groups)
+                    group_levels, [var1, var2] = self._cached(cs_stat._split_into_groups,
+                                                              data_frame, var_names[0], groups)
                     if len(var1) == 1 or len(var2) == 1:  # Single case vs control group
                         result_ht += '<decision>'+_('One group contains only one case. >> Choosing modified t-test.') + \
                                   '\n<default>'
                         result_ht += '<decision>'+_('Checking for normality.')+'\n<default>'
                         group = group_levels[1] if len(var1) == 1 else group_levels[0]
                         norm, text_result, graph_dummy, graph2_dummy = \
-                            cs_stat.normality_test(self.data_frame, self.data_measlevs, var_names[0],
-                                                   group_name=groups[0], group_value=group[0])
+                            self._cached(cs_stat.normality_test, data_frame, self.data_measlevs, var_names[0],
+                                         group_name=groups[0], group_value=group[0])
                         result_ht += text_result
                         if not norm:
                             result_ht += '<decision>'+_('Normality is violated in variable ')+var_names[0]+', ' + \
                                       _('group ')+str(group)+'.\n<default>'
                             result_ht += '<decision>>> '+_('Running Mann-Whitney test.')+'\n<default>'
-                            result_ht += cs_stat.mann_whitney_test(self.data_frame, var_names[0], groups[0])
+                            result_ht += cs_stat.mann_whitney_test(data_frame, var_names[0], groups[0],
+                                                                   rank_cache=self._rank_cache(data_frame))
                         else:
                             result_ht += '<decision>'+_('Normality is not violated. >> Running modified t-test.') + \
                                       '\n<default>'
-                            result_ht += cs_stat.single_case_task_extremity(self.data_frame, var_names[0], groups[0], single_case_slope_SEs[0] if single_case_slope_SEs else None, single_case_slope_trial_n)
+                            result_ht += cs_stat.single_case_task_extremity(data_frame, var_names[0], groups[0], single_case_slope_SEs[0] if single_case_slope_SEs else None, single_case_slope_trial_n)
                     else:
                         result_ht += '<decision>'+_('Interval variable.')+' >> ' + \
                                   _("Choosing two sample t-test, Mann-Whitney test or Welch's t-test depending on assumptions.") + \
                                   '\n<default>'
                         result_ht += '<decision>'+_('Checking for normality.')+'\n<default>'
                         non_normal_groups = []
-                        for group in group_levels:
-                            norm, text_result, graph_dummy, graph2_dummy = \
-                                cs_stat.normality_test(self.data_frame, self.data_measlevs, var_names[0],
-                                                       group_name=groups[0], group_value=group[0])
+                        normality_results = self._cached(cs_stat.normality_test_groups, data_frame,
+                                                         self.data_measlevs, var_names[0], groups[0],
+                                                         [group[0] for group in group_levels])
+                        for group, (norm, text_result) in zip(group_levels, normality_results):
                             result_ht += text_result
                             if not norm:
                                 non_normal_groups.append(group)
                         result_ht += '<decision>'+_('Checking for homogeneity of variance across groups.')+'\n<default>'
                         hoemogeneity_vars = True
-                        p, text_result = cs_stat.levene_test(self.data_frame, var_names[0], groups[0])
+                        p, text_result = cs_stat.levene_test(data_frame, var_names[0], groups[0])
                         result_ht += text_result
                         if p < 0.05:
                             hoemogeneity_vars = False
@@ -1000,23 +1596,26 @@ class CogStatData:
                             result_ht += '<decision>' + \
                                       _('Normality and homogeneity of variance are not violated. >> Running two sample t-test.') + \
                                       '\n<default>'
-                            result_ht += cs_stat.independent_t_test(self.data_frame, var_names[0], groups[0])
+                            result_ht += cs_stat.independent_t_test(data_frame, var_names[0], groups[0],
+                                                                    prec=self._column_info(var_names[0], 'precision'))
                         elif non_normal_groups:
                             result_ht += '<decision>'+_('Normality is violated in variable %s, group(s) %s.') % \
                                                    (var_names[0], ', '.join(map(str, non_normal_groups)))+' >> ' + \
                                       _('Running Mann-Whitney test.')+'\n<default>'
-                            result_ht += cs_stat.mann_whitney_test(self.data_frame, var_names[0], groups[0])
+                            result_ht += cs_stat.mann_whitney_test(data_frame, var_names[0], groups[0],
+                                                                   rank_cache=self._rank_cache(data_frame))
                         elif not hoemogeneity_vars:
                             result_ht += '<decision>'+_('Homeogeneity of variance violated in variable %s.') % \
                                                    var_names[0] + ' >> ' + _("Running Welch's t-test.")+'\n<default>'
-                            result_ht += cs_stat.welch_t_test(self.data_frame, var_names[0], groups[0])
+                            result_ht += cs_stat.welch_t_test(data_frame, var_names[0], groups[0])
 
                 elif meas_level == 'ord':
                     result_ht += '<decision>'+_('Ordinal variable.')+' >> '+_('Running Mann-Whitney test.')+'<default>\n'
-                    result_ht += cs_stat.mann_whitney_test(self.data_frame, var_names[0], groups[0])
+                    result_ht += cs_stat.mann_whitney_test(data_frame, var_names[0], groups[0],
+                                                           rank_cache=self._rank_cache(data_frame))
                 elif meas_level == 'nom':
                     result_ht += '<decision>'+_('Nominal variable.')+' >> '+_('Running Chi-square test.')+' '+'<default>\n'
-                    cramer_result, chi_result = cs_stat.chi_square_test(self.data_frame, var_names[0], groups[0])
+                    cramer_result, chi_result = cs_stat.chi_square_test(data_frame, var_names[0], groups[0])
                     sample_result += '\n\n' + cramer_result
                     result_ht += chi_result
 
@@ -1030,16 +1629,15 @@ class CogStatData:
 
                     result_ht += '<decision>'+_('Checking for normality.')+'\n<default>'
                     non_normal_groups = []
-                    for group in group_levels:
-                        norm, text_result, graph_dummy, graph2_dummy = \
-                            cs_stat.normality_test(self.data_frame, self.data_measlevs, var_names[0],
-                                                   group_name=groups[0], group_value=group)
+                    normality_results = self._cached(cs_stat.normality_test_groups, data_frame,
+                                                     self.data_measlevs, var_names[0], groups[0], group_levels)
+                    for group, (norm, text_result) in zip(group_levels, normality_results):
                         result_ht += text_result
                         if not norm:
                             non_normal_groups.append(group)
                     result_ht += '<decision>'+_('Checking for homogeneity of variance across groups.')+'\n<default>'
                     hoemogeneity_vars = True
-                    p, text_result = cs_stat.levene_test(self.data_frame, var_names[0], groups[0])
+                    p, text_result = cs_stat.levene_test(data_frame, var_names[0], groups[0])
                     result_ht += text_result
                     if p < 0.05:
                         hoemogeneity_vars = False
@@ -1048,7 +1646,7 @@ class CogStatData:
                         result_ht += '<decision>' + \
                                   _('Normality and homogeneity of variance are not violated. >> Running one-way ANOVA.')\
                                   + '\n<default>'
-                        anova_result, effect_size_result = cs_stat.one_way_anova(self.data_frame, var_names[0], groups[0])
+                        anova_result, effect_size_result = cs_stat.one_way_anova(data_frame, var_names[0], groups[0])
                         result_ht += anova_result
                         standardized_effect_size_result = _('Standardized effect size:') + '\n' + effect_size_result
 
@@ -1059,26 +1657,29 @@ class CogStatData:
                         result_ht += '<decision>'+_('Homeogeneity of variance violated in variable %s. ') % var_names[0]
                     if non_normal_groups or (not hoemogeneity_vars):
                         result_ht += '>> '+_('Running Kruskal-Wallis test.')+'\n<default>'
-                        result_ht += cs_stat.kruskal_wallis_test(self.data_frame, var_names[0], groups[0])
+                        result_ht += cs_stat.kruskal_wallis_test(data_frame, var_names[0], groups[0],
+                                                                 rank_cache=self._rank_cache(data_frame))
 
                 elif meas_level == 'ord':
                     result_ht += '<decision>'+_('Ordinal variable.')+' >> '+_('Running Kruskal-Wallis test.') + \
                               '<default>\n<default>'
-                    result_ht += cs_stat.kruskal_wallis_test(self.data_frame, var_names[0], groups[0])
+                    result_ht += cs_stat.kruskal_wallis_test(data_frame, var_names[0], groups[0],
+                                                             rank_cache=self._rank_cache(data_frame))
                 elif meas_level == 'nom':
                     result_ht += '<decision>'+_('Nominal variable.')+' >> '+_('Running Chi-square test.')+'<default>\n'
-                    cramer_result, chi_result = cs_stat.chi_square_test(self.data_frame, var_names[0], groups[0])
+                    cramer_result, chi_result = cs_stat.chi_square_test(data_frame, var_names[0], groups[0])
                     sample_result += '\n\n' + cramer_result
                     result_ht += chi_result
 
-        # Two grouping variables
-        elif len(groups) == 2:
+        # Two or more grouping variables
+        elif len(groups) >= 2:
             # 1. Raw data
+            self._progress(_('Raw data'))
             raw_result += '<h4>' + _('Raw data') + '</h4>'
 
             standardized_effect_size_result = None
 
-            data = self.data_frame[groups + [var_names[0]]].dropna()
+            data = data_frame[groups + [var_names[0]]].dropna()
             # create a list of sets with the levels of all grouping variables
             levels = [list(set(data[group])) for group in groups]
             for i in range(len(levels)):
@@ -1095,54 +1696,60 @@ class CogStatData:
                 (data[groups] == pd.Series({group: level for group, level in zip(groups, group_level)})).all(axis=1))
                                                      for group_level in level_combinations]
             pdf_result.loc[_('N of missing cases')] = [sum(
-                (self.data_frame[groups] == pd.Series({group: level for group, level in zip(groups, group_level)})).all(
+                (data_frame[groups] == pd.Series({group: level for group, level in zip(groups, group_level)})).all(
                     axis=1)) -
                                                        sum((data[groups] == pd.Series({group: level for group, level in
                                                                                        zip(groups, group_level)})).all(
                                                            axis=1)) for group_level in level_combinations]
             #            for group in group_levels:
             #                valid_n = sum(data[groups[0]]==group)
-            #                missing_n = sum(self.data_frame[groups[0]]==group)-valid_n
+            #                missing_n = sum(data_frame[groups[0]]==group)-valid_n
             #                raw_result += _(u'Group: %s, N of valid cases: %g, N of missing cases: %g\n') %(group, valid_n, missing_n)
             raw_result += cs_stat._format_html_table(pdf_result.to_html(bold_rows=False))
             raw_result += '\n\n'
             for group in groups:
-                valid_n = len(self.data_frame[group].dropna())
-                missing_n = len(self.data_frame[group]) - valid_n
+                missing_n = self._column_info(group, 'missing_n')
                 raw_result += _('N of missing grouping variable in %s') % group + ': %g\n' % missing_n
 
             # Plot individual data
 
-            raw_graph = cs_chart.create_compare_groups_sample_chart(self.data_frame, meas_level, var_names, groups,
-                                                                  level_combinations, raw_data_only=True)
+            raw_graph = self._cached(cs_chart.create_compare_groups_sample_chart,
+                                     data_frame, meas_level, var_names, groups,
+                                     level_combinations, raw_data_only=True, rank_cache=self._rank_cache(data_frame))
 
             # Plot the individual data with boxplots
             # There's no need to repeat the mosaic plot for the nominal variables
             if meas_level in ['int', 'unk', 'ord']:
-                sample_graph = cs_chart.create_compare_groups_sample_chart(self.data_frame, meas_level, var_names, groups,
-                                                                         level_combinations)
+                sample_graph = self._cached(cs_chart.create_compare_groups_sample_chart,
+                                            data_frame, meas_level, var_names, groups,
+                                            level_combinations, rank_cache=self._rank_cache(data_frame))
             else:
                 sample_graph = None
 
             # 2. Sample properties
+            self._progress(_('Sample properties'))
             sample_result = '<h4>' + _('Sample properties') + '</h4>'
 
             if meas_level in ['int', 'unk']:
-                sample_result += cs_stat.print_var_stats(self.data_frame, [var_names[0]], groups=groups,
-                                                         statistics=['mean', 'std', 'amax', 'upper_quartile', 'median', 'lower_quartile', 'amin'])
+                sample_result += self._cached(cs_stat.print_var_stats, data_frame, [var_names[0]], groups=groups,
+                                              statistics=['mean', 'std', 'amax', 'upper_quartile', 'median', 'lower_quartile', 'amin'],
+                                              precs=[self._column_info(name, 'precision') for name in [var_names[0]]])
             elif meas_level == 'ord':
-                sample_result += cs_stat.print_var_stats(self.data_frame, [var_names[0]], groups=groups,
-                                                         statistics=['amax', 'upper_quartile', 'median', 'lower_quartile', 'amin'])
+                sample_result += self._cached(cs_stat.print_var_stats, data_frame, [var_names[0]], groups=groups,
+                                              statistics=['amax', 'upper_quartile', 'median', 'lower_quartile', 'amin'],
+                                              precs=[self._column_info(name, 'precision') for name in [var_names[0]]])
             elif meas_level == 'nom':
-                cont_table_data = pd.crosstab(self.data_frame[var_names[0]],
-                                              [self.data_frame[groups[i]] for i in range(len(groups))])  # , rownames = [x], colnames = [y])
+                cont_table_data = pd.crosstab(data_frame[var_names[0]],
+                                              [data_frame[groups[i]] for i in range(len(groups))])  # , rownames = [x], colnames = [y])
                 sample_result += cs_stat._format_html_table(cont_table_data.to_html(bold_rows=False))
 
             # 3. Population properties
+            self._progress(_('Population properties'))
             # Plot population estimations
-            mean_estimations = cs_stat.comp_group_estimations(self.data_frame, meas_level, var_names, groups)
-            population_graph = cs_chart.create_compare_groups_population_chart(self.data_frame, meas_level, var_names, groups,
-                                                                level_combinations)
+            mean_estimations = cs_stat.comp_group_estimations(data_frame, meas_level, var_names, groups)
+            population_graph = self._cached(cs_chart.create_compare_groups_population_chart,
+                                            data_frame, meas_level, var_names, groups,
+                                            level_combinations)
 
             # Hypothesis testing
             population_result = '<h4>' + _('Population properties') + '</h4>\n'
@@ -1156,12 +1763,14 @@ class CogStatData:
             elif meas_level == 'nom':
                 result_ht += _('Testing if the distributions are the same.') + '<default>\n'
 
-            result_ht += '<decision>' + _('Two grouping variables. ') + '<default>'
+            if len(groups) == 2:
+                result_ht += '<decision>' + _('Two grouping variables. ') + '<default>'
+            else:
+                result_ht += '<decision>' + _('Several grouping variables.') + ' <default>'
             if meas_level == 'int':
-                group_levels, vars = cs_stat._split_into_groups(self.data_frame, var_names[0], groups)
                 result_ht += '<decision>' + _('Interval variable.') + ' >> ' + \
                              _("Choosing factorial ANOVA.") + '\n<default>'
-                result_ht += cs_stat.two_way_anova(self.data_frame, var_names[0], groups)
+                result_ht += cs_stat.factorial_anova(data_frame, var_names[0], groups)
 
             elif meas_level == 'ord':
                 result_ht += '<decision>' + _('Ordinal variable.') + ' >> ' + \
@@ -1170,10 +1779,6 @@ class CogStatData:
                 result_ht += '<decision>' + _('Nominal variable.') + ' >> ' + \
                              _('Sorry, not implemented yet.') + ' ' + '<default>\n'
 
-        elif len(groups) > 2:
-            raw_result += '<decision>'+_('Several grouping variables.')+' >> '+'<default>\n'
-            return self._convert_output([title, raw_result])
-
         return self._convert_output([title, raw_result, raw_graph, sample_result, sample_graph, population_result,
                                      population_graph, result_ht, standardized_effect_size_result])
 
@@ -1191,4 +1796,3 @@ def display(results):
             display(HTML(result))
         else:
             display(result)
-    plt.close('all')
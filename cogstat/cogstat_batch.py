@@ -0,0 +1,142 @@
+# -*- coding: utf-8 -*-
+"""
+Run CogStat analyses without the GUI, in parallel processes.
+
+The results of every analysis are written into a separate html file (and png files for the charts), and an index.html
+file lists all the analyses. Usage, e.g.:
+    python -m cogstat.cogstat_batch data.csv explore pairs groups --output results --jobs 4
+"""
+
+import argparse
+import html
+import logging
+import multiprocessing
+import os
+import re
+import sys
+import traceback
+
+# Use a non-Qt backend; this must be set before cogstat is imported
+os.environ['MPLBACKEND'] = 'agg'
+
+from . import cogstat as cs
+
+analysis_types = ['explore', 'pairs', 'correlations', 'groups']
+
+_data = None  # CogStatData instance of the worker process
+
+
+def list_analyses(data, analysis_names):
+    """Compile the list of analyses to run.
+
+    :param data: CogStatData instance
+    :param analysis_names: list of analysis types to run (see analysis_types)
+        'explore': explore all variables
+        'pairs': explore all variable pairs
+        'correlations': correlation matrix of all interval and ordinal variables
+        'groups': compare groups for all dependent variables and all nominal grouping variables
+    :return: list of (title, method name, arguments) tuples
+    """
+    var_names = list(data.data_frame.columns)
+    analyses = []
+    if 'explore' in analysis_names:
+        analyses.extend([('Explore variable %s' % var_name, 'explore_variable', (var_name,))
+                         for var_name in var_names])
+    if 'pairs' in analysis_names:
+        analyses.extend([('Explore variable pair %s - %s' % (x, y), 'explore_variable_pair', (x, y))
+                         for i, x in enumerate(var_names) for y in var_names[i+1:]])
+    if 'correlations' in analysis_names:
+        analyses.append(('Correlation matrix', 'explore_correlation_matrix',
+                         ([var_name for var_name in var_names if data.data_measlevs[var_name] != 'nom'],)))
+    if 'groups' in analysis_names:
+        analyses.extend([('Compare groups %s by %s' % (var_name, group), 'compare_groups', (var_name, [group]))
+                         for group in var_names if data.data_measlevs[group] == 'nom'
+                         for var_name in var_names if var_name != group])
+    return analyses
+
+
+def _init_worker(data_source, measurement_level):
+    """Import the data once in every worker process."""
+    global _data
+    _data = cs.CogStatData(data=data_source, measurement_level=measurement_level)
+
+
+def _run_analysis(task):
+    """Run a single analysis in a worker process and save the results.
+
+    :param task: (index, title, method name, arguments, output directory) tuple
+    :return: (file name, title, error message or None)
+    """
+    index, title, method, args, output_dir = task
+    file_name = '%04d_%s' % (index, re.sub(r'[^\w.-]+', '_', title))
+    try:
+        result = getattr(_data, method)(*args)
+    except Exception:
+        logging.error('Analysis failed: %s' % title)
+        return file_name + '.html', title, traceback.format_exc()
+    html_items = []
+    for item in result:
+        if isinstance(item, str):
+            html_items.append(item)
+        else:  # matplotlib figure
+            image_name = '%s_%d.png' % (file_name, len(html_items))
+            item.savefig(os.path.join(output_dir, image_name))
+            html_items.append('<img src="%s">' % image_name)
+    _write_html(os.path.join(output_dir, file_name + '.html'), title, '<br>\n'.join(html_items))
+    return file_name + '.html', title, None
+
+
+def _write_html(file_name, title, body):
+    with open(file_name, 'w', encoding='utf-8') as f:
+        f.write('<!DOCTYPE html>\n<html>\n<head>\n<meta charset="utf-8">\n<title>%s</title>\n</head>\n<body>\n%s\n'
+                '</body>\n</html>\n' % (html.escape(title), body))
+
+
+def run(data_source, analysis_names, output_dir, jobs=None, measurement_level=''):
+    """Run the analyses in parallel and write the results into output_dir.
+
+    :param data_source: file name of the data (see CogStatData for the available formats)
+    :param analysis_names: list of analysis types to run (see list_analyses())
+    :param output_dir: directory of the result files, created if needed
+    :param jobs: number of worker processes; all cpu cores are used if None
+    :param measurement_level: measurement levels of the variables, if not given in the data file
+    :return: list of (file name, title, error message or None) for all analyses
+    """
+    data = cs.CogStatData(data=data_source, measurement_level=measurement_level)
+    if data.import_source == cs._('Import failed'):
+        raise ValueError('The data could not be imported: %s' % data_source)
+    analyses = list_analyses(data, analysis_names)
+    if not os.path.exists(output_dir):
+        os.makedirs(output_dir)
+
+    tasks = [(index, title, method, args, output_dir) for index, (title, method, args) in enumerate(analyses)]
+    with multiprocessing.Pool(jobs, initializer=_init_worker, initargs=(data_source, measurement_level)) as pool:
+        results = pool.map(_run_analysis, tasks, chunksize=1)
+
+    index_items = ['<a href="%s">%s</a>' % (file_name, html.escape(title)) if error is None else
+                   '%s: <pre>%s</pre>' % (html.escape(title), html.escape(error))
+                   for file_name, title, error in results]
+    _write_html(os.path.join(output_dir, 'index.html'), 'CogStat results',
+                data.print_data(brief=True)[0] + '<br>\n'.join(index_items))
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Run CogStat analyses without the GUI.')
+    parser.add_argument('data', help='data file')
+    parser.add_argument('analyses', nargs='+', choices=analysis_types, help='analyses to run')
+    parser.add_argument('-o', '--output', default='cogstat_results', help='directory of the results')
+    parser.add_argument('-j', '--jobs', type=int, default=None, help='number of parallel processes (default: all cores)')
+    parser.add_argument('-m', '--measurement-level', default='',
+                        help="measurement levels of the variables, e.g., 'int nom ord', if not set in the data file")
+    args = parser.parse_args(argv)
+
+    results = run(args.data, args.analyses, args.output, jobs=args.jobs, measurement_level=args.measurement_level)
+    failed_n = sum(error is not None for file_name, title, error in results)
+    print('%d analyses were run, %d failed. Results: %s' %
+          (len(results), failed_n, os.path.join(args.output, 'index.html')))
+    return 1 if failed_n else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -7,35 +7,35 @@ import gettext
 import numpy as np
 import pandas as pd
 from scipy import stats
-import statsmodels.api as sm
 import textwrap
 
 import matplotlib
-import matplotlib.pyplot as plt
-import matplotlib.pylab
-
-try:
-    from statsmodels.graphics.mosaicplot import mosaic
-except:
-    pass
+import matplotlib.style
+from matplotlib.artist import setp
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.ticker import FuncFormatter
+# statsmodels is slow to import, so its modules are imported in the functions where they are needed
 
 from . import cogstat_config as csc
 from . import cogstat_stat as cs_stat
+from . import cogstat_stat_num as cs_stat_num
+from . import cogstat_util as cs_util
 
-matplotlib.pylab.rcParams['figure.figsize'] = csc.fig_size_x, csc.fig_size_y
+matplotlib.rcParams['figure.figsize'] = csc.fig_size_x, csc.fig_size_y
 
 ### Set matplotlib styles ###
 # Set the styles
-if csc.theme not in plt.style.available:
-    csc.theme = sorted(plt.style.available)[0]
+if csc.theme not in matplotlib.style.available:
+    csc.theme = sorted(matplotlib.style.available)[0]
     csc.save(['graph', 'theme'], csc.theme)
-plt.style.use(csc.theme)
+matplotlib.style.use(csc.theme)
 
-#print plt.style.available
+#print matplotlib.style.available
 #style_num = 15
-#print plt.style.available[style_num]
-#plt.style.use(plt.style.available[style_num])
-theme_colors = [col['color'] for col in list(plt.rcParams['axes.prop_cycle'])]
+#print matplotlib.style.available[style_num]
+#matplotlib.style.use(matplotlib.style.available[style_num])
+theme_colors = [col['color'] for col in list(matplotlib.rcParams['axes.prop_cycle'])]
 #print theme_colors
 # this is a workaround, as 'C0' notation does not seem to work
 
@@ -71,6 +71,43 @@ if rtl_lang:
 else:
     _plt = t.gettext
 
+
+def _new_figure(figsize=None):
+    """Create a figure with its own Agg canvas.
+
+    The charts do not use pyplot, so they do not depend on the global pyplot state, they can be created in parallel
+    threads, and they are released when they are not referenced anymore.
+
+    :param figsize: width and height in inches, rcParams['figure.figsize'] if None
+    :return: matplotlib Figure
+    """
+    fig = Figure(figsize=figsize)
+    FigureCanvasAgg(fig)
+    return fig
+
+
+def _set_boxplot_color(box):
+    """Set the color of all the elements of a boxplot to the theme color.
+
+    :param box: dictionary returned by Axes.boxplot()
+    """
+    for element in ['boxes', 'whiskers', 'caps', 'medians', 'fliers']:
+        setp(box[element], color=theme_colors[0])
+
+
+def _remove_twin_axes(ax):
+    """Remove the additional axes that statsmodels mosaic() creates for the labels of the 3rd and 4th factors.
+
+    Only the main axes of the mosaic plot are displayed, so the spines of the twin axes do not hide the measurement
+    level styles of the main axes.
+
+    :param ax: the main axes of the mosaic plot
+    """
+    for twin_ax in ax.figure.axes:
+        if twin_ax is not ax:
+            twin_ax.remove()
+
+
 def _wrap_labels(labels):
     """
     labels: list of strings
@@ -115,71 +152,86 @@ def _set_axis_measurement_level (ax, x_measurement_level, y_measurement_level):
 ### Charts for Explore variables ###
 ####################################
 
-def create_variable_raw_chart(pdf, data_measlevs, var_name, data):
+def create_variable_raw_chart(pdf, data_measlevs, var_name, data, rank_cache=None, freqs=None):
     """
 
     :param pdf:
     :param data_measlevs:
     :param var_name:
     :param data:
+    :param rank_cache: cs_stat_num.RankCache of pdf, or None to sort the data here
+    :param freqs: result of cs_stat_num.frequencies() for var_name, or None to count the values here
     :return:
     """
     if data_measlevs[var_name] == 'ord':
-        data_value = pdf[var_name].dropna()
-        data = pd.Series(stats.rankdata(data_value))
+        if rank_cache is None:
+            rank_cache = cs_stat_num.RankCache(pdf)
+        data_value = rank_cache.sorted_values(var_name)  # The original values of the data in sorted order
+        ranks = rank_cache.ranks(var_name)
+        data = pd.Series(ranks[~np.isnan(ranks)])
 
     if data_measlevs[var_name] in ['int', 'ord', 'unk']:
-        fig = plt.figure(figsize=(csc.fig_size_x, csc.fig_size_y * 0.25))
-        ax = plt.gca()
+        fig = _new_figure(figsize=(csc.fig_size_x, csc.fig_size_y * 0.25))
+        ax = fig.add_subplot(111)
         # Add individual data
-        plt.scatter(data, np.random.random(size=len(data)), color=theme_colors[0], marker='o')
+        ax.scatter(data, np.random.random(size=len(data)), color=theme_colors[0], marker='o')
         ax.axes.set_ylim([-1.5, 2.5])
         fig.subplots_adjust(top=0.85, bottom=0.3)
         # Add labels
         if data_measlevs[var_name] == 'ord':
-            plt.title(_plt('Rank of the raw data'))
-            plt.xlabel(_('Rank of %s') % var_name)
+            ax.set_title(_plt('Rank of the raw data'))
+            ax.set_xlabel(_('Rank of %s') % var_name)
         else:
-            plt.title(_plt('Raw data'))
-            plt.xlabel(var_name)
+            ax.set_title(_plt('Raw data'))
+            ax.set_xlabel(var_name)
         ax.axes.get_yaxis().set_visible(False)
         if data_measlevs[var_name] == 'ord':
             ax.tick_params(top=False, right=False)
             # Create new tick labels, with the rank and the value of the corresponding rank
-            ax.set_xticklabels(['%i\n(%s)' % (i, sorted(data_value)[int(i)-1])
+            ax.set_xticklabels(['%i\n(%s)' % (i, data_value[int(i)-1])
                                 if i-1 in range(len(data_value)) else '%i' % i for i in ax.get_xticks()])
             _set_axis_measurement_level(ax, 'ord', 'nom')
     elif data_measlevs[var_name] in ['nom']:
         # For nominal variables the histogram is a frequency graph
-        plt.figure()
-        values = list(set(pdf[var_name]))
-        freqs = [list(pdf[var_name]).count(i) for i in values]
+        fig = _new_figure()
+        ax = fig.add_subplot(111)
+        if freqs is None:
+            freqs = cs_stat_num.frequencies(pdf, var_name)
+        values, freqs, rel_freqs, cum_freqs, cum_rel_freqs, nan_n = freqs
+        if nan_n:
+            values, freqs = values + ['nan'], np.append(freqs, nan_n)
         locs = np.arange(len(values))
-        plt.title(_plt('Histogram'))
-        plt.bar(locs, freqs, 0.9, color=theme_colors[0])
-        plt.xticks(locs+0.9/2., _wrap_labels(values))
-        plt.ylabel(_plt('Frequency'))
-        ax = plt.gca()
+        ax.set_title(_plt('Histogram'))
+        ax.bar(locs, freqs, 0.9, color=theme_colors[0])
+        ax.set_xticks(locs+0.9/2.)
+        ax.set_xticklabels(_wrap_labels(values))
+        ax.set_ylabel(_plt('Frequency'))
         _set_axis_measurement_level(ax, 'nom', 'int')
 
-    return plt.gcf()
+    return fig
 
 
-def create_histogram_chart(pdf, data_measlevs, var_name):
+def create_histogram_chart(pdf, data_measlevs, var_name, rank_cache=None, unique_n=None):
     """Histogram with individual data and boxplot
 
     arguments:
     var_name (str): name of the variable
+    rank_cache (cs_stat_num.RankCache): sort orders of pdf, or None to sort the data here
+    unique_n (int): number of different values of the variable (ties have the same rank, so it is the number of
+        different ranks, too), or None to count them here
     """
     chart_result = ''
     suptitle_text = None
     max_length = 10  # maximum printing length of an item # TODO print ... if it's exceeded
     data = pdf[var_name].dropna()
     if data_measlevs[var_name] == 'ord':
-        data_value = pdf[var_name].dropna()  # The original values of the data
-        data = pd.Series(stats.rankdata(data_value))  # The ranks of the data
+        if rank_cache is None:
+            rank_cache = cs_stat_num.RankCache(pdf)
+        data_value = rank_cache.sorted_values(var_name)  # The original values of the data in sorted order
+        ranks = rank_cache.ranks(var_name)
+        data = pd.Series(ranks[~np.isnan(ranks)])  # The ranks of the data
     if data_measlevs[var_name] in ['int', 'ord', 'unk']:
-        categories_n = len(set(data))
+        categories_n = len(set(data)) if unique_n is None else unique_n
         if categories_n < 10:
             freq, edge = np.histogram(data, bins=categories_n)
         else:
@@ -194,45 +246,41 @@ def create_histogram_chart(pdf, data_measlevs, var_name):
         val_count = (val_count * (max(freq) / max(val_count))) / 20.0
 
         # Upper part with histogram and individual data
-        plt.figure()
-        ax_up = plt.axes([0.1, 0.3, 0.8, 0.6])
-        plt.hist(data.values, bins=len(edge) - 1, color=theme_colors[0])
+        fig = _new_figure()
+        ax_up = fig.add_axes([0.1, 0.3, 0.8, 0.6])
+        ax_up.hist(data.values, bins=len(edge) - 1, color=theme_colors[0])
         # .values needed, otherwise it gives error if the first case is missing data
         # Add individual data
-        plt.errorbar(np.array(val_count.index), np.zeros(val_count.shape),
-                     yerr=[np.zeros(val_count.shape), val_count.values],
-                     fmt='k|', capsize=0, linewidth=2)
-        # plt.plot(np.array(val_count.index), np.zeros(val_count.shape), 'k|', markersize=10, markeredgewidth=1.5)
+        ax_up.errorbar(np.array(val_count.index), np.zeros(val_count.shape),
+                       yerr=[np.zeros(val_count.shape), val_count.values],
+                       fmt='k|', capsize=0, linewidth=2)
+        # ax_up.plot(np.array(val_count.index), np.zeros(val_count.shape), 'k|', markersize=10, markeredgewidth=1.5)
         # Add labels
         if data_measlevs[var_name] == 'ord':
-            plt.title(_plt('Histogram of rank data with individual data and boxplot'))
+            ax_up.set_title(_plt('Histogram of rank data with individual data and boxplot'))
         else:
-            plt.title(_plt('Histogram with individual data and boxplot'))
+            ax_up.set_title(_plt('Histogram with individual data and boxplot'))
         if suptitle_text:
-            plt.suptitle(suptitle_text, x=0.9, y=0.025, horizontalalignment='right', fontsize=10)
-        plt.gca().axes.get_xaxis().set_visible(False)
-        plt.ylabel(_plt('Frequency'))
+            fig.suptitle(suptitle_text, x=0.9, y=0.025, horizontalalignment='right', fontsize=10)
+        ax_up.axes.get_xaxis().set_visible(False)
+        ax_up.set_ylabel(_plt('Frequency'))
         # Lower part showing the boxplot
-        ax_low = plt.axes([0.1, 0.1, 0.8, 0.2], sharex=ax_up)
-        box1 = plt.boxplot(data.values, vert=0,
-                           whis='range')  # .values needed, otherwise error when the first case is missing data
-        plt.gca().axes.get_yaxis().set_visible(False)
+        ax_low = fig.add_axes([0.1, 0.1, 0.8, 0.2], sharex=ax_up)
+        box1 = ax_low.boxplot(data.values, vert=0,
+                              whis='range')  # .values needed, otherwise error when the first case is missing data
+        ax_low.axes.get_yaxis().set_visible(False)
         if data_measlevs[var_name] == 'ord':
-            plt.xlabel(_('Rank of %s') % var_name)
+            ax_low.set_xlabel(_('Rank of %s') % var_name)
         else:
-            plt.xlabel(var_name)
-        plt.setp(box1['boxes'], color=theme_colors[0])
-        plt.setp(box1['whiskers'], color=theme_colors[0])
-        plt.setp(box1['caps'], color=theme_colors[0])
-        plt.setp(box1['medians'], color=theme_colors[0])
-        plt.setp(box1['fliers'], color=theme_colors[0])
+            ax_low.set_xlabel(var_name)
+        _set_boxplot_color(box1)
         if data_measlevs[var_name] == 'ord':
             ax_low.tick_params(top=False, right=False)
             # Create new tick labels, with the rank and the value of the corresponding rank
-            ax_low.set_xticklabels(['%i\n(%s)' % (i, sorted(data_value)[int(i - 1)])
+            ax_low.set_xticklabels(['%i\n(%s)' % (i, data_value[int(i - 1)])
                                     if i - 1 in range(len(data_value)) else '%i' % i for i in ax_low.get_xticks()])
             _set_axis_measurement_level(ax_low, 'ord', 'int')
-        chart_result = plt.gcf()
+        chart_result = fig
     # For nominal variables the histogram is a frequency graph, which has already been displayed in the Raw data, so it
     # is not repeated here
     return chart_result
@@ -249,65 +297,64 @@ def create_normality_chart(data, var_name):
 
     # Prepare the frequencies for the plot
     val_count = data.value_counts()
-    plt.figure()  # Otherwise the next plt.hist will modify the actual (previously created) graph
-    n, bins, patches = plt.hist(data.values, normed=True, color=theme_colors[0])
+    n, bins = np.histogram(data.values, density=True)
     if max(val_count) > 1:
         suptitle_text = _plt('Largest tick on the x axes displays %d cases.') % max(val_count)
     val_count = (val_count * (max(n) / max(val_count))) / 20.0
 
     # Graph
-    plt.figure()
-    n, bins, patches = plt.hist(data.values, normed=True, color=theme_colors[0])
-    plt.plot(bins, matplotlib.pylab.normpdf(bins, np.mean(data), np.std(data)), color=theme_colors[1], linestyle='--',
-             linewidth=3)
-    plt.title(_plt('Histogram with individual data and normal distribution'))
+    normality_histogram = _new_figure()
+    ax = normality_histogram.add_subplot(111)
+    ax.hist(data.values, bins=bins, density=True, color=theme_colors[0])
+    ax.plot(bins, stats.norm.pdf(bins, np.mean(data), np.std(data)), color=theme_colors[1], linestyle='--',
+            linewidth=3)
+    ax.set_title(_plt('Histogram with individual data and normal distribution'))
     if suptitle_text:
-        plt.suptitle(suptitle_text, x=0.9, y=0.025, horizontalalignment='right', fontsize=10)
-    plt.errorbar(np.array(val_count.index), np.zeros(val_count.shape),
-                 yerr=[np.zeros(val_count.shape), val_count.values],
-                 fmt='k|', capsize=0, linewidth=2)
-    #    plt.plot(data, np.zeros(data.shape), 'k+', ms=10, mew=1.5)
+        normality_histogram.suptitle(suptitle_text, x=0.9, y=0.025, horizontalalignment='right', fontsize=10)
+    ax.errorbar(np.array(val_count.index), np.zeros(val_count.shape),
+                yerr=[np.zeros(val_count.shape), val_count.values],
+                fmt='k|', capsize=0, linewidth=2)
+    #    ax.plot(data, np.zeros(data.shape), 'k+', ms=10, mew=1.5)
     # individual data
-    plt.xlabel(var_name)
-    plt.ylabel(_('Normalized relative frequency'))
+    ax.set_xlabel(var_name)
+    ax.set_ylabel(_('Normalized relative frequency'))
 
     # percent on y axes http://matplotlib.org/examples/pylab_examples/histogram_percent_demo.html
     def to_percent(y, position):
         s = str(100 * y)
         return s + r'$\%$' if matplotlib.rcParams['text.usetex'] is True else s + '%'
 
-    from matplotlib.ticker import FuncFormatter
-    plt.gca().yaxis.set_major_formatter(FuncFormatter(to_percent))
-
-    normality_histogram = plt.gcf()
+    ax.yaxis.set_major_formatter(FuncFormatter(to_percent))
 
     # QQ plot
-    fig = plt.figure()
-    ax = fig.add_subplot(111)
-    sm.graphics.qqplot(data, line='s', ax=ax)  # TODO set the color
-    plt.title(_plt('Quantile-quantile plot'))
-    qq_plot = plt.gcf()
+    qq_plot = _new_figure()
+    ax = qq_plot.add_subplot(111)
+    from statsmodels.graphics.gofplots import qqplot
+    qqplot(data, line='s', ax=ax)  # TODO set the color
+    ax.set_title(_plt('Quantile-quantile plot'))
 
     return normality_histogram, qq_plot
 
 
 def create_variable_population_chart(data, var_name, ci):
-    plt.figure(figsize=(csc.fig_size_x, csc.fig_size_y * 0.35))
-    plt.barh([1], [data.mean()], xerr=[ci], color=theme_colors[0], ecolor='black')
-    plt.gca().axes.get_yaxis().set_visible(False)
-    plt.xlabel(var_name)  # TODO not visible yet, maybe matplotlib bug, cannot handle figsize consistently
-    plt.title(_plt('Mean value with 95% confidence interval'))
-    return plt.gcf()
+    fig = _new_figure(figsize=(csc.fig_size_x, csc.fig_size_y * 0.35))
+    ax = fig.add_subplot(111)
+    ax.barh([1], [data.mean()], xerr=[ci], color=theme_colors[0], ecolor='black')
+    ax.axes.get_yaxis().set_visible(False)
+    ax.set_xlabel(var_name)  # TODO not visible yet, maybe matplotlib bug, cannot handle figsize consistently
+    ax.set_title(_plt('Mean value with 95% confidence interval'))
+    return fig
 
 
 def create_variable_popuplation_chart_2(data, var_name):
     # TODO merge with create_variable_popuplation_chart
-    plt.figure(figsize=(csc.fig_size_x, csc.fig_size_y * 0.35))
-    plt.barh([1], [np.median(data)], color=theme_colors[0], ecolor='black')  # TODO error bar
-    plt.gca().axes.get_yaxis().set_visible(False)
-    plt.xlabel(var_name)  # TODO not visible yet, maybe matplotlib bug, cannot handle figsize consistently
-    plt.title(_plt('Median value'))
-    return plt.gcf()
+    fig = _new_figure(figsize=(csc.fig_size_x, csc.fig_size_y * 0.35))
+    ax = fig.add_subplot(111)
+    ax.barh([1], [np.median(data)], color=theme_colors[0], ecolor='black')  # TODO error bar
+    ax.axes.get_yaxis().set_visible(False)
+    ax.set_xlabel(var_name)  # TODO not visible yet, maybe matplotlib bug, cannot handle figsize consistently
+    ax.set_title(_plt('Median value'))
+    return fig
 
 
 #########################################
@@ -345,7 +392,7 @@ def create_variable_pair_chart(data, meas_lev, slope, intercept, x, y, data_fram
         xy_freq *= 20.0
 
         # Draw figure
-        fig = plt.figure()
+        fig = _new_figure()
         ax = fig.add_subplot(111)
         if meas_lev == 'int':
             # Display the data
@@ -356,7 +403,7 @@ def create_variable_pair_chart(data, meas_lev, slope, intercept, x, y, data_fram
                 fit_y = [slope*i+intercept for i in fit_x]
                 ax.plot(fit_x, fit_y, color=theme_colors[0])
             # Set the labels
-            plt.title(_plt('Scatterplot of the variables'))
+            ax.set_title(_plt('Scatterplot of the variables'))
             ax.set_xlabel(x)
             ax.set_ylabel(y)
         elif meas_lev == 'ord':
@@ -367,47 +414,87 @@ def create_variable_pair_chart(data, meas_lev, slope, intercept, x, y, data_fram
             ax.set_ylim(0, len(yvalues)+1)
             ax.tick_params(top=False, right=False)
             # Create new tick labels, with the rank and the value of the corresponding rank
-            ax.set_xticklabels(['%i\n(%s)' % (i, sorted(xvalues)[int(i-1)])
+            xvalues, yvalues = sorted(xvalues), sorted(yvalues)
+            ax.set_xticklabels(['%i\n(%s)' % (i, xvalues[int(i-1)])
                                 if i-1 in range(len(xvalues)) else '%i' % i for i in ax.get_xticks()])
             try:
-                ax.set_yticklabels(['%i\n(%s)' % (i, sorted(yvalues)[int(i-1)])
+                ax.set_yticklabels(['%i\n(%s)' % (i, yvalues[int(i-1)])
                                 if i-1 in range(len(yvalues)) else '%i' % i for i in ax.get_yticks()],
                                wrap=True)
             except:  # for matplotlib before 1.5
-                ax.set_yticklabels(['%i\n(%s)' % (i, sorted(yvalues)[int(i-1)])
+                ax.set_yticklabels(['%i\n(%s)' % (i, yvalues[int(i-1)])
                                 if i-1 in range(len(yvalues)) else '%i' % i for i in ax.get_yticks()])
             _set_axis_measurement_level(ax, 'ord', 'ord')
             # Display the labels
-            plt.title(_plt('Scatterplot of the rank of the variables'))
+            ax.set_title(_plt('Scatterplot of the rank of the variables'))
             ax.set_xlabel(_plt('Rank of %s') % x)
             ax.set_ylabel(_plt('Rank of %s') % y)
         if suptitle_text:
-            plt.suptitle(suptitle_text, x=0.9, y=0.025, horizontalalignment='right', fontsize=10)
-        graph = plt.gcf()
+            fig.suptitle(suptitle_text, x=0.9, y=0.025, horizontalalignment='right', fontsize=10)
+        graph = fig
     elif meas_lev in ['nom']:
+        from statsmodels.graphics.mosaicplot import mosaic
         cont_table_data = pd.crosstab(data_frame[y], data_frame[x])#, rownames = [x], colnames = [y]) # TODO use data instead?
 
         #mosaic(data_frame, [x, y])  # Previous version
+        fig = _new_figure()
+        ax = fig.add_subplot(111)
         if 0 in cont_table_data.values:
-            fig, rects = mosaic(cont_table_data.unstack()+1e-9, label_rotation=[0.0, 90.0])
+            fig, rects = mosaic(cont_table_data.unstack()+1e-9, label_rotation=[0.0, 90.0], ax=ax)
             # this is a workaround for mosaic limitation, which cannot draw cells with 0 frequency
             # see https://github.com/cogstat/cogstat/issues/1
         else:
-            fig, rects = mosaic(cont_table_data.unstack(), label_rotation=[0.0, 90.0])
+            fig, rects = mosaic(cont_table_data.unstack(), label_rotation=[0.0, 90.0], ax=ax)
         fig.set_facecolor(csc.bg_col)
-        ax = plt.subplot(111)
+        _remove_twin_axes(ax)
         ax.set_xlabel(x)
         ax.set_ylabel(y)
-        plt.title(_plt('Mosaic plot of the variables'))
+        ax.set_title(_plt('Mosaic plot of the variables'))
         _set_axis_measurement_level(ax, 'nom', 'nom')
         try:
-            graph = plt.gcf()
+            graph = fig
         except:  # in some cases mosaic cannot be drawn  # TODO how to solve this?
             print('Error, the mosaic plot can not be drawn with those data.')
 
     return graph
 
 
+def create_correlation_heatmap(r, var_names, rank=False):
+    """Heatmap of a correlation matrix
+
+    With many variables the variable names and the coefficients are not displayed in the cells.
+
+    :param r: 2d numpy array of the correlation coefficients
+    :param var_names: names of the variables in the order of the matrix
+    :param rank: the coefficients are Spearman's rank-order correlations
+    :return: matplotlib Figure
+    """
+    fig = _new_figure(figsize=(csc.fig_size_x, csc.fig_size_x * 0.8))
+    ax = fig.add_subplot(111)
+    image = ax.imshow(np.ma.masked_invalid(r), cmap='RdBu_r', vmin=-1, vmax=1, interpolation='nearest')
+    fig.colorbar(image, ax=ax)
+    if len(var_names) <= 30:
+        ax.set_xticks(np.arange(len(var_names)))
+        ax.set_xticklabels(var_names, rotation=90)
+        ax.set_yticks(np.arange(len(var_names)))
+        ax.set_yticklabels(var_names)
+    else:
+        ax.set_xticks([])
+        ax.set_yticks([])
+    if len(var_names) <= 10:
+        for i, j in zip(*np.nonzero(~np.isnan(r))):
+            ax.text(j, i, '%0.2f' % r[i, j], horizontalalignment='center', verticalalignment='center',
+                    color='white' if abs(r[i, j]) > 0.5 else 'black', fontsize=8)
+    ax.tick_params(top=False, right=False)
+    ax.grid(False)
+    if rank:
+        ax.set_title(_plt("Spearman's rank-order correlation of the variables"))
+    else:
+        ax.set_title(_plt("Pearson's correlation of the variables"))
+    fig.tight_layout()
+    return fig
+
+
 #########################################
 ### Charts for Repeated measures vars ###
 #########################################
@@ -427,12 +514,12 @@ def create_repeated_measures_sample_chart(data, var_names, meas_level, data_fram
         # TODO is it OK for ordinals?
         variables = np.array(data)
 
-        fig = plt.figure()
+        fig = _new_figure()
         ax = fig.add_subplot(111)
         if raw_data:
-            plt.title(_plt('Individual data of the variables'))
+            ax.set_title(_plt('Individual data of the variables'))
         else:
-            plt.title(_plt('Boxplots and individual data of the variables'))
+            ax.set_title(_plt('Boxplots and individual data of the variables'))
         # Display individual data
         for i in range(len(variables.transpose()) - 1):  # for all pairs
             # Prepare the frequencies for the plot
@@ -449,24 +536,21 @@ def create_repeated_measures_sample_chart(data, var_names, meas_level, data_fram
                 # TODO put text to chart
                 intro_result = '\n' + _('Thickest line displays %d cases.') % max_freq + '\n'
             for data1, data2, data_freq in zip(xvalues, yvalues, xy_freq):
-                plt.plot([i + 1, i + 2], [data1, data2], '-', color=csc.ind_line_col, lw=data_freq)
+                ax.plot([i + 1, i + 2], [data1, data2], '-', color=csc.ind_line_col, lw=data_freq)
 
         # Display boxplots
         if not raw_data:
             box1 = ax.boxplot(variables, whis='range')
-            # ['medians', 'fliers', 'whiskers', 'boxes', 'caps']
-            plt.setp(box1['boxes'], color=theme_colors[0])
-            plt.setp(box1['whiskers'], color=theme_colors[0])
-            plt.setp(box1['caps'], color=theme_colors[0])
-            plt.setp(box1['medians'], color=theme_colors[0])
-            plt.setp(box1['fliers'], color=theme_colors[0])
+            _set_boxplot_color(box1)
         else:
             ax.set_xlim(0.5, len(var_names) + 0.5)
-        plt.xticks(list(range(1, len(var_names) + 1)), _wrap_labels(var_names))
-        plt.ylabel(_('Value'))
-        graph = plt.gcf()
+        ax.set_xticks(list(range(1, len(var_names) + 1)))
+        ax.set_xticklabels(_wrap_labels(var_names))
+        ax.set_ylabel(_('Value'))
+        graph = fig
     elif meas_level == 'nom':
         import itertools
+        from statsmodels.graphics.mosaicplot import mosaic
         graph = []
         for var_pair in itertools.combinations(var_names, 2):
             # workaround to draw mosaic plots with zero cell, see #1
@@ -474,18 +558,20 @@ def create_repeated_measures_sample_chart(data, var_names, meas_level, data_fram
             ct = pd.crosstab(data_frame[var_pair[0]], data_frame[var_pair[1]]).sort_index(axis='index',
                                                                                           ascending=False) \
                 .unstack()
+            fig = _new_figure()
+            ax = fig.add_subplot(111)
             if 0 in ct.values:
-                fig, rects = mosaic(ct + 1e-9, label_rotation=[0.0, 90.0])
+                fig, rects = mosaic(ct + 1e-9, label_rotation=[0.0, 90.0], ax=ax)
             else:
-                fig, rects = mosaic(ct, label_rotation=[0.0, 90.0])
+                fig, rects = mosaic(ct, label_rotation=[0.0, 90.0], ax=ax)
             fig.set_facecolor(csc.bg_col)
-            ax = plt.subplot(111)
+            _remove_twin_axes(ax)
             ax.set_xlabel(var_pair[1])
             ax.set_ylabel(var_pair[0])
-            plt.title(_plt('Mosaic plot of the variables'))
+            ax.set_title(_plt('Mosaic plot of the variables'))
             _set_axis_measurement_level(ax, 'nom', 'nom')
             try:
-                graph.append(plt.gcf())
+                graph.append(fig)
             except:  # in some cases mosaic cannot be drawn  # TODO how to solve this?
                 intro_result = '\n' + _('Sorry, the mosaic plot can not be drawn with those data.')
     return graph
@@ -497,24 +583,26 @@ def create_repeated_measures_population_chart(data, var_names, meas_level, data_
     graph = None
     if meas_level in ['int', 'unk']:
         # ord is excluded at the moment
-        fig = plt.figure()
+        fig = _new_figure()
         ax = fig.add_subplot(111)
 
         if meas_level in ['int', 'unk']:
-            plt.title(_plt('Means and 95% confidence intervals for the variables'))
+            ax.set_title(_plt('Means and 95% confidence intervals for the variables'))
+            data = cs_util.upcast(data)
             means = np.mean(data)
             cis, cils, cihs = cs_stat.confidence_interval_t(data, ci_only=False)
             ax.bar(list(range(len(data.columns))), means, 0.5, yerr=cis, align='center',
                    color=theme_colors[0], ecolor='0')
 
         elif meas_level in ['ord']:
-            plt.title(_plt('Medians for the variables'))
+            ax.set_title(_plt('Medians for the variables'))
             medians = np.median(data)
             ax.bar(list(range(len(data.columns))), medians, 0.5, align='center',
                    color=theme_colors[0], ecolor='0')
-        plt.xticks(list(range(len(var_names))), _wrap_labels(var_names))
-        plt.ylabel(_plt('Value'))
-        graph = plt.gcf()
+        ax.set_xticks(list(range(len(var_names))))
+        ax.set_xticklabels(_wrap_labels(var_names))
+        ax.set_ylabel(_plt('Value'))
+        graph = fig
     return graph
 
 
@@ -523,7 +611,8 @@ def create_repeated_measures_population_chart(data, var_names, meas_level, data_
 #################################
 
 
-def create_compare_groups_sample_chart(data_frame, meas_level, var_names, groups, group_levels, raw_data_only=False):
+def create_compare_groups_sample_chart(data_frame, meas_level, var_names, groups, group_levels, raw_data_only=False,
+                                       rank_cache=None):
     """Display the boxplot of the groups with individual data or the mosaic plot
 
     :param data_frame: The data frame
@@ -533,6 +622,7 @@ def create_compare_groups_sample_chart(data_frame, meas_level, var_names, groups
     :param group_levels: List of lists or tuples with group levels (1 grouping variable) or group level combinations
     (more than 1 grouping variables)
     :param raw_data_only: Only the raw data are displayed
+    :param rank_cache: cs_stat_num.RankCache of data_frame, or None to sort the data here
     :return:
     """
     if meas_level in ['int', 'ord']:  # TODO 'unk'?
@@ -541,82 +631,86 @@ def create_compare_groups_sample_chart(data_frame, meas_level, var_names, groups
         # group the raw the data according to the level combinations
         if len(groups) == 1:
             group_levels = [[group_level] for group_level in group_levels]
-        variables = [data_frame[var_names[0]][(data_frame[groups] == pd.Series({group: level for group, level in zip(groups, group_level)})).all(axis=1)].dropna() for group_level in group_levels]
-        if meas_level == 'ord':  # Calculate the rank information # FIXME is there a more efficient way to do this?
-            index_ranks = dict(list(zip(pd.concat(variables).index, stats.rankdata(pd.concat(variables)))))
-            variables_value = pd.concat(variables).values  # original values
-            for var_i in range(len(variables)):  # For all groups
-                for i in variables[var_i].index:  # For all values in that group
-                    variables[var_i][i] = index_ranks[i]
-                    #print i, variables[var_i][i], index_ranks[i]
+        level_combinations, grouped_data = cs_stat._split_into_groups(data_frame, var_names[0], groups)
+        grouped_data = dict(zip(level_combinations, grouped_data))
+        variables = [grouped_data[tuple(group_level)] for group_level in group_levels]
+        if meas_level == 'ord':  # Calculate the rank information
+            if rank_cache is None:
+                rank_cache = cs_stat_num.RankCache(data_frame)
+            valid_cases = data_frame[groups].notna().all(axis=1).values
+            variables_value = rank_cache.sorted_values(var_names[0], valid_cases)  # original values in sorted order
+            variables = [rank_cache.ranks_of(var_names[0], variable, valid_cases) for variable in variables]
+        variables = [pd.Series(variable) for variable in variables]
         # TODO graph: mean, etc.
         #means = [np.mean(self.data_values[self.data_names.index(var_name)]) for var_name in var_names]
         #stds = [np.std(self.data_values[self.data_names.index(var_name)]) for var_name in var_names]
         #rects1 = ax.bar(range(1,len(variables)+1), means, color=theme_colors[0], yerr=stds)
         # Create graph
-        fig = plt.figure()
+        fig = _new_figure()
         ax = fig.add_subplot(111)
         # Add boxplot
         if not raw_data_only:
             box1 = ax.boxplot(variables, whis='range')
-            plt.setp(box1['boxes'], color=theme_colors[0])
-            plt.setp(box1['whiskers'], color=theme_colors[0])
-            plt.setp(box1['caps'], color=theme_colors[0])
-            plt.setp(box1['medians'], color=theme_colors[0])
-            plt.setp(box1['fliers'], color=theme_colors[0])
+            _set_boxplot_color(box1)
         # Display individual data
         for var_i in range(len(variables)):
             val_count = variables[var_i].value_counts()
+            if val_count.empty:  # level combination without cases
+                continue
             max_freq = max(val_count)
             if max_freq>10:
                 val_count = (val_count-1)/((max_freq-1)/9.0)+1
                 # largest dot shouldn't be larger than 10 × of the default size
                 # smallest dot is 1 unit size
-                plt.suptitle(_plt('Largest individual sign displays %d cases.') % max_freq, x=0.9, y=0.025,
+                fig.suptitle(_plt('Largest individual sign displays %d cases.') % max_freq, x=0.9, y=0.025,
                              horizontalalignment='right', fontsize=10)
             ax.scatter(np.ones(len(val_count))+var_i, val_count.index, val_count.values*5, color='#808080', marker='o')
-            #plt.plot(np.ones(len(variables[i]))+i, variables[i], '.', color = '#808080', ms=3) # TODO color should be used from ini file
+            #ax.plot(np.ones(len(variables[i]))+i, variables[i], '.', color = '#808080', ms=3) # TODO color should be used from ini file
         # Add labels
-        plt.xticks(list(range(1, len(group_levels)+1)), _wrap_labels([' : '.join(map(str, group_level)) for group_level in group_levels]))
-        plt.xlabel(' : '.join(groups))
+        ax.set_xticks(list(range(1, len(group_levels)+1)))
+        ax.set_xticklabels(_wrap_labels([' : '.join(map(str, group_level)) for group_level in group_levels]))
+        ax.set_xlabel(' : '.join(groups))
         if meas_level == 'ord':
-            plt.ylabel(_('Rank of %s') % var_names[0])
+            ax.set_ylabel(_('Rank of %s') % var_names[0])
             if raw_data_only:
-                plt.title(_plt('Individual data of the rank data of the groups'))
+                ax.set_title(_plt('Individual data of the rank data of the groups'))
             else:
-                plt.title(_plt('Boxplots and individual data of the rank data of the groups'))
+                ax.set_title(_plt('Boxplots and individual data of the rank data of the groups'))
             ax.tick_params(top=False, right=False)
             # Create new tick labels, with the rank and the value of the corresponding rank
             try:
-                ax.set_yticklabels(['%i\n(%s)' % (i, sorted(variables_value)[int(i)-1])
+                ax.set_yticklabels(['%i\n(%s)' % (i, variables_value[int(i)-1])
                                     if i-1 in range(len(variables_value)) else '%i' % i for i in ax.get_yticks()],
                                    wrap=True)
             except:  # for matplotlib before 1.5
-                ax.set_yticklabels(['%i\n(%s)' % (i, sorted(variables_value)[int(i)-1])
+                ax.set_yticklabels(['%i\n(%s)' % (i, variables_value[int(i)-1])
                                     if i-1 in range(len(variables_value)) else '%i' % i for i in ax.get_yticks()])
             _set_axis_measurement_level(ax, 'nom', 'ord')
         else:
-            plt.ylabel(var_names[0])
+            ax.set_ylabel(var_names[0])
             if raw_data_only:
-                plt.title(_plt('Individual data of the groups'))
+                ax.set_title(_plt('Individual data of the groups'))
             else:
-                plt.title(_plt('Boxplots and individual data of the groups'))
+                ax.set_title(_plt('Boxplots and individual data of the groups'))
             _set_axis_measurement_level(ax, 'nom', 'int')
         graph = fig
     elif meas_level in ['nom']:
+        from statsmodels.graphics.mosaicplot import mosaic
         # workaround to draw mosaic plots with zero cell, see #1
         #fig, rects = mosaic(data_frame, [groups[0], var_names[0]])  # previous version
         ct = pd.crosstab(data_frame[var_names[0]], [data_frame[groups[i]] for i in range(len(groups))]).sort_index(axis='index', ascending=False).unstack()
         #print ct
+        fig = _new_figure()
+        ax = fig.add_subplot(111)
         if 0 in ct.values:
-            fig, rects = mosaic(ct+1e-9, label_rotation=[0.0, 90.0])
+            fig, rects = mosaic(ct+1e-9, label_rotation=[0.0, 90.0], ax=ax)
         else:
-            fig, rects = mosaic(ct, label_rotation=[0.0, 90.0])
+            fig, rects = mosaic(ct, label_rotation=[0.0, 90.0], ax=ax)
         fig.set_facecolor(csc.bg_col)
-        ax = plt.subplot(111)
+        _remove_twin_axes(ax)
         ax.set_xlabel(' : '.join(groups))
         ax.set_ylabel(var_names[0])
-        plt.title(_plt('Mosaic plot of the groups'))
+        ax.set_title(_plt('Mosaic plot of the groups'))
         _set_axis_measurement_level(ax, 'nom', 'nom')
         try:
             graph = fig
@@ -635,29 +729,29 @@ def create_compare_groups_population_chart(data_frame, meas_level, var_names, gr
     #        group_levels = [[group_level] for group_level in group_levels]
     if meas_level in ['int', 'unk']:
         # ord is excluded at the moment
-        fig = plt.figure()
+        fig = _new_figure()
         ax = fig.add_subplot(111)
 
-        pdf = data_frame.dropna(subset=[var_names[0]])[[var_names[0]] + groups]
+        pdf = cs_util.upcast(data_frame.dropna(subset=[var_names[0]])[[var_names[0]] + groups])
         if meas_level in ['int', 'unk']:
-            plt.title(_plt('Means and 95% confidence intervals for the groups'))
-            means = pdf.groupby(groups, sort=False).aggregate(np.mean)[var_names[0]]
-            cis = pdf.groupby(groups, sort=False).aggregate(cs_stat.confidence_interval_t)[var_names[0]]
-            ax.bar(list(range(len(means.values))), means.reindex(group_levels), 0.5,
+            ax.set_title(_plt('Means and 95% confidence intervals for the groups'))
+            means = pdf.groupby(groups, sort=False, observed=True).aggregate(np.mean)[var_names[0]]
+            cis = pdf.groupby(groups, sort=False, observed=True).aggregate(cs_stat.confidence_interval_t)[var_names[0]]
+            ax.bar(list(range(len(group_levels))), means.reindex(group_levels), 0.5,
                    yerr=np.array(cis.reindex(group_levels)),
                    align='center', color=theme_colors[0], ecolor='0')
             # pandas series is converted to np.array to be able to handle numeric indexes (group levels)
             _set_axis_measurement_level(ax, 'nom', 'int')
         elif meas_level in ['ord']:
-            plt.title(_plt('Medians for the groups'))
-            medians = pdf.groupby(groups[0], sort=False).aggregate(np.median)[var_names[0]]
-            ax.bar(list(range(len(medians.values))), medians.reindex(group_levels), 0.5, align='center',
+            ax.set_title(_plt('Medians for the groups'))
+            medians = pdf.groupby(groups[0], sort=False, observed=True).aggregate(np.median)[var_names[0]]
+            ax.bar(list(range(len(group_levels))), medians.reindex(group_levels), 0.5, align='center',
                    color=theme_colors[0], ecolor='0')
         if len(groups) == 1:
             group_levels = [[group_level] for group_level in group_levels]
-        plt.xticks(list(range(len(group_levels))),
-                   _wrap_labels([' : '.join(map(str, group_level)) for group_level in group_levels]))
-        plt.xlabel(' : '.join(groups))
-        plt.ylabel(var_names[0])
+        ax.set_xticks(list(range(len(group_levels))))
+        ax.set_xticklabels(_wrap_labels([' : '.join(map(str, group_level)) for group_level in group_levels]))
+        ax.set_xlabel(' : '.join(groups))
+        ax.set_ylabel(var_names[0])
         graph = fig
     return graph
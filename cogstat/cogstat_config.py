@@ -42,6 +42,26 @@ except:
     graph_font_size = config['style']['graph font size']
 versions = {}  # To be modified from cogstat.py
 
+# Number of intermediate results (descriptives, test results, charts) stored per data set
+analysis_cache_size = 64
+
+# Text files are imported in chunks to limit the memory needed for large files
+import_chunk_size = 100000  # number of rows read at once
+import_downcast = False  # store integer variables in the smallest integer type that can hold their values
+import_float32 = False  # store interval variables in 32 bit floats if all their values can be stored exactly
+
+# Imported data files are stored in a binary format (if pyarrow is available), so that opening them again is faster
+import_cache = True
+import_cache_dir = os.path.join(dirs.user_cache_dir, 'imported_data')
+import_cache_min_size = 10 * 2**20  # only files larger than this (in bytes) are stored
+import_cache_max_size = 2 * 2**30  # least recently used files are removed above this size (in bytes)
+import_cache_max_age = 30  # files not used for this many days are removed
+
+# Maximum number of excluded cases displayed when filtering the data
+filter_report_max_cases = 100
+# Normality is checked with the Shapiro-Wilk test up to this sample size, and with the D'Agostino-Pearson test above it
+normality_shapiro_max_n = 5000
+
 
 def save(keys, value):
     if len(keys)==2:
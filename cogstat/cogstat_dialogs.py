@@ -337,9 +337,9 @@ class preferences_dialog(QtWidgets.QDialog, preferences.Ui_Dialog):
     def init_themes(self):
         """Set the available themes.
         """
-        import matplotlib.pyplot as plt
+        import matplotlib.style
 
-        themes = sorted(plt.style.available)
+        themes = sorted(matplotlib.style.available)
         self.themeComboBox.clear()
         for theme in themes:
             self.themeComboBox.addItem(theme)
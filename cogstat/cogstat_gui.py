@@ -21,6 +21,7 @@ splash_screen.showMessage('', Qt.AlignBottom, Qt.white)  # TODO find something e
 import sys
 import os
 import webbrowser
+import functools
 import gettext
 import logging
 import traceback
@@ -51,6 +52,58 @@ rtl_lang = True if csc.language in ['he', 'fa', 'ar'] else False
 broken_analysis = '<default>'+_('%s Oops, something went wrong, CogStat could not run the analysis. You may want to report it.') \
                   + ' ' + _('Read more about how to report an issue <a href = "%s">here</a>.') \
                   % 'https://github.com/cogstat/cogstat/wiki/Report-a-bug'
+broken_import = '<default>' + _('Open data. Oops, something went wrong, CogStat could not open the data. You may want to report the issue.') \
+                + ' ' + _('Read more about how to report an issue <a href = "%s">here</a>.') \
+                % 'https://github.com/cogstat/cogstat/wiki/Report-a-bug'
+
+
+class AnalysisThread(QtCore.QThread):
+    """Run imports and analyses in a worker thread, so that the GUI remains responsive.
+
+    The functions are run one after the other. The result of a function is sent in the result_ready signal as soon as
+    it is ready, and its traceback is sent in the failed signal if it raises an exception. The stages of the running
+    function are sent in the progress signal (see report_progress()).
+    """
+    progress = QtCore.pyqtSignal(int, str)  # index of the running function, name of the stage
+    result_ready = QtCore.pyqtSignal(int, object)  # index of the function, its result
+    failed = QtCore.pyqtSignal(int, str)  # index of the function, traceback
+
+    def __init__(self, functions, parent=None):
+        """
+        :param functions: list of functions without parameters
+        :param parent: parent QObject
+        """
+        super(AnalysisThread, self).__init__(parent)
+        self.functions = functions
+        self.cancelled = False
+        self._index = 0
+
+    def cancel(self):
+        """Stop the running function at its next stage and skip the remaining functions."""
+        self.cancelled = True
+
+    def report_progress(self, stage):
+        """Progress callback for the CogStatData; it is called in the worker thread.
+
+        :param stage: name of the stage
+        """
+        if self.cancelled:
+            raise cogstat.AnalysisCancelled()
+        self.progress.emit(self._index, stage)
+
+    def run(self):
+        for self._index, function in enumerate(self.functions):
+            if self.cancelled:
+                break
+            try:
+                result = function()
+            except cogstat.AnalysisCancelled:
+                break
+            except Exception:
+                self.failed.emit(self._index, traceback.format_exc())
+            else:
+                self.result_ready.emit(self._index, result)
+
 
 class StatMainWindow(QtWidgets.QMainWindow):
     """
@@ -68,6 +121,7 @@ class StatMainWindow(QtWidgets.QMainWindow):
             if missing_required_components:
                 sys.exit()
         
+        self.active_data = None  # CogStatData instance of the opened data
         self.analysis_results = []
         # analysis_result stores list of GuiResultPackages.
         # It will be useful when we can rerun all the previous analysis in the GUI output
@@ -134,6 +188,7 @@ class StatMainWindow(QtWidgets.QMainWindow):
                             [_('&Analysis'),
                                 ['', _('&Explore variable')+'...', _('Ctrl+1'), 'self.explore_variable'],
                                 ['', _('Explore relation of variable &pair')+'...', _('Ctrl+2'), 'self.explore_variable_pair'],
+                                ['', _('Explore &correlation matrix')+'...', _('Ctrl+3'), 'self.explore_correlation_matrix'],
                                 ['separator'],
                                 ['', _('Pivot &table')+'...', 'Ctrl+T', 'self.pivot'],
                                 ['separator'],
@@ -167,7 +222,8 @@ class StatMainWindow(QtWidgets.QMainWindow):
         # Enable these commands only when active_data is available
         self.analysis_commands = [_('&Save data'), _('Save data &as')+'...', _('&Display data'), _('Display data &briefly'),
                                   _('Pivot &table')+'...', _('&Explore variable')+'...',
-                                  _('Explore relation of variable &pair')+'...', _('Compare repeated measures va&riables')+'...', _('Compare &groups')+'...',
+                                  _('Explore relation of variable &pair')+'...', _('Explore &correlation matrix')+'...',
+                                  _('Compare repeated measures va&riables')+'...', _('Compare &groups')+'...',
                                   _('&Compare groups and variables')+'...']
 
         # Create menus and commands
@@ -216,6 +272,19 @@ class StatMainWindow(QtWidgets.QMainWindow):
         self.setAcceptDrops(True)
         #self.statusBar().showMessage(_('Ready'))
 
+        # Prepare the progress display of the running analyses, see _run_in_background()
+        self._analysis_thread = None
+        self._tasks = []
+        self.progress_label = QtWidgets.QLabel()
+        self.progress_bar = QtWidgets.QProgressBar()
+        self.progress_bar.setMaximumWidth(150)
+        self.cancel_button = QtWidgets.QPushButton(_('Cancel'))
+        self.cancel_button.clicked.connect(self._cancel_analysis)
+        self.statusBar().addWidget(self.progress_label, 1)
+        self.statusBar().addPermanentWidget(self.progress_bar)
+        self.statusBar().addPermanentWidget(self.cancel_button)
+        self._show_progress_widgets(False)
+
         self.unsaved_output = False  # Do not want to save the output with the welcome message
         self.output_filename = ''
         
@@ -291,8 +360,8 @@ class StatMainWindow(QtWidgets.QMainWindow):
         # http://qt-project.org/doc/qt-4.7/qt.html see CursorShape
         # http://qt-project.org/doc/qt-4.7/qapplication.html#id-19f00dae-ec43-493e-824c-ef07ce96d4c6
         if on:
-            QtWidgets.QApplication.setOverrideCursor(QtGui.QCursor(QtCore.Qt.WaitCursor))
-            #QtGui.QApplication.setOverrideCursor(QtGui.QCursor(QtCore.Qt.BusyCursor))
+            # The analyses run in the background, so the cursor signals that the Cancel button can be used
+            QtWidgets.QApplication.setOverrideCursor(QtGui.QCursor(QtCore.Qt.BusyCursor))
         else:
             while QtWidgets.QApplication.overrideCursor() is not None:
                 # TODO if for some reason (unhandled exception) the cursor was not set back formerly,
@@ -320,7 +389,95 @@ class StatMainWindow(QtWidgets.QMainWindow):
             else:
                 logging.error('Unknown output type: %s' % type(output))
         self.unsaved_output = True
-                        
+
+    def _show_progress_widgets(self, on):
+        for widget in [self.progress_label, self.progress_bar, self.cancel_button]:
+            widget.setVisible(on)
+
+    def _run_in_background(self, tasks):
+        """Run imports or analyses in a worker thread, and print their results as soon as they are ready.
+
+        Only one task list can run at the same time; while it is running, the data and analysis menus are disabled.
+
+        :param tasks: list of (title, function, handler, error_message) tuples
+            title: name of the task displayed in the status bar
+            function: function without parameters, it runs in the worker thread
+            handler: function called in the main thread with the result of the function
+            error_message: output displayed if the function raises an exception
+        """
+        if self._analysis_thread is not None:
+            return
+        self._tasks = tasks
+        self._analysis_thread = AnalysisThread([task[1] for task in tasks], self)
+        self._analysis_thread.progress.connect(self._show_progress)
+        self._analysis_thread.result_ready.connect(self._handle_result)
+        self._analysis_thread.failed.connect(self._handle_failure)
+        self._analysis_thread.finished.connect(self._analysis_finished)
+        for menu in self.menus[:2]:  # Data and Analysis menus
+            menu.setEnabled(False)
+        self._show_data_menus(False)
+        self._busy_signal(True)
+        self.progress_bar.setRange(0, len(tasks))
+        self.progress_bar.setValue(0)
+        self.cancel_button.setEnabled(True)
+        self._show_progress(0, '')
+        self._show_progress_widgets(True)
+        self._analysis_thread.start()
+
+    def _report_progress(self, stage):
+        """Progress callback of the CogStatData; it is called in the worker thread."""
+        if self._analysis_thread is not None:
+            self._analysis_thread.report_progress(stage)
+
+    def _show_progress(self, index, stage):
+        title = self._tasks[index][0]
+        if len(self._tasks) > 1:
+            title += ' (%d/%d)' % (index + 1, len(self._tasks))
+        self.progress_label.setText(title + (': ' + stage if stage else ''))
+
+    def _handle_result(self, index, result):
+        self.progress_bar.setValue(index + 1)
+        self._tasks[index][2](result)
+
+    def _handle_failure(self, index, error_traceback):
+        self.progress_bar.setValue(index + 1)
+        sys.stderr.write(error_traceback)
+        self.analysis_results.append(GuiResultPackage())
+        self.analysis_results[-1].add_output(cs_util.reformat_output(self._tasks[index][3]))
+        self._print_to_output_pane()
+
+    def _cancel_analysis(self):
+        if self._analysis_thread is not None:
+            self._analysis_thread.cancel()
+            self.cancel_button.setEnabled(False)
+            self.progress_label.setText(_('Cancelling...'))
+
+    def _analysis_finished(self):
+        if self._analysis_thread.cancelled:
+            self.analysis_results.append(GuiResultPackage())
+            self.analysis_results[-1].add_output(cs_util.reformat_output('<default>' + _('The analysis was cancelled.')))
+            self._print_to_output_pane()
+        self._analysis_thread.deleteLater()
+        self._analysis_thread = None
+        self._tasks = []
+        self._show_progress_widgets(False)
+        for menu in self.menus[:2]:
+            menu.setEnabled(True)
+        self._show_data_menus(self.active_data is not None)
+        self._busy_signal(False)
+
+    def _add_analysis_result(self, command, result):
+        """Store and print the result of an analysis.
+
+        :param command: command of the analysis (see GuiResultPackage), or None
+        :param result: list of output items
+        """
+        self.analysis_results.append(GuiResultPackage())
+        if command:
+            self.analysis_results[-1].add_command(command)
+        self.analysis_results[-1].add_output(result)
+        self._print_to_output_pane()
+
     ### Data menu methods ###
     def open_file(self, filename=''):
         """Open file.
@@ -351,33 +508,31 @@ class StatMainWindow(QtWidgets.QMainWindow):
     
     def _open_data(self, data):
         """ Core of the import process.
+
+        The data are imported in the background, see _run_in_background().
         """
-        self._busy_signal(True)
-        try:
-            self.active_data = cogstat.CogStatData(data=data)
-            if self.active_data.import_source == _('Import failed'):
-                QtWidgets.QMessageBox.warning(self, _('Import error'), _('Data could not be loaded.'), QtWidgets.QMessageBox.Ok)
-                self._show_data_menus(False)
-            else:
-                self._show_data_menus()
-                '''
-                self.statusBar().showMessage((_('Data loaded from file: ') if self.active_data.import_source[:9] in ['text file', 'SPSS file'] else _('Data loaded from clipboard: '))
-                                            + _('%s variables and %s cases.') % (len(self.active_data.data_frame.columns),
-                                                                                 len(self.active_data.data_frame.index)))
-                '''
-                self.print_data(brief=True, display_import_message=True)
-        except:
-            self.analysis_results.append(GuiResultPackage())
-            self.analysis_results[-1].add_command('self._open_data()')  # TODO
-            self.analysis_results[-1].\
-                add_output(cs_util.reformat_output('<default>' +
-                                                   _('Open data. Oops, something went wrong, CogStat could not open the data. You may want to report the issue.') \
-                                                   + ' ' + _('Read more about how to report an issue <a href = "%s">here</a>.') \
-                                                   % 'https://github.com/cogstat/cogstat/wiki/Report-a-bug'))
-            traceback.print_exc()
-            self._print_to_output_pane()
-        self._busy_signal(False)
-            
+        self._run_in_background([(_('Open data'),
+                                  functools.partial(cogstat.CogStatData, data=data,
+                                                    progress_callback=self._report_progress),
+                                  self._data_opened, broken_import)])
+
+    def _data_opened(self, data):
+        """Use the imported data.
+
+        :param data: CogStatData instance
+        """
+        if data.import_source == _('Import failed'):
+            self.active_data = None
+            QtWidgets.QMessageBox.warning(self, _('Import error'), _('Data could not be loaded.'), QtWidgets.QMessageBox.Ok)
+        else:
+            self.active_data = data
+            '''
+            self.statusBar().showMessage((_('Data loaded from file: ') if self.active_data.import_source[:9] in ['text file', 'SPSS file'] else _('Data loaded from clipboard: '))
+                                        + _('%s variables and %s cases.') % (len(self.active_data.orig_data_frame.columns),
+                                                                             len(self.active_data.data_frame.index)))
+            '''
+            self.print_data(brief=True, display_import_message=True)
+
     def print_data(self, brief=False, display_import_message=False):
         """Print the current data to the output.
         
@@ -413,26 +568,19 @@ class StatMainWindow(QtWidgets.QMainWindow):
             try:
                 self.dial_var_prop
             except:
-                self.dial_var_prop = cogstat_dialogs.explore_var_dialog(names=self.active_data.data_frame.columns)
+                self.dial_var_prop = cogstat_dialogs.explore_var_dialog(names=self.active_data.orig_data_frame.columns)
             else:  # TODO is it not necessary anymore? For all dialogs
-                self.dial_var_prop.init_vars(names=self.active_data.data_frame.columns)
+                self.dial_var_prop.init_vars(names=self.active_data.orig_data_frame.columns)
             if self.dial_var_prop.exec_():
                 var_names, freq, loc_test_value = self.dial_var_prop.read_parameters()
             else:
                 return
-        self._busy_signal(True)
-        try:
-            for var_name in var_names:
-                self.analysis_results.append(GuiResultPackage())
-                self.analysis_results[-1].add_command('self.explore_variable()')  # TODO
-                result = self.active_data.explore_variable(var_name, frequencies=freq, central_value=loc_test_value)
-                self.analysis_results[-1].add_output(result)
-                self._print_to_output_pane()
-        except:
-            self.analysis_results[-1].add_output(cs_util.reformat_output(broken_analysis % _('Explore variable.')))
-            traceback.print_exc()
-            self._print_to_output_pane()
-        self._busy_signal(False)
+        self._run_in_background([(_('Explore variable'),
+                                  functools.partial(self.active_data.explore_variable, var_name, frequencies=freq,
+                                                    central_value=loc_test_value),
+                                  functools.partial(self._add_analysis_result, 'self.explore_variable()'),  # TODO
+                                  broken_analysis % _('Explore variable.'))
+                                 for var_name in var_names])
 
     def explore_variable_pair(self, var_names=None):
         """Explore variable pairs.
@@ -444,36 +592,55 @@ class StatMainWindow(QtWidgets.QMainWindow):
             try:
                 self.dial_var_pair
             except:
-                self.dial_var_pair = cogstat_dialogs.explore_var_pairs_dialog(names=self.active_data.data_frame.columns)
+                self.dial_var_pair = cogstat_dialogs.explore_var_pairs_dialog(names=self.active_data.orig_data_frame.columns)
             else:
-                self.dial_var_pair.init_vars(names=self.active_data.data_frame.columns)
+                self.dial_var_pair.init_vars(names=self.active_data.orig_data_frame.columns)
             if self.dial_var_pair.exec_():
                 var_names = self.dial_var_pair.read_parameters()
             else:
                 return
-        self._busy_signal(True)
         if len(var_names) < 2:  # TODO this check should go to the appropriate dialog
             self.analysis_results.append(GuiResultPackage())
             text_result = cs_util.reformat_output('<default> %s %s'%(_('Explore variable pair.'), _('At least two variables should be set.')))
             self.analysis_results[-1].add_output(text_result)
+            self._print_to_output_pane()
         else:
+            tasks = []
+            for x in var_names:
+                pass_diag = False
+                for y in var_names:
+                    if pass_diag:
+                        tasks.append((_('Explore relation of variable pair'),
+                                      functools.partial(self.active_data.explore_variable_pair, x, y),
+                                      functools.partial(self._add_analysis_result,
+                                                        'self.explore_variable_pair'),  # TODO
+                                      broken_analysis % _('Explore variable pair.')))
+                    if x == y:
+                        pass_diag = True
+            self._run_in_background(tasks)
+
+    def explore_correlation_matrix(self, var_names=None):
+        """Explore the correlation matrix of several variables.
+
+        Arguments:
+        var_names (list): variable names
+        """
+        if not var_names:
             try:
-                for x in var_names:
-                    pass_diag = False
-                    for y in var_names:
-                        if pass_diag:
-                            self.analysis_results.append(GuiResultPackage())
-                            self.analysis_results[-1].add_command('self.explore_variable_pair')  # TODO
-                            result_list = self.active_data.explore_variable_pair(x, y)
-                            self.analysis_results[-1].add_output(result_list)
-                            self._print_to_output_pane()
-                        if x == y:
-                            pass_diag = True
+                self.dial_corr_matrix
             except:
-                self.analysis_results[-1].add_output(cs_util.reformat_output(broken_analysis % _('Explore variable pair.')))
-                traceback.print_exc()
-                self._print_to_output_pane()
-        self._busy_signal(False)
+                self.dial_corr_matrix = cogstat_dialogs.explore_var_pairs_dialog(names=self.active_data.orig_data_frame.columns)
+                self.dial_corr_matrix.setWindowTitle(_('Explore correlation matrix'))
+            else:
+                self.dial_corr_matrix.init_vars(names=self.active_data.orig_data_frame.columns)
+            if self.dial_corr_matrix.exec_():
+                var_names = self.dial_corr_matrix.read_parameters()
+            else:
+                return
+        self._run_in_background([(_('Explore correlation matrix'),
+                                  functools.partial(self.active_data.explore_correlation_matrix, var_names),
+                                  functools.partial(self._add_analysis_result, 'self.explore_correlation_matrix()'),
+                                  broken_analysis % _('Explore correlation matrix.'))])
             
     def pivot(self, depend_names=None, row_names=[], col_names=[], page_names=[], function='Mean'):
         """Build a pivot table.
@@ -487,26 +654,22 @@ class StatMainWindow(QtWidgets.QMainWindow):
             try:
                 self.dial_pivot
             except:
-                self.dial_pivot = cogstat_dialogs.pivot_dialog(names=self.active_data.data_frame.columns)
+                self.dial_pivot = cogstat_dialogs.pivot_dialog(names=self.active_data.orig_data_frame.columns)
             else:
-                self.dial_pivot.init_vars(names=self.active_data.data_frame.columns)
+                self.dial_pivot.init_vars(names=self.active_data.orig_data_frame.columns)
             if self.dial_pivot.exec_():
                 row_names, col_names, page_names, depend_names, function = self.dial_pivot.read_parameters()
             else:
                 return
-        self._busy_signal(True)
-        self.analysis_results.append(GuiResultPackage())
         if not depend_names or not (row_names or col_names or page_names):  # TODO this check should go to the dialog
             text_result = cs_util.reformat_output('<default>%s %s'%(_('Pivot table.'), _('The dependent variable and at least one grouping variable should be given.')))
+            self._add_analysis_result(None, text_result)
         else:
-            try:
-                text_result = self.active_data.pivot(depend_names, row_names, col_names, page_names, function)
-            except:
-                text_result = cs_util.reformat_output(broken_analysis % _('Pivot table.'))
-                traceback.print_exc()
-        self.analysis_results[-1].add_output(text_result)
-        self._print_to_output_pane()
-        self._busy_signal(False)
+            self._run_in_background([(_('Pivot table'),
+                                      functools.partial(self.active_data.pivot, depend_names, row_names, col_names,
+                                                        page_names, function),
+                                      functools.partial(self._add_analysis_result, None),
+                                      broken_analysis % _('Pivot table.'))])
 
     def compare_variables(self, var_names=None):
         """Compare variables.
@@ -518,29 +681,21 @@ class StatMainWindow(QtWidgets.QMainWindow):
             try:
                 self.dial_comp_var
             except:
-                self.dial_comp_var = cogstat_dialogs.compare_vars_dialog(names=self.active_data.data_frame.columns)
+                self.dial_comp_var = cogstat_dialogs.compare_vars_dialog(names=self.active_data.orig_data_frame.columns)
             else:
-                self.dial_comp_var.init_vars(names=self.active_data.data_frame.columns)
+                self.dial_comp_var.init_vars(names=self.active_data.orig_data_frame.columns)
             if self.dial_comp_var.exec_():
                 var_names = self.dial_comp_var.read_parameters()  # TODO check if settings are appropriate
             else:
                 return
-        self._busy_signal(True)
-        self.analysis_results.append(GuiResultPackage())
-        self.analysis_results[-1].add_command('self.compare_variables()')  # TODO
         if len(var_names) < 2:
             text_result = cs_util.reformat_output('<default>%s %s'%(_('Compare variables.'), _('At least two variables should be set.')))
-            self.analysis_results[-1].add_output(text_result)
+            self._add_analysis_result('self.compare_variables()', text_result)  # TODO
         else:
-            try:
-                result_list = self.active_data.compare_variables(var_names)
-                for result in result_list:  # TODO is this a list of lists? Can we remove the loop?
-                    self.analysis_results[-1].add_output(result)
-            except:
-                self.analysis_results[-1].add_output(cs_util.reformat_output(broken_analysis % _('Compare variables.')))
-                traceback.print_exc()
-        self._print_to_output_pane()
-        self._busy_signal(False)
+            self._run_in_background([(_('Compare repeated measures variables'),
+                                      functools.partial(self.active_data.compare_variables, var_names),
+                                      functools.partial(self._add_analysis_result, 'self.compare_variables()'),  # TODO
+                                      broken_analysis % _('Compare variables.'))])
         
     def compare_groups(self, var_names=None, groups=None, single_case_slope_SEs=None, single_case_slope_trial_n=None):
         """Compare groups.
@@ -553,32 +708,23 @@ class StatMainWindow(QtWidgets.QMainWindow):
             try:
                 self.dial_comp_grp
             except:
-                self.dial_comp_grp = cogstat_dialogs.compare_groups_dialog(names=self.active_data.data_frame.columns)
+                self.dial_comp_grp = cogstat_dialogs.compare_groups_dialog(names=self.active_data.orig_data_frame.columns)
             else:
-                self.dial_comp_grp.init_vars(names=self.active_data.data_frame.columns)
+                self.dial_comp_grp.init_vars(names=self.active_data.orig_data_frame.columns)
             if self.dial_comp_grp.exec_():
                 var_names, groups, single_case_slope_SEs, single_case_slope_trial_n = self.dial_comp_grp.read_parameters()  # TODO check if settings are appropriate
             else:
                 return
-        self._busy_signal(True)
         if not var_names or not groups:
-            self.analysis_results.append(GuiResultPackage())
-            self.analysis_results[-1].add_command('self.compare_groups()')  # TODO
             text_result = cs_util.reformat_output('<default>%s %s' % (_('Compare groups.'), _('Both the dependent and the grouping variables should be set.')))
-            self.analysis_results[-1].add_output(text_result)
+            self._add_analysis_result('self.compare_groups()', text_result)  # TODO
         else:
-            for var_name in var_names:
-                try:
-                    self.analysis_results.append(GuiResultPackage())
-                    self.analysis_results[-1].add_command('self.compare_groups()')  # TODO
-                    result_list = self.active_data.compare_groups(var_name, groups,  single_case_slope_SEs, single_case_slope_trial_n)
-                    self.analysis_results[-1].add_output(result_list)
-                    self._print_to_output_pane()
-                except:
-                    self.analysis_results[-1].add_output(cs_util.reformat_output(broken_analysis % _('Compare groups.')))
-                    traceback.print_exc()
-                    self._print_to_output_pane()
-        self._busy_signal(False)
+            self._run_in_background([(_('Compare groups'),
+                                      functools.partial(self.active_data.compare_groups, var_name, groups,
+                                                        single_case_slope_SEs, single_case_slope_trial_n),
+                                      functools.partial(self._add_analysis_result, 'self.compare_groups()'),  # TODO
+                                      broken_analysis % _('Compare groups.'))
+                                     for var_name in var_names])
 
     ### Result menu methods ###
     def delete_output(self):
@@ -660,7 +806,12 @@ class StatMainWindow(QtWidgets.QMainWindow):
     def closeEvent(self, event):
         # Override the close behavior, otherwise alt+F4 quits unconditionally.
         # http://stackoverflow.com/questions/1414781/prompt-on-exit-in-pyqt-application
-        
+
+        # Stop the running analysis
+        if self._analysis_thread is not None:
+            self._analysis_thread.cancel()
+            self._analysis_thread.wait()
+
         # Check if everything is saved
         tosave = True
         while self.unsaved_output and tosave:
@@ -16,7 +16,6 @@ Mostly scipy.stats, statsmodels and matplotlib is used to generate the results.
 import gettext
 import os
 import numpy as np
-import statsmodels.api as sm
 import string
 import sys
 from io import StringIO
@@ -29,14 +28,8 @@ from . import cogstat_util as cs_util
 from . import cogstat_stat_num as cs_stat_num
 from . import cogstat_chart as cs_chart
 
-try:
-    from statsmodels.graphics.mosaicplot import mosaic
-except:
-    pass
-from statsmodels.stats.weightstats import DescrStatsW
-from statsmodels.sandbox.stats.runs import mcnemar
-from statsmodels.sandbox.stats.runs import cochrans_q
 import pandas as pd
+# statsmodels is slow to import, so its modules are imported in the functions where they are needed
 
 '''
 # r is not needed for some time, but may be necessary at some later point again, so keep the code
@@ -82,21 +75,49 @@ def _split_into_groups(pdf, var_name, grouping_name):
     return:
     level_combinations (list of str or list of tuples of str): list of group levels (for one grouping variable)
         or list of tuples of group levels (for more than one grouping variable)
-    grouped data: list of pandas series
+    grouped data: list of numpy arrays, missing data are dropped; level combinations without data give empty arrays
     """
 
+    level_combinations, values, codes = _group_codes(pdf, var_name, grouping_name)
+    # Partition the cases according to the codes in a single pass
+    if values.dtype == np.float32:  # calculations use 64 bit floats
+        values = values.astype(float)
+    order = np.argsort(codes, kind='mergesort')  # stable sort keeps the original order of the cases within groups
+    group_sizes = np.bincount(codes, minlength=len(level_combinations))
+    grouped_data = np.split(values[order], np.cumsum(group_sizes)[:-1])
+    return level_combinations, grouped_data
+
+
+def _group_codes(pdf, var_name, grouping_name):
+    """Code the level combinations of the grouping variables of the cases with a single number.
+
+    arguments:
+    var_name (str): name of the dependent var
+    grouping_name (list of str): name of the grouping var(s)
+
+    return:
+    level_combinations: as in _split_into_groups()
+    values: numpy array of the dependent variable in its stored type; cases with missing data are dropped
+    codes: numpy array of the index of the level combination of the values
+    """
     if isinstance(grouping_name, (str)):  # TODO list is required, fix the calls sending string
         grouping_name = [grouping_name]
     # create a list of sets with the levels of all grouping variables
-    levels = [list(set(pdf[group].dropna())) for group in grouping_name]
-    for i in range(len(levels)):
-        levels[i].sort()
+    # for categorical variables only the (few) values of the categories are checked
+    levels = [sorted(pdf[group].cat.remove_unused_categories().cat.categories if pdf[group].dtype.name == 'category'
+                     else pdf[group].dropna().unique().tolist()) for group in grouping_name]
 
     # create all level combinations for the grouping variables
     level_combinations = list(itertools.product(*levels))
-    grouped_data = [pdf[var_name][(pdf[grouping_name] == pd.Series({group: level for group, level in zip(grouping_name, group_level)})).all(axis=1)].dropna() for group_level in
-                 level_combinations]
-    return level_combinations, grouped_data
+
+    # -1 is the code of missing grouping data
+    codes = np.zeros(len(pdf), dtype=np.int64)
+    for group, group_levels in zip(grouping_name, levels):
+        group_codes = pd.Categorical(pdf[group], categories=group_levels).codes.astype(np.int64)
+        codes = np.where((codes < 0) | (group_codes < 0), -1, codes * len(group_levels) + group_codes)
+    values = pdf[var_name].values
+    valid = (codes >= 0) & pd.notnull(values)
+    return level_combinations, values[valid], codes[valid]
 
 
 def _format_html_table(html_table, add_style=False):
@@ -110,15 +131,16 @@ def _format_html_table(html_table, add_style=False):
     else:
         return html_table.replace('\n', '').replace('border="1"', 'style="border:1px solid black;"')
 
-def pivot(pdf, row_names, col_names, page_names, depend_name, function):
+def pivot(pdf, row_names, col_names, page_names, depend_name, function, prec=None):
     """
     Build pivot table
     all parameters are lists # TODO doc
+    prec (int): decimal precision of the dependent variable (see cs_util.precision()), or None to compute it here
     """
             
     if len(depend_name) != 1:
         return _('Sorry, only one dependent variable can be used.')
-    if pdf[depend_name[0]].dtype == 'object':
+    if pdf[depend_name[0]].dtype.name in ['object', 'category']:  # string variables (nominal ones are categorical)
         return _('Sorry, string variables cannot be used in Pivot table.')
     function_code = {'N': 'len', 'Sum': 'np.sum', 'Mean': 'np.mean', 'Median': 'median', 'Lower quartile': 'perc25',
                      'Upper quartile': 'perc75', 'Standard deviation': 'np.std', 'Variance': 'np.var'}
@@ -134,7 +156,7 @@ def pivot(pdf, row_names, col_names, page_names, depend_name, function):
     if function == 'N':
         prec = 0
     else:
-        prec = cs_util.precision(pdf[depend_name[0]])+1
+        prec = (cs_util.precision(pdf[depend_name[0]]) if prec is None else prec) + 1
 
     def format_output(x):
         return '%0.*f' % (prec, x)
@@ -174,7 +196,7 @@ def pivot(pdf, row_names, col_names, page_names, depend_name, function):
                                             aggfunc=eval(function_code[function]))
                 else:
                     ptable = pd.pivot_table(df, values=depend_name, index=row_names, columns=col_names,
-                                            aggfunc=eval(function_code[function]))
+                                            aggfunc=eval(function_code[function]), observed=True)
                 ptable_result = '%s\n%s' % (ptable_result, _format_html_table(ptable.
                                             to_html(bold_rows=False, sparsify=False, float_format=format_output),
                                                                               add_style=False))
@@ -213,26 +235,33 @@ def safe_var_names(names):  # TODO not used at the moment. maybe could be delete
 ### Single variables ###
 
 
-def display_variable_raw_data(pdf, data_measlevs, var_name):
+def display_variable_raw_data(pdf, data_measlevs, var_name, rank_cache=None, freqs=None, valid_n=None,
+                              missing_n=None):
     """Display n of valid valid and display raw data on a chart
+
+    rank_cache (cs_stat_num.RankCache): sort orders of pdf, or None to sort the data when needed
+    freqs (tuple): result of cs_stat_num.frequencies() for var_name, or None to count the values when needed
+    valid_n, missing_n (int): number of valid and missing cases of var_name, or None to count them here
     """
     data = pdf[var_name].dropna()
 
     text_result=''
-    text_result += _('N of valid cases: %g') % len(data) + '\n'
-    missing_cases = len(pdf[var_name])-len(data)
+    text_result += _('N of valid cases: %g') % (len(data) if valid_n is None else valid_n) + '\n'
+    missing_cases = len(pdf[var_name])-len(data) if missing_n is None else missing_n
     text_result += _('N of missing cases: %g') % missing_cases + '\n'
 
-    chart = cs_chart.create_variable_raw_chart(pdf, data_measlevs, var_name, data)
+    chart = cs_chart.create_variable_raw_chart(pdf, data_measlevs, var_name, data, rank_cache=rank_cache,
+                                             freqs=freqs)
 
     return text_result, chart
 
-def frequencies(pdf, var_name, meas_level):
+def frequencies(pdf, var_name, meas_level, freqs=None):
     """Frequencies
     
     arguments:
     var_name (str): name of the variable
     meas_level: measurement level of the variable
+    freqs (tuple): result of cs_stat_num.frequencies() for var_name, or None to count the values here
     """
 
     def as_percent(v, precision='0.1'):
@@ -244,26 +273,17 @@ def frequencies(pdf, var_name, meas_level):
         else:
             raise TypeError("Numeric type required")
 
-    # TODO rewrite this; can we use pandas here?
-    freq1 = [[i, list(pdf[var_name]).count(i)] for i in set(pdf[var_name])]
-    # Remove and count nans - otherwise sort() does not function correctly
-    freq = [x for x in freq1 if x[0] == x[0]]
-    nan_n = len(freq1) - len(freq)
-    freq.sort()
-    if nan_n:
-        freq.append(['nan', nan_n])
-    total_count = float(len(pdf[var_name]))
-    running_total = 0
-    running_rel_total = 0.0
-    for i in range(len(freq)):
-        rel_freq = freq[i][1]/total_count
-        running_total += freq[i][1]
-        running_rel_total += rel_freq
-        if meas_level == 'nom':
-            freq[i].extend([rel_freq])
-        else:
-            freq[i].extend([rel_freq, running_total, running_rel_total])
+    if freqs is None:
+        freqs = cs_stat_num.frequencies(pdf, var_name)
+    values, freqs, rel_freqs, cum_freqs, cum_rel_freqs, nan_n = freqs
+    freq = [list(row) for row in zip(values, freqs.tolist(), rel_freqs.tolist(), cum_freqs.tolist(),
+                                      cum_rel_freqs.tolist())]
+    if nan_n:  # missing values are in the last row
+        rel_freq = nan_n / float(len(pdf[var_name]))
+        freq.append(['nan', nan_n, rel_freq, (cum_freqs[-1] if len(freq) else 0) + nan_n,
+                     (cum_rel_freqs[-1] if len(freq) else 0.0) + rel_freq])
     if meas_level == 'nom':
+        freq = [row[:3] for row in freq]
         column_names = [_('Value'), _('Freq'), _('Rel freq')]
     else:
         column_names = [_('Value'), _('Freq'), _('Rel freq'), _('Cum freq'), _('Cum rel freq')]
@@ -272,8 +292,23 @@ def frequencies(pdf, var_name, meas_level):
     return text_result
 
 
-def normality_test(pdf, data_measlevs, var_name, group_name='', group_value='', alt_data=None):
+def _normality_test_result(var_name, group_name, group_value, test, statistic, p):
+    """Text of the result of a normality test in APA format"""
+    group_text = ' (%s: %s)' % (group_name, group_value) if group_name else ''
+    if test == 'shapiro':
+        return _('Shapiro-Wilk normality test in variable %s%s') % (var_name, group_text) + \
+               ': <i>W</i> = %0.3g, %s\n' % (statistic, cs_util.print_p(p))
+    else:
+        return _("D'Agostino-Pearson normality test in variable %s%s") % (var_name, group_text) + \
+               ': <i>K</i><sup>2</sup> = %0.3g, %s\n' % (statistic, cs_util.print_p(p))
+
+
+def normality_test(pdf, data_measlevs, var_name, group_name='', group_value='', alt_data=None, charts=False,
+                   unique_n=None):
     """Check normality
+
+    Large samples are tested with the D'Agostino-Pearson test instead of the Shapiro-Wilk test (see
+    csc.normality_shapiro_max_n).
     
     arguments:
     var_name (str):
@@ -288,12 +323,17 @@ def normality_test(pdf, data_measlevs, var_name, group_name='', group_value='',
         instead of self.data_frame. This could be useful if some other data
         should be dropped, e.g., in variable comparison, where cases are 
         dropped based on missing cases in other variables.
+    charts (bool):
+        Create the histogram and the QQ plot, too.
+    unique_n (int):
+        Number of different values of var_name in pdf (without group_name and alt_data), or None to check if the
+        variable is constant here.
     
     return:
     norm (bool): is the variable normal (False if normality is violated)
     text_result (html text): APA format
-    image (matplotlib): histogram with normal distribution
-    image2 (matplotlib): QQ plot
+    image (matplotlib): histogram with normal distribution; None if charts is False
+    image2 (matplotlib): QQ plot; None if charts is False
     """
     text_result = ''
     if repr(alt_data) == 'None':
@@ -310,7 +350,7 @@ def normality_test(pdf, data_measlevs, var_name, group_name='', group_value='',
 
     if data_measlevs[var_name] in ['nom', 'ord']:
         return False, '<decision>'+_('Normality can be checked only for interval variables.')+'\n<default>', None, None
-    if len(set(data)) == 1:
+    if (unique_n == 1) if unique_n is not None else (len(data) and np.all(data.values == data.values[0])):
         return False, _('Normality cannot be checked for constant variable in %s%s.\n' % (var_name, ' (%s: %s)' % (group_name, group_value) if group_name else '')), None, None
     # TODO do we need this?
 #        if len(data)<7:
@@ -327,10 +367,13 @@ def normality_test(pdf, data_measlevs, var_name, group_name='', group_value='',
     if len(data) < 3:
         return False, _('Too small sample to test normality in variable %s%s.\n' % (var_name, ' (%s: %s)' % (group_name, group_value) if group_name else '')), None, None
     else:
-        W, p = stats.shapiro(data)
-        text_result += _('Shapiro-Wilk normality test in variable %s%s') % (var_name, ' (%s: %s)' % (group_name, group_value) if group_name else '') +': <i>W</i> = %0.3g, %s\n' %(W, cs_util.print_p(p))
+        [test], [statistic], [p] = cs_stat_num.normality_tests([np.asarray(data)], csc.normality_shapiro_max_n)
+        text_result += _normality_test_result(var_name, group_name, group_value, test, statistic, p)
 
-    normality_histogram, qq_plot = cs_chart.create_normality_chart(data, var_name)
+    if charts:
+        normality_histogram, qq_plot = cs_chart.create_normality_chart(data, var_name)
+    else:
+        normality_histogram, qq_plot = None, None
     
     # Decide about normality
     norm = False if p < 0.05 else True
@@ -338,7 +381,47 @@ def normality_test(pdf, data_measlevs, var_name, group_name='', group_value='',
     return norm, text_result, normality_histogram, qq_plot
 
 
-def one_t_test(pdf, data_measlevs, var_name, test_value=0):
+def normality_test_groups(pdf, data_measlevs, var_name, group_name, group_values):
+    """Check normality in several groups of a grouping variable at once
+
+    The cases are split into the groups in a single pass, and all large groups are tested together.
+
+    arguments:
+    var_name (str):
+        Name of the variable to be checked.
+    group_name (str):
+        Name of the grouping variable.
+    group_values (list):
+        Groups to check.
+
+    return:
+    list of (norm, text_result) for the groups as in normality_test()
+    """
+    if data_measlevs[var_name] in ['nom', 'ord']:
+        return [(False, '<decision>'+_('Normality can be checked only for interval variables.')+'\n<default>')] * \
+               len(group_values)
+    levels, samples = _split_into_groups(pdf, var_name, [group_name])
+    samples = dict(zip([level[0] for level in levels], samples))
+    samples = [samples.get(group_value, np.array([])) for group_value in group_values]
+
+    results = [None] * len(group_values)
+    tested_groups = []
+    for group_i, (group_value, sample) in enumerate(zip(group_values, samples)):
+        if len(sample) and np.all(sample == sample[0]):
+            results[group_i] = (False, _('Normality cannot be checked for constant variable in %s%s.\n' % (var_name, ' (%s: %s)' % (group_name, group_value))))
+        elif len(sample) < 3:
+            results[group_i] = (False, _('Too small sample to test normality in variable %s%s.\n' % (var_name, ' (%s: %s)' % (group_name, group_value))))
+        else:
+            tested_groups.append(group_i)
+    tests, statistics, ps = cs_stat_num.normality_tests([samples[group_i] for group_i in tested_groups],
+                                                        csc.normality_shapiro_max_n)
+    for group_i, test, statistic, p in zip(tested_groups, tests, statistics, ps):
+        results[group_i] = (False if p < 0.05 else True,
+                            _normality_test_result(var_name, group_name, group_values[group_i], test, statistic, p))
+    return results
+
+
+def one_t_test(pdf, data_measlevs, var_name, test_value=0, prec=None, unique_n=None):
     """One sample t-test
     
     arguments:
@@ -346,6 +429,10 @@ def one_t_test(pdf, data_measlevs, var_name, test_value=0):
         Name of the variable to test.
     test_value (numeric):
         Test against this value.
+    prec (int):
+        Decimal precision of the variable (see cs_util.precision()), or None to compute it here.
+    unique_n (int):
+        Number of different values of the variable, or None to count them here.
         
     return:
     text_result (html str):
@@ -358,9 +445,10 @@ def one_t_test(pdf, data_measlevs, var_name, test_value=0):
     if data_measlevs[var_name] in ['int', 'unk']:
         if data_measlevs[var_name] == 'unk':
             text_result += warn_unknown_variable
-        if len(set(data))==1:
+        if (len(set(data)) if unique_n is None else unique_n) == 1:
             return _('One sample t-test cannot be run for constant variable.\n'), None
                     
+        from statsmodels.stats.weightstats import DescrStatsW
         data = pdf[var_name].dropna()
         descr = DescrStatsW(data)
         t, p, df = descr.ttest_mean(float(test_value))
@@ -368,7 +456,7 @@ def one_t_test(pdf, data_measlevs, var_name, test_value=0):
             # Or we could use confidence_interval_t
             cil, cih = descr.tconfint_mean()
             ci = (cih-cil)/2
-            prec = cs_util.precision(data)+1
+            prec = (cs_util.precision(data) if prec is None else prec) + 1
             ci_text = '[%0.*f, %0.*f]' %(prec, cil, prec, cih)
         else:
             ci = 0  # only with statsmodels
@@ -417,66 +505,66 @@ def wilcox_sign_test(pdf, data_measlevs, var_name, value=0):
     return text_result, image
 
 
-def print_var_stats(pdf, var_names, groups=None, statistics=[]):
+def print_var_stats(pdf, var_names, groups=None, statistics=[], precs=None):
     """
     Computes descriptive stats for variables and/or groups.
 
     arguments:
     var_names: list of variable names to use
     groups: list of grouping variable names
-    statistics: list of strings, they can be numpy functions, such as 'mean, 'median', and they should be included in the
-            stat_names list
+    statistics: list of strings, they can be the statistics of cs_stat_num.descriptives(), such as 'mean, 'median', and
+            they should be included in the stat_names list
+    precs: list of the decimal precisions of the variables (see cs_util.precision()), or None to compute them here;
+            the statistics of the groups are displayed with the precision of the variable
 
     Now it only handles a single dependent variable and a single grouping variable.
     """
     stat_names = {'mean': _('Mean'), 'median': _('Median'), 'std': _('Standard deviation'), 'amin': _('Minimum'),
                   'amax': _('Maximum'), 'lower_quartile': 'Lower quartile', 'upper_quartile': _('Upper quartile'),
                   'skew': _('Skewness'), 'kurtosis': _('Kurtosis'), 'ptp':_('Range')}
-    # Create these functions in numpy namespace to enable simple getattr call of them below
-    np.lower_quartile = lambda x: np.percentile(x, 25)
-    np.upper_quartile = lambda x: np.percentile(x, 75)
-    # with the bias=False it gives the same value as SPSS
-    np.skew = lambda x: stats.skew(x, bias=False)
-    # with the bias=False it gives the same value as SPSS
-    np.kurtosis = lambda x: stats.kurtosis(x, bias=False)
-
     text_result = ''
-    if sum([pdf[var_name].dtype == 'object' for var_name in var_names]):
+    if sum([pdf[var_name].dtype.name in ['object', 'category'] for var_name in var_names]):
          raise RuntimeError('only numerical variables can be used in print_var_stats')
-    # Compute only variable statistics
+
+    if precs is None:
+        precs = [cs_util.precision(pdf[var_name]) for var_name in var_names]
+
+    # Compute the statistics
+    # Precision and statistics are collected for each column of the result table (None if there are no data)
     if not groups:
         # drop all data with NaN pair
         data = pdf[var_names].dropna()
-        pdf_result = pd.DataFrame(columns=var_names)
+        column_labels = var_names
+        precs = [prec + 1 for prec in precs]
+        # all variables are processed together
+        stat_results = cs_stat_num.descriptives(data.values)
+        column_stats = [{stat: stat_results[stat][i] for stat in statistics} for i in range(len(var_names))]
         text_result += _('Descriptives for the variables') if len(var_names) > 1 else _('Descriptives for the variable')
-        for var_name in var_names:
-            prec = cs_util.precision(data[var_name])+1
-            for stat in statistics:
-                pdf_result.loc[stat_names[stat], var_name] = '%0.*f' % \
-                                                             (prec, getattr(np, stat)(data[var_name].dropna()))
     # There is at least one grouping variable
     else:
         # missing groups and values will be dropped
-
-        groups, grouped_data = _split_into_groups(pdf, var_names[0], groups)
-        groups = [' : '.join(map(str, group)) for group in groups]
-        pdf_result = pd.DataFrame(columns=groups)
-
+        groups, values, codes = _group_codes(pdf, var_names[0], groups)
+        column_labels = [' : '.join(map(str, group)) for group in groups]
+        # all groups are processed together
+        stat_results = cs_stat_num.grouped_descriptives(values, codes, len(groups))
+        group_sizes = np.bincount(codes, minlength=len(groups))
+        precs = [precs[0] + 1 if group_size else None for group_size in group_sizes]
+        column_stats = [{stat: stat_results[stat][i] for stat in statistics} if group_size else None
+                        for i, group_size in enumerate(group_sizes)]
         text_result += _('Descriptives for the groups')
-        # Not sure if the precision can be controlled per cell with this method;
-        # Instead we make a pandas frame with str cells
-#        pdf_result = pd.DataFrame([np.mean(group_data.dropna()) for group_data in grouped_data], columns=[_('Mean')], index=groups)
-#        text_result += pdf_result.T.to_html()
-        for group_label, group_data in zip(groups, grouped_data):
-            if len(group_data):
-                prec = cs_util.precision(group_data) + 1
-                for stat in statistics:
-                    pdf_result.loc[stat_names[stat], group_label] = '%0.*f' % \
-                                                                    (prec, getattr(np, stat)(group_data.dropna()))
-            else:  # TODO can we remove this part?
-                text_result += _('No data')
-                for stat in statistics:
-                    pdf_result.loc[stat_names[stat], group_label] = _('No data')
+
+    # Format the results
+    # Not sure if the precision can be controlled per cell with this method;
+    # Instead we make a pandas frame with str cells
+    pdf_result = pd.DataFrame(columns=column_labels)
+    for column_label, prec, stat_results in zip(column_labels, precs, column_stats):
+        if stat_results is None:  # TODO can we remove this part?
+            text_result += _('No data')
+            for stat in statistics:
+                pdf_result.loc[stat_names[stat], column_label] = _('No data')
+        else:
+            for stat in statistics:
+                pdf_result.loc[stat_names[stat], column_label] = '%0.*f' % (prec, stat_results[stat])
     text_result += _format_html_table(pdf_result.to_html(bold_rows=False))
     return text_result
 
@@ -487,6 +575,7 @@ def confidence_interval_t(data, ci_only=True):
     """
     # FIXME is this solution slow? Should we write our own CI function?
     if LooseVersion(csc.versions['statsmodels']) >= LooseVersion('0.5'):
+        from statsmodels.stats.weightstats import DescrStatsW
         descr = DescrStatsW(data)
         cil, cih = descr.tconfint_mean()
         ci = (cih-cil)/2
@@ -515,6 +604,37 @@ def var_pair_contingency_table(meas_lev, x, y, data_frame):
     return text_result
 
 
+def correlation_matrix_table(var_names, n, correlations):
+    """Table of the correlations of all variable pairs in decreasing order of the strength of the first correlation
+
+    arguments:
+    var_names (list of str): names of the variables in the order of the matrices
+    n (2d numpy array): numbers of the valid pairs
+    correlations (list of (str, str, 2d numpy array)): names, symbols and matrices of the correlation coefficients
+
+    return:
+    html table with the coefficients, their 95% confidence intervals and p values
+    """
+    def format_p(p):
+        return '&lt; 0.001' if p < 0.001 else '%0.3f' % p
+
+    first_var, second_var = np.triu_indices(len(var_names), 1)
+    pair_n = n[first_var, second_var]
+    order = np.argsort(-np.nan_to_num(np.abs(correlations[0][2][first_var, second_var]), nan=-1), kind='mergesort')
+    first_var, second_var, pair_n = first_var[order], second_var[order], pair_n[order]
+    pdf_result = pd.DataFrame({('', _('Variable 1')): np.asarray(var_names, dtype=object)[first_var],
+                               ('', _('Variable 2')): np.asarray(var_names, dtype=object)[second_var],
+                               ('', _('N of valid pairs')): pair_n})
+    for name, symbol, r in correlations:
+        r = r[first_var, second_var]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            r_ci_low, r_ci_high = cs_stat_num.corr_ci(r, pair_n)
+        pdf_result[(name, symbol)] = ['%0.3f' % r_pair for r_pair in r]
+        pdf_result[(name, _('95% confidence interval'))] = ['[%0.3f, %0.3f]' % ci for ci in zip(r_ci_low, r_ci_high)]
+        pdf_result[(name, '<i>p</i>')] = [format_p(p) for p in cs_stat_num.correlation_p(r, pair_n)]
+    return _format_html_table(pdf_result.to_html(bold_rows=False, escape=False, index=False))
+
+
 ### Compare variables ###
 
 
@@ -524,6 +644,7 @@ def repeated_measures_estimations(data, meas_level):
     # TODO the same things are calulated in cs_chart.create_repeated_measures_population_chart()
     condition_means_pdf = pd.DataFrame()
     if meas_level in ['int', 'unk']:
+        data = cs_util.upcast(data)
         means = np.mean(data)
         cis, cils, cihs = confidence_interval_t(data, ci_only=False)
         condition_means_pdf[_('Point estimation')] = means
@@ -580,12 +701,14 @@ def paired_wilcox_test(pdf, var_names):
 
 
 def mcnemar_test(pdf, var_names):
+    from statsmodels.sandbox.stats.runs import mcnemar
     chi2, p = mcnemar(pdf[var_names[0]], pdf[var_names[1]], exact=False)
     return _('Result of the McNemar test') + ': &chi;<sup>2</sup>(1, <i>N</i> = %d) = %0.3g, %s\n' % \
                                               (len(pdf[var_names[0]]), chi2, cs_util.print_p(p))
 
 
 def cochran_q_test(pdf, var_names):
+    from statsmodels.sandbox.stats.runs import cochrans_q
     q, p = cochrans_q(pdf[var_names])
     return _("Result of Cochran's Q test") + ': <i>Q</i>(%d, <i>N</i> = %d) = %0.3g, %s\n' % \
                                               (len(var_names)-1, len(pdf[var_names[0]]), q, cs_util.print_p(p))
@@ -610,7 +733,7 @@ def repeated_measures_anova(pdf, var_names):
 
     # Post-hoc tests
     if p < 0.05:
-        pht = cs_stat_num.pairwise_ttest(pdf[var_names].dropna(), var_names).sort_index()
+        pht = cs_stat_num.pairwise_ttest(pdf[var_names].dropna(), var_names)
         text_result += '\n' + _('Comparing variables pairwise with the Holm-Bonferroni correction:')
         #print pht
         pht['text'] = pht.apply(lambda x: '<i>t</i> = %0.3g, %s' % (x['t'], cs_util.print_p(x['p (Holm)'])), axis=1)
@@ -657,9 +780,9 @@ def comp_group_estimations(data_frame, meas_level, var_names, groups):
     """
     group_means_pdf = pd.DataFrame()
     if meas_level in ['int', 'unk']:
-        pdf = data_frame.dropna(subset=[var_names[0]])[[var_names[0]] + groups]
-        means = pdf.groupby(groups, sort=False).aggregate(np.mean)[var_names[0]]
-        cis = pdf.groupby(groups, sort=False).aggregate(confidence_interval_t)[var_names[0]]
+        pdf = cs_util.upcast(data_frame.dropna(subset=[var_names[0]])[[var_names[0]] + groups])
+        means = pdf.groupby(groups, sort=False, observed=True).aggregate(np.mean)[var_names[0]]
+        cis = pdf.groupby(groups, sort=False, observed=True).aggregate(confidence_interval_t)[var_names[0]]
         group_means_pdf[_('Point estimation')] = means
         # APA format, but cannot be used the numbers if copied to spreadsheet
         #group_means_pdf[_('95% confidence interval')] = '['+ (means-cis).map(str) + ', ' + (means+cis).map(str) + ']'
@@ -683,27 +806,24 @@ def levene_test(pdf, var_name, group_name):
     text_result = ''
 
     dummy_groups, var_s = _split_into_groups(pdf, var_name, group_name)
-    for i, var in enumerate(var_s):
-        var_s[i] = var_s[i].dropna()
     w, p = stats.levene(*var_s)
     text_result += _('Levene test')+': <i>W</i> = %0.3g, %s\n' %(w, cs_util.print_p(p))
             
     return p, text_result
 
 
-def independent_t_test(pdf, var_name, grouping_name):
+def independent_t_test(pdf, var_name, grouping_name, prec=None):
     """Independent samples t-test
     
     arguments:
     var_name (str):
     grouping_name (str):
+    prec (int): decimal precision of the variable (see cs_util.precision()), or None to compute it here
     """
     from statsmodels.stats.weightstats import ttest_ind
     text_result = ''
     
     dummy_groups, [var1, var2] = _split_into_groups(pdf, var_name, grouping_name)
-    var1 = var1.dropna()
-    var2 = var2.dropna()
     t, p, df = ttest_ind(var1, var2)
     # CI http://onlinestatbook.com/2/estimation/difference_means.html
     # However, there are other computtional methods:
@@ -717,7 +837,7 @@ def independent_t_test(pdf, var_name, grouping_name):
     t_cl = stats.t.ppf(1-(0.05/2), df) # two-tailed
     lci = mean_diff - t_cl*s_m1m2
     hci = mean_diff + t_cl*s_m1m2
-    prec = cs_util.precision(var1.append(var2))+1
+    prec = (cs_util.precision(pd.Series(np.concatenate([var1, var2]))) if prec is None else prec) + 1
     text_result += _('Difference between the two groups:') +' %0.*f, ' % (prec, mean_diff) + \
                    _('95%% confidence interval [%0.*f, %0.*f]') % (prec, lci, prec, hci)+'\n'
     text_result += _('Result of independent samples t-test:')+' <i>t</i>(%0.3g) = %0.3g, %s\n' % \
@@ -742,11 +862,11 @@ def single_case_task_extremity(pdf, var_name, grouping_name, se_name = None, n_t
         try:
             if len(var1) == 1:
                 ind_data = var1
-                group_data = var2.dropna()
+                group_data = var2
             else:
                 ind_data = var2
-                group_data = var1.dropna()
-            t, p, df = cs_stat_num.modified_t_test(ind_data, group_data)
+                group_data = var1
+            t, p, df = cs_stat_num.modified_t_test(pd.Series(ind_data), group_data)
             text_result += _('Result of the modified independent samples t-test:') + \
                            ' <i>t</i>(%0.3g) = %0.3g, %s\n' % (df, t, cs_util.print_p(p))
         except ValueError:
@@ -755,14 +875,14 @@ def single_case_task_extremity(pdf, var_name, grouping_name, se_name = None, n_t
         group_levels, [se1, se2] = _split_into_groups(pdf, se_name, grouping_name)
         if len(var1)==1:
             case_var = var1[0]
-            control_var = var2
+            control_var = pd.Series(var2)
             case_se = se1[0]
-            control_se = se2
+            control_se = pd.Series(se2)
         else:
             case_var = var2[0]
-            control_var = var1
+            control_var = pd.Series(var1)
             case_se = se2[0]
-            control_se = se1
+            control_se = pd.Series(se1)
         t, df, p, test = cs_stat_num.slope_extremity_test(n_trials, case_var, case_se, control_var, control_se)
         text_result += _('Result of slope test with %s:')%(test) + \
                        ' <i>t</i>(%0.3g) = %0.3g, %s\n' % (df, t, cs_util.print_p(p))
@@ -778,7 +898,7 @@ def welch_t_test(pdf, var_name, grouping_name):
     :return: html text with APA format result
     """
     dummy_groups, [var1, var2] = _split_into_groups(pdf, var_name, grouping_name)
-    t, p = stats.ttest_ind(var1.dropna(), var2.dropna(), equal_var=False)
+    t, p = stats.ttest_ind(var1, var2, equal_var=False)
     # http://msemac.redwoods.edu/~darnold/math15/spring2013/R/Activities/WelchTTest.html
     n1 = len(var1)
     n2 = len(var2)
@@ -788,24 +908,40 @@ def welch_t_test(pdf, var_name, grouping_name):
     return _("Result of Welch's unequal variances t-test:") + \
            ' <i>t</i>(%0.3g) = %0.3g, %s\n' % (df, t, cs_util.print_p(p))
 
-def mann_whitney_test(pdf, var_name, grouping_name):
+def mann_whitney_test(pdf, var_name, grouping_name, rank_cache=None):
     """Mann-Whitney test
+
+    With larger samples or with ties, the normal approximation is computed from the precomputed ranks.
     
     arguments:
     var_name (str):
     grouping_name (str):
+    rank_cache (cs_stat_num.RankCache): sort orders of pdf, or None to sort the data here
     """
     # Not available in statsmodels
     text_result = ''
-    
+
+    if rank_cache is None:
+        rank_cache = cs_stat_num.RankCache(pdf)
+    valid_cases = pdf[[var_name, grouping_name]].notna().all(axis=1).values
+    tie_sizes = rank_cache.tie_sizes(var_name, valid_cases)
+    in_first_group = pd.factorize(np.asarray(pdf[grouping_name])[valid_cases], sort=True)[0] == 0
+    if min(np.sum(in_first_group), np.sum(~in_first_group)) > 8 or np.any(tie_sizes > 1):
+        u, p = cs_stat_num.mann_whitney_u(rank_cache.ranks(var_name, valid_cases)[valid_cases], in_first_group,
+                                          tie_sizes)
+        text_result += _('Result of independent samples Mann-Whitney rank test: ')+'<i>U</i> = %0.3g, %s\n' % \
+                                                                                   (u, cs_util.print_p(p))
+        return text_result
+
+    # Exact test for small samples without ties
     dummy_groups, [var1, var2] = _split_into_groups(pdf, var_name, grouping_name)
     try:
-        u, p = stats.mannwhitneyu(var1.dropna(), var2.dropna(), alternative='two-sided')
+        u, p = stats.mannwhitneyu(var1, var2, alternative='two-sided')
         text_result += _('Result of independent samples Mann-Whitney rank test: ')+'<i>U</i> = %0.3g, %s\n' % \
                                                                                    (u, cs_util.print_p(p))
     except:
         try:  # older versions of mannwhitneyu do not include the alternative parameter
-            u, p = stats.mannwhitneyu(var1.dropna(), var2.dropna())
+            u, p = stats.mannwhitneyu(var1, var2)
             text_result += _('Result of independent samples Mann-Whitney rank test: ')+'<i>U</i> = %0.3g, %s\n' % \
                                                                                        (u, cs_util.print_p(p * 2))
         except Exception as e:
@@ -817,82 +953,58 @@ def mann_whitney_test(pdf, var_name, grouping_name):
 def one_way_anova(pdf, var_name, grouping_name):
     """One-way ANOVA
 
+    The ANOVA and the post-hoc test are computed from the number of cases, the mean and the sum of squares of the
+    groups.
+
     Arguments:
     var_name (str):
     grouping_name (str):
     """
     text_result = ''
-    
-    # http://statsmodels.sourceforge.net/stable/examples/generated/example_interactions.html#one-way-anova
-    from statsmodels.formula.api import ols
-    from statsmodels.stats.anova import anova_lm
+
     data = pdf.dropna(subset=[var_name, grouping_name])
-    # from IPython import embed; embed()
-    # FIXME If there is a variable called 'C', then patsy is confused whether C is the variable or the categorical variable
-    # http://gotoanswer.stanford.edu/?q=Statsmodels+Categorical+Data+from+Formula+%28using+pandas%
-    # http://stackoverflow.com/questions/22545242/statsmodels-categorical-data-from-formula-using-pandas
-    # http://stackoverflow.com/questions/26214409/ipython-notebook-and-patsy-categorical-variable-formula
-    anova_model = ols(str(var_name+' ~ C('+grouping_name+')'), data=data).fit()
-    # Type I is run, and we want to run type III, but for a one-way ANOVA different types give the same results
-    anova_result = anova_lm(anova_model)
+    group_stats = cs_stat_num.group_statistics(data, var_name, grouping_name)
+    [dfn, dfd, f, pf], [ssn, ssd] = cs_stat_num.one_way_anova(group_stats)
     text_result += _('Result of one-way ANOVA: ') + '<i>F</i>(%d, %d) = %0.3g, %s\n' % \
-                                                    (anova_result['df'][0], anova_result['df'][1], anova_result['F'][0],
-                                                     cs_util.print_p(anova_result['PR(>F)'][0]))
+                                                    (dfn, dfd, f, cs_util.print_p(pf))
     # http://en.wikipedia.org/wiki/Effect_size#Omega-squared.2C_.CF.892
-    omega2 = (anova_result['sum_sq'][0] - (anova_result['df'][0] * anova_result['mean_sq'][1]))/\
-             ((anova_result['sum_sq'][0]+anova_result['sum_sq'][1]) +anova_result['mean_sq'][1])
+    omega2 = (ssn - (dfn * ssd/dfd))/((ssn+ssd) + ssd/dfd)
     effect_size_result = _('Effect size: ') + '&omega;<sup>2</sup> = %0.3g\n' % omega2
     # http://statsmodels.sourceforge.net/stable/stats.html#multiple-tests-and-multiple-comparison-procedures
-    if anova_result['PR(>F)'][0] < 0.05:  # post-hoc
-        post_hoc_res = sm.stats.multicomp.pairwise_tukeyhsd(np.array(data[var_name]), np.array(data[grouping_name]),
-                                                            alpha=0.05)
+    if pf < 0.05:  # post-hoc
+        post_hoc_res = cs_stat_num.tukey_hsd(group_stats, alpha=0.05)
         text_result += '\n'+_('Groups differ. Post-hoc test of the means.')+'\n'
         text_result += ('<fix_width_font>%s\n<default>' % post_hoc_res).replace(' ', '\\u00a0')
-        ''' # TODO create our own output
-        http://statsmodels.sourceforge.net/devel/generated/statsmodels.sandbox.stats.multicomp.TukeyHSDResults.html#statsmodels.sandbox.stats.multicomp.TukeyHSDResults
-        These are the original data:
-        post_hoc_res.data
-        post_hoc_res.groups
-
-        These are used for the current output:
-        post_hoc_res.groupsunique
-        post_hoc_res.meandiffs
-        post_hoc_res.confint
-        post_hoc_res.reject
-        '''
+        # TODO create our own output
     return text_result, effect_size_result
 
-def two_way_anova(pdf, var_name, grouping_names):
-    """Two-way ANOVA
+def factorial_anova(pdf, var_name, grouping_names):
+    """Factorial ANOVA with any number of grouping variables
+
+    The Type III sums of squares are computed from the number of cases, the mean and the sum of squares of the cells.
 
     Arguments:
     pdf (pd dataframe)
     var_name (str):
     grouping_names (list of str):
     """
-    # TODO extend it to multi-way ANOVA
     text_result = ''
 
-    # http://statsmodels.sourceforge.net/stable/examples/generated/example_interactions.html#one-way-anova
-    from statsmodels.formula.api import ols
-    from statsmodels.stats.anova import anova_lm
     data = pdf.dropna(subset=[var_name] + grouping_names)
-    # from IPython import embed; embed()
-    # FIXME If there is a variable called 'C', then patsy is confused whether C is the variable or the categorical variable
-    # http://gotoanswer.stanford.edu/?q=Statsmodels+Categorical+Data+from+Formula+%28using+pandas%
-    # http://stackoverflow.com/questions/22545242/statsmodels-categorical-data-from-formula-using-pandas
-    # http://stackoverflow.com/questions/26214409/ipython-notebook-and-patsy-categorical-variable-formula
-    anova_model = ols(str('%s ~ C(%s) + C(%s) + C(%s):C(%s)' % (var_name, grouping_names[0], grouping_names[1], grouping_names[0], grouping_names[1])), data=data).fit()
-    anova_result = anova_lm(anova_model, typ=3)
-    text_result += _('Result of two-way ANOVA:' + '\n')
-    # Main effects
-    for group_i, group in enumerate(grouping_names):
-        text_result += _('Main effect of %s: ' % group) + '<i>F</i>(%d, %d) = %0.3g, %s\n' % \
-                       (anova_result['df'][group_i+1], anova_result['df'][4], anova_result['F'][group_i+1],
-                        cs_util.print_p(anova_result['PR(>F)'][group_i+1]))
-    # Interaction effects
-    text_result += _('Interaction of %s and %s: ') % (grouping_names[0], grouping_names[1]) + '<i>F</i>(%d, %d) = %0.3g, %s\n' % \
-                   (anova_result['df'][3], anova_result['df'][4], anova_result['F'][3], cs_util.print_p(anova_result['PR(>F)'][3]))
+    cell_stats = cs_stat_num.cell_statistics(data, var_name, grouping_names)
+    anova_result, [dfd, ssd] = cs_stat_num.factorial_anova(cell_stats)
+    if len(grouping_names) == 2:
+        text_result += _('Result of two-way ANOVA:' + '\n')
+    else:
+        text_result += _('Result of %d-way ANOVA:') % len(grouping_names) + '\n'
+    for term, (dfn, ssn, f, p) in zip(anova_result.index, anova_result.values):
+        # Main effects
+        if len(term) == 1:
+            text_result += _('Main effect of %s: ' % term[0])
+        # Interaction effects
+        else:
+            text_result += _('Interaction of %s and %s: ') % (', '.join(term[:-1]), term[-1])
+        text_result += '<i>F</i>(%d, %d) = %0.3g, %s\n' % (dfn, dfd, f, cs_util.print_p(p))
 
     """ # TODO
     # http://en.wikipedia.org/wiki/Effect_size#Omega-squared.2C_.CF.892
@@ -904,7 +1016,7 @@ def two_way_anova(pdf, var_name, grouping_names):
     """ # TODO
     # http://statsmodels.sourceforge.net/stable/stats.html#multiple-tests-and-multiple-comparison-procedures
     if anova_result['PR(>F)'][0] < 0.05:  # post-hoc
-        post_hoc_res = sm.stats.multicomp.pairwise_tukeyhsd(np.array(data[var_name]), np.array(data[grouping_name]),
+        post_hoc_res = pairwise_tukeyhsd(np.array(data[var_name]), np.array(data[grouping_name]),
                                                             alpha=0.05)
         text_result += '\n' + _(u'Groups differ. Post-hoc test of the means.') + '\n'
         text_result += ('<fix_width_font>%s\n<default>' % post_hoc_res).replace(' ', u'\\u00a0')
@@ -923,21 +1035,27 @@ def two_way_anova(pdf, var_name, grouping_names):
     """
     return text_result
 
-def kruskal_wallis_test(pdf, var_name, grouping_name):
+def kruskal_wallis_test(pdf, var_name, grouping_name, rank_cache=None):
     """Kruskal-Wallis test
 
+    The test is computed from the precomputed ranks.
+
     Arguments:
     var_name (str):
     grouping_name (str):
+    rank_cache (cs_stat_num.RankCache): sort orders of pdf, or None to sort the data here
     """
     # Not available in statsmodels
     text_result = ''
 
-    dummy_groups, variables = _split_into_groups(pdf, var_name, grouping_name)
-    variables = [variable.dropna() for variable in variables]
+    if rank_cache is None:
+        rank_cache = cs_stat_num.RankCache(pdf)
+    valid_cases = pdf[[var_name, grouping_name]].notna().all(axis=1).values
+    codes = pd.factorize(np.asarray(pdf[grouping_name])[valid_cases])[0]
     try:
-        H, p = stats.kruskal(*variables)
-        df = len(dummy_groups)-1
+        H, p = cs_stat_num.kruskal_wallis(rank_cache.ranks(var_name, valid_cases)[valid_cases], codes,
+                                          rank_cache.tie_sizes(var_name, valid_cases))
+        df = codes.max()
         n = len(pdf[var_name].dropna())  # TODO Is this OK here?
         text_result += _('Result of the Kruskal-Wallis test: ')+'&chi;<sup>2</sup>(%d, <i>N</i> = %d) = %0.3g, %s\n' % \
                                                                 (df, n, H, cs_util.print_p(p))  # χ2(1, N=90)=0.89, p=.35
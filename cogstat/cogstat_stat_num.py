@@ -8,10 +8,380 @@ Arguments are the pandas data frame (pdf) and parameters.
 Output is the result of the numerical analysis in numerical form.
 """
 
+import itertools
+
 import numpy as np
 from scipy import stats
 import pandas as pd
 
+### Ranks ###
+
+
+class RankCache:
+    """
+    Sort orders of the variables of a data frame
+
+    Every variable is sorted only once, when its ranks or sorted values are first needed. The ranks of any subset of
+    the cases are computed from the sort order in a single pass, so the rank-based tests and charts do not sort the
+    data again. Create a new RankCache when the data change.
+    """
+
+    def __init__(self, pdf):
+        self.pdf = pdf
+        self._sort_orders = {}
+
+    def sort_order(self, var_name):
+        """
+        Positions of the cases with valid values in the order of the values; tied values keep the order of the cases
+
+        ### Arguments:
+        var_name: label of the variable
+
+        ### Returns: sort_order
+        sort_order: numpy array of positions in the data frame
+        """
+        if var_name not in self._sort_orders:
+            valid_positions = np.flatnonzero(self.pdf[var_name].notna().values)
+            self._sort_orders[var_name] = valid_positions[np.argsort(self.pdf[var_name].values[valid_positions],
+                                                                     kind='mergesort')]
+        return self._sort_orders[var_name]
+
+    def _selected_sort_order(self, var_name, mask):
+        order = self.sort_order(var_name)
+        if mask is not None:
+            order = order[np.asarray(mask)[order]]
+        return order
+
+    def sorted_values(self, var_name, mask=None):
+        """
+        Sorted valid values of a variable
+
+        ### Arguments:
+        var_name: label of the variable
+        mask: boolean array of the cases to include; all cases with valid values are included if None
+
+        ### Returns: sorted_values
+        sorted_values: numpy array
+        """
+        return self.pdf[var_name].values[self._selected_sort_order(var_name, mask)]
+
+    def _ties(self, var_name, mask):
+        order = self._selected_sort_order(var_name, mask)
+        sorted_values = self.pdf[var_name].values[order]
+        new_value = np.r_[True, sorted_values[1:] != sorted_values[:-1]]
+        return order, new_value, np.r_[np.flatnonzero(new_value), len(order)]
+
+    def ranks(self, var_name, mask=None):
+        """
+        Ranks of the cases; tied values get the average of their ranks (as scipy.stats.rankdata() does)
+
+        ### Arguments:
+        var_name: label of the variable
+        mask: boolean array of the cases to rank; all cases with valid values are ranked if None
+
+        ### Returns: ranks
+        ranks: numpy array of the ranks of all cases in the order of the data frame; np.nan for the cases that are
+               not ranked
+        """
+        order, new_value, tie_bounds = self._ties(var_name, mask)
+        tie_index = np.cumsum(new_value) - 1
+        ranks = np.full(len(self.pdf), np.nan)
+        ranks[order] = (tie_bounds[tie_index] + tie_bounds[tie_index + 1] + 1) / 2.0
+        return ranks
+
+    def ranks_of(self, var_name, values, mask=None):
+        """
+        Ranks of some values among the values of a variable, e.g., the ranks of the cases of a group
+
+        ### Arguments:
+        var_name: label of the variable
+        values: values of the variable
+        mask: boolean array of the cases to rank; all cases with valid values are ranked if None
+
+        ### Returns: ranks
+        ranks: numpy array of the ranks of the values
+        """
+        sorted_values = self.sorted_values(var_name, mask)
+        return (np.searchsorted(sorted_values, values, side='left') +
+                np.searchsorted(sorted_values, values, side='right') + 1) / 2.0
+
+    def tie_sizes(self, var_name, mask=None):
+        """
+        Number of cases with the same value for every different value of a variable
+
+        ### Arguments:
+        var_name: label of the variable
+        mask: boolean array of the cases to include; all cases with valid values are included if None
+
+        ### Returns: tie_sizes
+        tie_sizes: numpy array
+        """
+        return np.diff(self._ties(var_name, mask)[2])
+
+
+### Single variables ###
+
+
+def frequencies(pdf, var_name):
+    """Compute the frequencies of the values of a variable in a single pass.
+
+    :param pdf: pandas data frame
+    :param var_name: name of the variable
+    :return: values (list, sorted, missing values excluded), frequencies, relative frequencies, cumulative frequencies,
+        cumulative relative frequencies (numpy arrays for the values), number of missing values
+        Relative frequencies are computed with the total number of cases, including the missing cases.
+    """
+    counts = pdf[var_name].value_counts(sort=False).sort_index()
+    total_count = float(len(pdf[var_name]))
+    freqs = counts.values
+    rel_freqs = freqs / total_count
+    return counts.index.tolist(), freqs, rel_freqs, np.cumsum(freqs), np.cumsum(rel_freqs), \
+           len(pdf[var_name]) - int(freqs.sum())
+
+
+def _sorted_percentile(sorted_data, q):
+    """Percentile of sorted data along the first axis with linear interpolation (as numpy.percentile does)."""
+    position = q / 100.0 * (sorted_data.shape[0] - 1)
+    lower_index = int(np.floor(position))
+    upper_index = min(lower_index + 1, sorted_data.shape[0] - 1)
+    fraction = position - lower_index
+    difference = sorted_data[upper_index] - sorted_data[lower_index]
+    # same rounding as in numpy
+    if fraction < 0.5:
+        return sorted_data[lower_index] + difference * fraction
+    else:
+        return sorted_data[upper_index] - difference * (1 - fraction)
+
+
+def descriptives(data):
+    """Compute the descriptive statistics of one or more variables with a single sort.
+
+    The variables are processed together, so all the variables should have the same number of cases (e.g., the
+    columns of a data frame after dropping the missing cases). For groups with different sizes, use
+    grouped_descriptives().
+
+    :param data: 1 or 2 dimensional array-like without missing values; columns are the variables
+    :return: dictionary of numpy arrays (one value per variable) with the keys 'mean', 'std' (of the sample), 'skew',
+        'kurtosis' (with the bias=False correction which gives the same values as SPSS), 'amin', 'amax', 'ptp',
+        'lower_quartile', 'median', 'upper_quartile'
+        If there are no cases, all the statistics are nan.
+    """
+    data = np.asarray(data, dtype=float)
+    if data.ndim == 1:
+        data = data[:, np.newaxis]
+    n = data.shape[0]
+    if n == 0:
+        nans = np.full(data.shape[1], np.nan)
+        return {stat: nans for stat in ['mean', 'std', 'skew', 'kurtosis', 'amin', 'amax', 'ptp', 'lower_quartile',
+                                        'median', 'upper_quartile']}
+
+    # moments are computed in the original order of the data to get the same values as numpy functions
+    mean = data.mean(axis=0)
+    deviation = data - mean
+    squared_deviation = deviation ** 2
+    m2 = squared_deviation.mean(axis=0)
+    m3 = (squared_deviation * deviation).mean(axis=0)
+    m4 = (squared_deviation ** 2).mean(axis=0)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        # constant variables have no skewness and kurtosis (similarly to scipy.stats)
+        constant = m2 <= (np.finfo(float).resolution * mean) ** 2
+        skew = np.where(constant, np.nan, m3 / m2 ** 1.5)
+        kurtosis = np.where(constant, np.nan, m4 / m2 ** 2 - 3)
+        # bias correction as in scipy.stats.skew() and scipy.stats.kurtosis() with bias=False
+        if n > 2:
+            skew = skew * np.sqrt((n - 1.0) * n) / (n - 2.0)
+        if n > 3:
+            kurtosis = ((n + 1.0) * kurtosis + 6.0) * (n - 1.0) / ((n - 2.0) * (n - 3.0))
+
+    # order statistics are computed with a single sort
+    sorted_data = np.sort(data, axis=0)
+
+    return {'mean': mean, 'std': np.sqrt(m2), 'skew': skew, 'kurtosis': kurtosis,
+            'amin': sorted_data[0], 'amax': sorted_data[-1], 'ptp': sorted_data[-1] - sorted_data[0],
+            'lower_quartile': _sorted_percentile(sorted_data, 25), 'median': _sorted_percentile(sorted_data, 50),
+            'upper_quartile': _sorted_percentile(sorted_data, 75)}
+
+
+def grouped_descriptives(values, codes, group_n):
+    """Compute the descriptive statistics of a variable in several groups with a single sort.
+
+    The moments are summed per group with np.bincount, and the order statistics are read from the data sorted by group
+    and value at the group offsets.
+
+    :param values: 1 dimensional array-like without missing values
+    :param codes: 1 dimensional array of the index of the group of the values (0 <= code < group_n)
+    :param group_n: number of groups
+    :return: dictionary of numpy arrays (one value per group) with the same keys as descriptives()
+        The statistics of groups without cases are nan.
+    """
+    values = np.asarray(values, dtype=float)
+    codes = np.asarray(codes, dtype=np.int64)
+    if len(values) == 0:
+        nans = np.full(group_n, np.nan)
+        return {stat: nans for stat in ['mean', 'std', 'skew', 'kurtosis', 'amin', 'amax', 'ptp', 'lower_quartile',
+                                        'median', 'upper_quartile']}
+    n = np.bincount(codes, minlength=group_n).astype(float)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        mean = np.bincount(codes, values, minlength=group_n) / n
+        deviation = values - mean[codes]
+        squared_deviation = deviation ** 2
+        m2 = np.bincount(codes, squared_deviation, minlength=group_n) / n
+        m3 = np.bincount(codes, squared_deviation * deviation, minlength=group_n) / n
+        m4 = np.bincount(codes, squared_deviation ** 2, minlength=group_n) / n
+        # constant variables have no skewness and kurtosis (similarly to scipy.stats)
+        constant = m2 <= (np.finfo(float).resolution * mean) ** 2
+        skew = np.where(constant, np.nan, m3 / m2 ** 1.5)
+        kurtosis = np.where(constant, np.nan, m4 / m2 ** 2 - 3)
+        # bias correction as in scipy.stats.skew() and scipy.stats.kurtosis() with bias=False
+        skew = np.where(n > 2, skew * np.sqrt((n - 1.0) * n) / (n - 2.0), skew)
+        kurtosis = np.where(n > 3, ((n + 1.0) * kurtosis + 6.0) * (n - 1.0) / ((n - 2.0) * (n - 3.0)), kurtosis)
+
+    # order statistics are computed with a single sort by group and value
+    sorted_values = values[np.lexsort((values, codes))]
+    sizes = n.astype(np.int64)
+    empty = sizes == 0
+    # positions in the sorted data are relative to the group offsets; empty groups point to the first value, and their
+    # statistics are replaced with nan
+    offsets = np.where(empty, 0, np.cumsum(sizes) - sizes)
+    last_index = np.maximum(sizes - 1, 0)
+
+    def sorted_percentile(q):
+        """Percentile of the groups with linear interpolation (as _sorted_percentile() does)"""
+        position = q / 100.0 * last_index
+        lower_index = np.floor(position).astype(np.int64)
+        upper_index = np.minimum(lower_index + 1, last_index)
+        fraction = position - lower_index
+        lower_value = sorted_values[offsets + lower_index]
+        upper_value = sorted_values[offsets + upper_index]
+        difference = upper_value - lower_value
+        # same rounding as in numpy
+        percentile = np.where(fraction < 0.5, lower_value + difference * fraction,
+                              upper_value - difference * (1 - fraction))
+        return np.where(empty, np.nan, percentile)
+
+    amin = np.where(empty, np.nan, sorted_values[offsets])
+    amax = np.where(empty, np.nan, sorted_values[offsets + last_index])
+    return {'mean': mean, 'std': np.sqrt(m2), 'skew': skew, 'kurtosis': kurtosis,
+            'amin': amin, 'amax': amax, 'ptp': amax - amin,
+            'lower_quartile': sorted_percentile(25), 'median': sorted_percentile(50),
+            'upper_quartile': sorted_percentile(75)}
+
+
+def _dagostino_pearson(n, skewness, kurtosis):
+    """
+    D'Agostino-Pearson K-squared test from the sample size, skewness and kurtosis (as scipy.stats.normaltest() does)
+
+    ### Arguments:
+    n, skewness, kurtosis: numpy arrays of the sample sizes, biased skewnesses and biased (non-Fisher) kurtoses
+
+    ### Returns: K2, p
+    K2, p: numpy arrays of the K-squared statistics and the p values
+    """
+    # Skewness test
+    y = skewness * np.sqrt(((n + 1) * (n + 3)) / (6.0 * (n - 2)))
+    beta2 = 3.0 * (n ** 2 + 27 * n - 70) * (n + 1) * (n + 3) / ((n - 2.0) * (n + 5) * (n + 7) * (n + 9))
+    W2 = -1 + np.sqrt(2 * (beta2 - 1))
+    delta = 1 / np.sqrt(0.5 * np.log(W2))
+    alpha = np.sqrt(2.0 / (W2 - 1))
+    y = np.where(y == 0, 1, y)
+    z_skewness = delta * np.log(y / alpha + np.sqrt((y / alpha) ** 2 + 1))
+    # Kurtosis test
+    E = 3.0 * (n - 1) / (n + 1)
+    varb2 = 24.0 * n * (n - 2) * (n - 3) / ((n + 1) * (n + 1.0) * (n + 3) * (n + 5))
+    x = (kurtosis - E) / np.sqrt(varb2)
+    sqrtbeta1 = 6.0 * (n * n - 5 * n + 2) / ((n + 7) * (n + 9)) * np.sqrt((6.0 * (n + 3) * (n + 5)) /
+                                                                          (n * (n - 2) * (n - 3)))
+    A = 6.0 + 8.0 / sqrtbeta1 * (2.0 / sqrtbeta1 + np.sqrt(1 + 4.0 / (sqrtbeta1 ** 2)))
+    term1 = 1 - 2 / (9.0 * A)
+    denom = 1 + x * np.sqrt(2 / (A - 4.0))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        term2 = np.sign(denom) * np.where(denom == 0.0, np.nan, ((1 - 2.0 / A) / np.abs(denom)) ** (1 / 3.0))
+    z_kurtosis = (term1 - term2) / np.sqrt(2 / (9.0 * A))
+    K2 = z_skewness ** 2 + z_kurtosis ** 2
+    return K2, stats.chi2.sf(K2, 2)
+
+
+def normality_tests(samples, shapiro_max_n=5000):
+    """
+    Normality tests of several samples
+
+    Samples up to shapiro_max_n cases are tested with the Shapiro-Wilk test. The Shapiro-Wilk test is slow and its p
+    value is not accurate for larger samples, so those are tested with the D'Agostino-Pearson test. The moments of all
+    large samples are computed in a single pass.
+
+    ### Arguments:
+    samples: list of numpy arrays without missing values; every sample should include at least 3 cases
+    shapiro_max_n: largest sample tested with the Shapiro-Wilk test
+
+    ### Returns: tests, statistics, ps
+    tests: list of 'shapiro' or 'dagostino' for the samples
+    statistics: numpy array of the W statistics of the Shapiro-Wilk test or the K-squared statistics of the
+                D'Agostino-Pearson test
+    ps: numpy array of the p values
+    """
+    tests = ['shapiro' if len(sample) <= shapiro_max_n else 'dagostino' for sample in samples]
+    statistics = np.full(len(samples), np.nan)
+    ps = np.full(len(samples), np.nan)
+    for sample_i, sample in enumerate(samples):
+        if tests[sample_i] == 'shapiro':
+            statistics[sample_i], ps[sample_i] = stats.shapiro(sample)
+    large_samples = [sample_i for sample_i, test in enumerate(tests) if test == 'dagostino']
+    if large_samples:
+        values = np.concatenate([samples[sample_i] for sample_i in large_samples]).astype(float)
+        n = np.array([len(samples[sample_i]) for sample_i in large_samples], dtype=float)
+        codes = np.repeat(np.arange(len(large_samples)), n.astype(int))
+        deviations = values - (np.bincount(codes, weights=values) / n)[codes]
+        squared_deviations = deviations * deviations
+        m2, m3, m4 = [np.bincount(codes, weights=powers) / n for powers in
+                      (squared_deviations, squared_deviations * deviations, squared_deviations * squared_deviations)]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            statistics[large_samples], ps[large_samples] = _dagostino_pearson(n, m3 / m2 ** 1.5, m4 / m2 ** 2)
+    return tests, statistics, ps
+
+
+def outlier_limits(data, mode='2sd'):
+    """Compute the range of the non-outlier values of variables.
+
+    :param data: 2 dimensional array-like, columns are the variables; missing values (nan) are ignored
+    :param mode: '2sd': mean +- 2 standard deviations (population estimation)
+                 'mad': median +- 2.5 median absolute deviations (scaled to be consistent with the standard
+                        deviation of the normal distribution; Leys et al., 2013)
+                 'iqr': lower quartile - 1.5 interquartile range and upper quartile + 1.5 interquartile range (Tukey
+                        fences)
+    :return: numpy arrays of the lower and upper limits of the variables
+    """
+    data = np.asarray(data, dtype=float)
+    if mode == '2sd':
+        center = np.nanmean(data, axis=0)
+        spread = 2 * np.nanstd(data, axis=0, ddof=1)
+        return center - spread, center + spread
+    elif mode == 'mad':
+        center = np.nanmedian(data, axis=0)
+        spread = 2.5 * 1.4826 * np.nanmedian(np.abs(data - center), axis=0)
+        return center - spread, center + spread
+    elif mode == 'iqr':
+        lower_quartile, upper_quartile = np.nanpercentile(data, [25, 75], axis=0)
+        spread = 1.5 * (upper_quartile - lower_quartile)
+        return lower_quartile - spread, upper_quartile + spread
+    else:
+        raise ValueError('Unknown outlier mode: %s' % mode)
+
+
+def mahalanobis_distance(data):
+    """Compute the squared Mahalanobis distance of the cases from the mean of the variables.
+
+    :param data: 2 dimensional array-like, columns are the variables
+    :return: numpy array of the squared distances; nan for cases with missing values
+    """
+    data = np.asarray(data, dtype=float)
+    complete_cases = ~np.isnan(data).any(axis=1)
+    deviation = data[complete_cases] - data[complete_cases].mean(axis=0)
+    inverse_cov = np.linalg.pinv(np.atleast_2d(np.cov(deviation, rowvar=False)))
+    distances = np.full(len(data), np.nan)
+    distances[complete_cases] = np.einsum('ij,jk,ik->i', deviation, inverse_cov, deviation)
+    return distances
+
+
 ### Variable pairs ###
 
 
@@ -29,6 +399,106 @@ def corr_ci(r, n, confidence=0.95):
     return lower, upper
 
 
+def spearman_r(x_ranks, y_ranks):
+    """
+    Spearman's rank-order correlation computed from the ranks of the variables
+
+    The result is the same as the result of scipy.stats.spearmanr() with the raw data.
+
+    ### Arguments:
+    x_ranks, y_ranks: numpy arrays of the ranks of the cases without missing values
+
+    ### Returns: r, p
+    r: correlation coefficient; np.nan if there are not enough cases or a variable is constant
+    p: two-sided p value of the t test of the coefficient
+    """
+    if len(x_ranks) <= 1 or np.all(x_ranks == x_ranks[0]) or np.all(y_ranks == y_ranks[0]):
+        return np.nan, np.nan
+    r = np.corrcoef(x_ranks, y_ranks)[1, 0]
+    df = len(x_ranks) - 2
+    with np.errstate(divide='ignore'):
+        t = r * np.sqrt(np.clip(df / ((r + 1.0) * (1.0 - r)), 0, None))
+    return r, 2 * stats.t.sf(np.abs(t), df)
+
+
+def pairwise_correlations(values, valid):
+    """
+    Pearson correlation matrix with pairwise deletion of the missing values
+
+    All sums needed for all pairs of variables are computed with a few matrix products, so the variable pairs are not
+    handled one by one.
+
+    ### Arguments:
+    values: 2d numpy array of the data (cases x variables); the missing values can be anything
+    valid: boolean 2d numpy array; True for the valid values
+
+    ### Returns: r, n
+    r: 2d numpy array of the correlation coefficients; np.nan for the pairs with a constant variable
+    n: 2d numpy array of the numbers of the cases where both variables are valid
+    """
+    valid = valid.astype(float)
+    x = np.where(valid, values, 0.0)
+    # Center the variables to reduce the rounding errors
+    with np.errstate(divide='ignore', invalid='ignore'):
+        x -= np.nan_to_num(np.sum(x, axis=0) / np.sum(valid, axis=0)) * valid
+    n = valid.T @ valid
+    sum_x = x.T @ valid  # sum of the first variable of the pair in the cases where both variables are valid
+    sum_x2 = (x * x).T @ valid
+    with np.errstate(divide='ignore', invalid='ignore'):
+        cov = x.T @ x - sum_x * sum_x.T / n
+        var = sum_x2 - sum_x * sum_x / n
+        r = np.clip(cov / np.sqrt(var * var.T), -1, 1)
+    r[(var <= 0) | (var.T <= 0)] = np.nan
+    np.fill_diagonal(r, np.where(np.diag(var) > 0, 1.0, np.nan))
+    return r, n.astype(int)
+
+
+def rank_correlations(rank_cache, var_names):
+    """
+    Spearman's rank-order correlation matrix with pairwise deletion of the missing values
+
+    The variables are ranked once, and the correlations of the ranks are computed with pairwise_correlations(). The
+    cases of a pair have to be ranked again only if the variables have missing values in different cases.
+
+    ### Arguments:
+    rank_cache: RankCache of the data
+    var_names: list of labels of the variables
+
+    ### Returns: r, n
+    r, n: as in pairwise_correlations()
+    """
+    ranks = np.column_stack([rank_cache.ranks(var_name) for var_name in var_names])
+    valid = ~np.isnan(ranks)
+    r, n = pairwise_correlations(ranks, valid)
+    valid_n = np.diag(n)
+    different_cases = (n != valid_n[:, np.newaxis]) | (n != valid_n[np.newaxis, :])
+    for i, j in zip(*np.nonzero(np.triu(different_cases, 1))):
+        both_valid = valid[:, i] & valid[:, j]
+        # The mean of the ranks of n cases is (n+1)/2
+        x = rank_cache.ranks(var_names[i], both_valid)[both_valid] - (n[i, j] + 1) / 2.0
+        y = rank_cache.ranks(var_names[j], both_valid)[both_valid] - (n[i, j] + 1) / 2.0
+        with np.errstate(divide='ignore', invalid='ignore'):
+            r[i, j] = r[j, i] = np.dot(x, y) / np.sqrt(np.dot(x, x) * np.dot(y, y))
+    return r, n
+
+
+def correlation_p(r, n):
+    """
+    Two-sided p values of the t tests of correlation coefficients
+
+    ### Arguments:
+    r: numpy array of the correlation coefficients
+    n: numpy array of the sample sizes
+
+    ### Returns: p
+    p: numpy array of the p values; np.nan if there are less than 3 cases
+    """
+    df = np.asarray(n, dtype=float) - 2
+    with np.errstate(divide='ignore', invalid='ignore'):
+        t = r * np.sqrt(np.clip(df / ((1.0 + r) * (1.0 - r)), 0, None))
+        return np.where(df > 0, 2 * stats.t.sf(np.abs(t), df), np.nan)
+
+
 def modified_t_test(ind_data, group_data):
     """Compare a single case to a group.
 
@@ -160,6 +630,28 @@ def slope_extremity_test(n_trials, case_slope, case_SE, control_slopes, control_
     return t, df, p, test
 
 
+def _wide_table(data, dep_var, indep_var=None, id_var=None, wide=True):
+    """
+    Create the subjects × conditions numpy array from wide or long format data
+
+    ### Arguments:
+    See repeated_measures_anova()
+
+    ### Returns: 2d numpy array, rows are the subjects, columns are the conditions (in the order of dep_var for wide
+                format, and in the sorted order of the conditions for long format)
+    """
+    if wide:
+        if id_var:  # several rows of the same participant are averaged
+            data = data.groupby(id_var)[dep_var].mean()
+        else:
+            data = data[dep_var]
+        table = np.asarray(data, dtype=float)
+    else:
+        table = pd.pivot_table(data, values=dep_var, index=id_var, columns=indep_var, aggfunc=np.mean,
+                               observed=True).values
+    return table
+
+
 def repeated_measures_anova(data, dep_var, indep_var=None, id_var=None, wide=True):
     """
     Standard one-way repeated measures ANOVA
@@ -183,57 +675,35 @@ def repeated_measures_anova(data, dep_var, indep_var=None, id_var=None, wide=Tru
                 the corrected df values)
     """
     ### Reshaping data
-    if wide:
-        if not id_var:
-            data = data.assign(ID=data.index)
-            id_var = 'ID'
-        data = pd.melt(data, id_vars=id_var, value_vars=dep_var, var_name='condition', value_name='measured')
-        dep_var = 'measured'
-        indep_var = 'condition'
+    # The computations use the subjects × conditions matrix
+    table = _wide_table(data, dep_var, indep_var, id_var, wide)
+    n, k = table.shape
 
     ### one-way ANOVA
-    n = len(set(data[id_var]))
-    k = len(set(data[indep_var]))
     DFn = (k-1)
     DFd = (k-1)*(n-1)
-    q_eff = []
-    q_err = []
-    for j, var in enumerate(list(set(data[indep_var]))):
-        subset_j = data[data[indep_var] == var]
-        q_eff.insert(j, n*np.square(np.mean(subset_j[dep_var])-np.mean(data[dep_var])))
-        for i, sub in enumerate(list(set(data[id_var]))):
-            subset_i = data[data[id_var] == sub]
-            subset_ij = subset_j[subset_j[id_var] == sub]
-            q_err.insert(j+i, np.square(np.mean(subset_ij[dep_var]) -np.mean(subset_i[dep_var]) - np.mean(subset_j[dep_var]) + np.mean(data[dep_var])))
-    # F-statistic    
-    F = (sum(q_eff)/DFn)/(sum(q_err)/DFd)
-    pF = 1-stats.f.cdf(F, DFn, DFd)
+    grand_mean = np.mean(table)
+    condition_means = np.mean(table, axis=0)
+    subject_means = np.mean(table, axis=1)
+    q_eff = n * np.sum(np.square(condition_means - grand_mean))
+    q_err = np.sum(np.square(table - subject_means[:, np.newaxis] - condition_means[np.newaxis, :] + grand_mean))
+    # F-statistic
+    F = (q_eff/DFn)/(q_err/DFd)
+    pF = stats.f.sf(F, DFn, DFd)
 
     ### Mauchly's test for sphericity & Degree of freedom corrections
     # Calculating sample covariances
-    table = np.empty((0, n))
-    for j, var in enumerate(list(set(data[indep_var]))):
-        subset_j = data[data[indep_var] == var]
-        row = []
-        for i, sub in enumerate(list(set(data[id_var]))):
-            subset_ij = subset_j[subset_j[id_var] == sub]
-            row.insert(i, np.mean(subset_ij[dep_var].values))
-        table = np.vstack([table, np.asarray(row)])    
-    samp_table = np.cov(table)
+    samp_table = np.cov(table, rowvar=False)
     samp_means = samp_table.mean(axis=1)
     # Estimating population covariances
-    pop_table = np.empty((0, k))
-    for x in range(k):
-        row = []
-        for y in range(k):
-            row.insert(y, samp_table[x][y]-samp_means[x]-samp_means[y]+samp_table.mean())
-        pop_table = np.vstack([pop_table, np.asarray(row)])
+    pop_table = samp_table - samp_means[:, np.newaxis] - samp_means[np.newaxis, :] + samp_table.mean()
     # Mauchly's W statistic
-    W = np.prod([x for x in list(np.linalg.eigvals(pop_table)) if x > 0.00000000001])/np.power(np.trace(pop_table)/(k-1), (k-1)) # uses the pseudo-determinant (discards all near-zero eigenvalues)
+    eigenvalues = np.linalg.eigvalsh(pop_table)
+    W = np.prod(eigenvalues[eigenvalues > 0.00000000001])/np.power(np.trace(pop_table)/(k-1), (k-1)) # uses the pseudo-determinant (discards all near-zero eigenvalues)
     dfW = int((0.5*k*(k-1))-1)
     fW = float(2*np.square(k-1)+(k-1)+2)/float(6*(k-1)*(n-1))
     chiW = (fW-1)*(n-1)*np.log(W)
-    pW = 1-stats.chi2.cdf(chiW, dfW)
+    pW = stats.chi2.sf(chiW, dfW)
 
     # Greenhouse & Geisser's epsilon
     GG = np.square(np.trace(pop_table))/(np.sum(np.square(pop_table))*(k-1))
@@ -242,12 +712,9 @@ def repeated_measures_anova(data, dep_var, indep_var=None, id_var=None, wide=Tru
     # Lower-bound epsilon
     LB = 1/float(k-1)
     # Correction
-    corr_list = [GG, HF, LB]
-    corr_table = np.empty((0, 2))
-    for epsilon in corr_list:
-        F_corr = (sum(q_eff)/(DFn*epsilon))/(sum(q_err)/(DFd*epsilon))
-        pF_corr = 1-stats.f.cdf(F_corr, DFn*epsilon, DFd*epsilon)
-        corr_table = np.vstack([corr_table, np.array([epsilon, pF_corr])])
+    # the epsilon cancels out from the F statistic, only the df values are corrected
+    epsilons = np.array([GG, HF, LB])
+    corr_table = np.column_stack([epsilons, stats.f.sf(F, DFn*epsilons, DFd*epsilons)])
 
     return [DFn, DFd, F, pF, W, pW], corr_table
 
@@ -255,53 +722,283 @@ def repeated_measures_anova(data, dep_var, indep_var=None, id_var=None, wide=Tru
 def pairwise_ttest(data, dep_var, indep_var=None, id_var=None, wide=True, paired=True):
     """
     Posthoc pairwise t-tests for ANOVA
-    
+
+    All pairs are computed at once from the means and the (co)variances of the conditions.
+
     ### Arguments:
     data: pandas DataFrame
     dep_var: dependent variable - label (long format) or a list of labels (wide format)
     indep_var: label of the independent variable (only necessary if data is in long format)
     id_var: label of the variable which contains the participants' identifiers. Default assumes that the table index
-            contains the identifiers.
+            contains the identifiers (wide format) or that the cases of a participant are in the same order in all
+            conditions (long format).
     wide: whether the data is in wide format
     paired: whether the samples are related
-    
+
     ### Returns: pandas DataFrame with the t-statistics and associated p values (corrected and uncorrected) of each
-                pairings
+                pairings; pairs are in the order of dep_var (wide format) or in the sorted order of the conditions
+                (long format)
     """
-    # TODO keep the order of the dep_vars
-    ### Reshaping data
-    if wide:
-        if not id_var:
-            data = data.assign(ID=data.index)
-            id_var = 'ID'
-        data = pd.melt(data, id_vars=id_var, value_vars=dep_var, var_name='condition', value_name='measured')
-        dep_var = 'measured'
-        indep_var = 'condition'
-    # Selecting test
     if paired:
-        test = stats.ttest_rel
+        if not wide and not id_var:
+            data = data.assign(ID=data.groupby(indep_var, observed=True).cumcount())
+            id_var = 'ID'
+        table = _wide_table(data, dep_var, indep_var, id_var, wide)
+        conditions = list(dep_var) if wide else sorted(set(data[indep_var]))
+        n = table.shape[0]
+        means = table.mean(axis=0)
+        cov = np.atleast_2d(np.cov(table, rowvar=False))
+        i, j = np.triu_indices(len(conditions), 1)
+        # variance of the difference of the conditions
+        var_diff = cov[i, i] + cov[j, j] - 2 * cov[i, j]
+        t = (means[i] - means[j]) / np.sqrt(var_diff / n)
+        df = n - 1
     else:
-        test = stats.ttest_ind
-
-    # Pairwise t-tests
-    table = np.empty((0, 2))
-    pairings = []
-    for f in list(set(data[indep_var])):
-        for f2 in list(set(data[indep_var])):
-            if f != f2 and (f2, f) not in pairings:
-                subset_f = data[data[indep_var] == f]
-                subset_f2 = data[data[indep_var] == f2]
-                table = np.vstack([table, np.asarray(test(subset_f[dep_var], subset_f2[dep_var]))])
-                pairings.append((f, f2))
+        # missing data are dropped per condition
+        if wide:
+            groups = data[dep_var]
+        else:
+            groups = data.groupby(indep_var, observed=True)[dep_var]
+        counts, means, variances = groups.count(), groups.mean().values, groups.var().values
+        conditions = counts.index.tolist()
+        counts = counts.values
+        i, j = np.triu_indices(len(conditions), 1)
+        df = counts[i] + counts[j] - 2
+        pooled_var = ((counts[i] - 1) * variances[i] + (counts[j] - 1) * variances[j]) / df
+        t = (means[i] - means[j]) / np.sqrt(pooled_var * (1.0 / counts[i] + 1.0 / counts[j]))
+    p = 2 * stats.t.sf(np.abs(t), df)
 
     # Corrections
-    fam_size = (np.square(len(set(data[indep_var])))-len(set(data[indep_var])))/2
-    bonf_list = []
-    holm_list = []
-    sorted_p = sorted(list(table[:, 1]))
-    for p in table[:, 1]:
-        bonf_list.append(min(p*fam_size, 1))
-        holm_list.append(min(p*(fam_size-sorted_p.index(p)), 1))
-    table = np.hstack([table, np.asarray(list(zip(bonf_list, holm_list)))])
-    table = pd.DataFrame(table, index=pd.MultiIndex.from_tuples(pairings), columns=['t', 'p', 'p (Bonf)', 'p (Holm)'])
+    fam_size = len(p)
+    p_bonf = np.minimum(p * fam_size, 1)
+    # rank of the p values (tied values have the same rank)
+    p_rank = np.searchsorted(np.sort(p), p, side='left')
+    p_holm = np.minimum(p * (fam_size - p_rank), 1)
+    pairings = [(conditions[pair_i], conditions[pair_j]) for pair_i, pair_j in zip(i, j)]
+    table = pd.DataFrame(np.column_stack([t, p, p_bonf, p_holm]), index=pd.MultiIndex.from_tuples(pairings),
+                         columns=['t', 'p', 'p (Bonf)', 'p (Holm)'])
     return table
+
+
+### Compare groups ###
+
+
+def group_statistics(data, var_name, grouping_name):
+    """
+    Sufficient statistics of the groups: number of cases, mean and sum of squared deviations from the mean
+
+    The groups are coded once, and every statistic is computed with a single pass over the data, so the data are not
+    copied for the groups.
+
+    ### Arguments:
+    data: pandas DataFrame without missing values in the variables
+    var_name: label of the dependent variable
+    grouping_name: label of the grouping variable
+
+    ### Returns: group_stats
+    group_stats: pandas DataFrame with 'n', 'mean' and 'ss' columns; the index includes the sorted group levels
+    """
+    codes, levels = pd.factorize(data[grouping_name], sort=True)
+    values = np.asarray(data[var_name], dtype=float)
+    n = np.bincount(codes, minlength=len(levels))
+    mean = np.bincount(codes, weights=values, minlength=len(levels)) / n
+    ss = np.bincount(codes, weights=np.square(values - mean[codes]), minlength=len(levels))
+    return pd.DataFrame({'n': n, 'mean': mean, 'ss': ss}, index=levels)
+
+
+def one_way_anova(group_stats):
+    """
+    One-way between-subjects ANOVA computed from the sufficient statistics of the groups
+
+    ### Arguments:
+    group_stats: pandas DataFrame returned by group_statistics()
+
+    ### Returns: [DFn, DFd, F, pF], [SSn, SSd]
+    DFn, DFd: degrees of freedom of the groups and of the error
+    F: F statistic
+    pF: p value of the F statistic
+    SSn, SSd: sum of squares of the groups and of the error
+    """
+    n = group_stats['n'].values
+    means = group_stats['mean'].values
+    grand_mean = np.sum(n * means) / np.sum(n)
+    DFn = len(n) - 1
+    DFd = np.sum(n) - len(n)
+    SSn = np.sum(n * np.square(means - grand_mean))
+    SSd = np.sum(group_stats['ss'].values)
+    F = (SSn/DFn)/(SSd/DFd)
+    pF = stats.f.sf(F, DFn, DFd)
+    return [DFn, DFd, F, pF], [SSn, SSd]
+
+
+def tukey_hsd(group_stats, alpha=0.05):
+    """
+    Tukey HSD post-hoc test computed from the sufficient statistics of the groups
+
+    The result is the same as the result of statsmodels pairwise_tukeyhsd() with the raw data.
+
+    ### Arguments:
+    group_stats: pandas DataFrame returned by group_statistics()
+    alpha: family-wise error rate
+
+    ### Returns: results_table
+    results_table: statsmodels SimpleTable with the mean differences, adjusted p values and confidence intervals of
+                   the pairs of groups
+    """
+    from statsmodels.sandbox.stats.multicomp import tukeyhsd
+    from statsmodels.iolib.table import SimpleTable
+    levels = np.asarray(group_stats.index)
+    n = group_stats['n'].values
+    ms_error = np.sum(group_stats['ss'].values) / (np.sum(n) - len(n))
+    # res contains: 0:(idx1, idx2), 1:reject, 2:meandiffs, 3: std_pairs, 4:confint, 5:q_crit, 6:df_total,
+    # 7:reject2, 8: pvals
+    res = tukeyhsd(group_stats['mean'].values, n, ms_error, df=None, alpha=alpha, q_crit=None)
+    results = np.array(list(zip(levels[res[0][0]], levels[res[0][1]], np.round(res[2], 4), np.round(res[8], 4),
+                                np.round(res[4][:, 0], 4), np.round(res[4][:, 1], 4), res[1])),
+                       dtype=[('group1', object), ('group2', object), ('meandiff', float), ('p-adj', float),
+                              ('lower', float), ('upper', float), ('reject', np.bool_)])
+    results_table = SimpleTable(results, headers=results.dtype.names)
+    results_table.title = 'Multiple Comparison of Means - Tukey HSD, FWER=%4.2f' % alpha
+    return results_table
+
+
+def mann_whitney_u(ranks, in_first_group, tie_sizes):
+    """
+    Two-sided Mann-Whitney U test with normal approximation computed from the ranks of the cases
+
+    The result is the same as the result of the asymptotic scipy.stats.mannwhitneyu() with the raw data, including the
+    continuity and the tie corrections.
+
+    ### Arguments:
+    ranks: numpy array of the ranks of the cases of the two groups
+    in_first_group: boolean numpy array marking the cases of the first group
+    tie_sizes: numpy array of the numbers of cases with the same value, as returned by RankCache.tie_sizes()
+
+    ### Returns: U, p
+    U: U statistic of the first group
+    p: two-sided p value
+    """
+    n1 = np.sum(in_first_group)
+    n2 = len(ranks) - n1
+    n = n1 + n2
+    U1 = np.sum(ranks[in_first_group]) - n1 * (n1 + 1) / 2.0
+    U = max(U1, n1 * n2 - U1)
+    s = np.sqrt(n1 * n2 / 12.0 * ((n + 1) - np.sum(tie_sizes ** 3 - tie_sizes) / float(n * (n - 1))))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        z = (U - n1 * n2 / 2.0 - 0.5) / s
+    return U1, np.clip(2 * stats.norm.sf(z), 0, 1)
+
+
+def kruskal_wallis(ranks, codes, tie_sizes):
+    """
+    Kruskal-Wallis H test computed from the ranks of the cases
+
+    The result is the same as the result of scipy.stats.kruskal() with the raw data.
+
+    ### Arguments:
+    ranks: numpy array of the ranks of the cases
+    codes: numpy array of the group codes (0, 1, ...) of the cases
+    tie_sizes: numpy array of the numbers of cases with the same value, as returned by RankCache.tie_sizes()
+
+    ### Returns: H, p
+    H: H statistic corrected for ties
+    p: p value of the chi-squared distribution
+    """
+    group_n = np.bincount(codes)
+    if len(group_n) < 2:
+        raise ValueError('Need at least two groups in stats.kruskal()')
+    n = len(ranks)
+    tie_correction = 1.0 - np.sum(tie_sizes ** 3 - tie_sizes) / float(n ** 3 - n)
+    if tie_correction == 0:
+        raise ValueError('All numbers are identical in kruskal')
+    rank_sums = np.bincount(codes, weights=ranks)
+    H = (12.0 / (n * (n + 1)) * np.sum(rank_sums ** 2 / group_n) - 3 * (n + 1)) / tie_correction
+    return H, stats.chi2.sf(H, len(group_n) - 1)
+
+
+def cell_statistics(data, var_name, grouping_names):
+    """
+    Sufficient statistics of the cells of several grouping variables: number of cases, mean and sum of squared
+    deviations from the mean
+
+    The level combinations are coded once, and every statistic is computed with a single pass over the data. Only the
+    cells with cases are included.
+
+    ### Arguments:
+    data: pandas DataFrame without missing values in the variables
+    var_name: label of the dependent variable
+    grouping_names: list of labels of the grouping variables
+
+    ### Returns: cell_stats
+    cell_stats: pandas DataFrame with 'n', 'mean' and 'ss' columns; the index is a MultiIndex of the level
+                combinations in sorted order
+    """
+    codes, levels = zip(*[pd.factorize(data[grouping_name], sort=True) for grouping_name in grouping_names])
+    combined_codes = np.ravel_multi_index(codes, [len(level) for level in levels])
+    cell_codes, cells = pd.factorize(combined_codes, sort=True)
+    values = np.asarray(data[var_name], dtype=float)
+    n = np.bincount(cell_codes, minlength=len(cells))
+    mean = np.bincount(cell_codes, weights=values, minlength=len(cells)) / n
+    ss = np.bincount(cell_codes, weights=np.square(values - mean[cell_codes]), minlength=len(cells))
+    index = pd.MultiIndex.from_arrays([level[level_codes] for level, level_codes in
+                                       zip(levels, np.unravel_index(cells, [len(level) for level in levels]))],
+                                      names=grouping_names)
+    return pd.DataFrame({'n': n, 'mean': mean, 'ss': ss}, index=index)
+
+
+def factorial_anova(cell_stats):
+    """
+    Between-subjects factorial ANOVA with Type III sums of squares computed from the sufficient statistics of the cells
+
+    The model includes all main effects and interactions of the grouping variables with treatment coding (the first
+    level is the reference level), so the result is the same as the result of the statsmodels anova_lm(typ=3) of the
+    full factorial model fitted to the raw data. The model is fitted to the cell means weighted by the number of cases,
+    therefore the cost does not depend on the number of cases.
+
+    ### Arguments:
+    cell_stats: pandas DataFrame returned by cell_statistics()
+
+    ### Returns: anova_table, [DFd, SSd]
+    anova_table: pandas DataFrame with 'df', 'ss', 'F' and 'p' columns; the index includes the terms (tuples of the
+                 grouping variable names) with the main effects first, then the interactions in increasing order
+    DFd, SSd: degrees of freedom and sum of squares of the error
+    """
+    n = cell_stats['n'].values
+    means = cell_stats['mean'].values
+    grouping_names = list(cell_stats.index.names)
+
+    # Treatment coded dummy variables of the grouping variables
+    dummies = [(np.asarray(level_codes)[:, np.newaxis] == np.arange(1, len(levels))).astype(float)
+               for level_codes, levels in zip(cell_stats.index.codes, cell_stats.index.levels)]
+    # Design matrix with the intercept and with the products of the dummy variables for all terms
+    terms = [term for term_size in range(1, len(grouping_names) + 1)
+             for term in itertools.combinations(range(len(grouping_names)), term_size)]
+    columns = [np.ones((len(n), 1))]
+    for term in terms:
+        term_columns = np.ones((len(n), 1))
+        for factor in term:
+            term_columns = (term_columns[:, :, np.newaxis] * dummies[factor][:, np.newaxis, :]).\
+                reshape(len(n), -1)
+        columns.append(term_columns)
+    term_slices = np.cumsum([0] + [column.shape[1] for column in columns])
+    x = np.hstack(columns)
+
+    # Weighted least squares fit of the cell means; X'WX and X'Wy are the same as X'X and X'y of the raw data
+    xtwx_inv = np.linalg.pinv(x.T @ (n[:, np.newaxis] * x))
+    beta = xtwx_inv @ (x.T @ (n * means))
+    SSd = np.sum(cell_stats['ss'].values) + np.sum(n * np.square(means - x @ beta))
+    DFd = np.sum(n) - np.linalg.matrix_rank(x)
+    ms_error = SSd / DFd
+
+    # Wald F test of the coefficients of the terms
+    anova_table = pd.DataFrame(columns=['df', 'ss', 'F', 'p'], index=pd.Index(
+        [tuple(grouping_names[factor] for factor in term) for term in terms], tupleize_cols=False), dtype=float)
+    for term_i in range(len(terms)):
+        term_slice = slice(term_slices[term_i + 1], term_slices[term_i + 2])
+        term_beta = beta[term_slice]
+        term_cov = xtwx_inv[term_slice, term_slice]
+        DFn = np.linalg.matrix_rank(term_cov)
+        SSn = term_beta @ np.linalg.pinv(term_cov) @ term_beta
+        F = SSn / DFn / ms_error
+        anova_table.iloc[term_i] = [DFn, SSn, F, stats.f.sf(F, DFn, DFd)]
+    return anova_table, [DFd, SSd]
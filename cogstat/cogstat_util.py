@@ -5,8 +5,10 @@ Various functions for CogStat.
 
 import sys
 import os
+from collections import OrderedDict
 
 import numpy as np
+import pandas as pd
 
 from . import cogstat_config as csc
 
@@ -22,41 +24,26 @@ def get_versions():
     
     # Python components
     csc.versions['python'] = sys.version
-    try:
-        import numpy
-        csc.versions['numpy'] = numpy.__version__ 
-    except:
-        csc.versions['numpy'] = None
-    try:
-        import pandas
-        csc.versions['pandas'] = pandas.__version__
-        #csc.versions['pandas'] = pandas.version.version
-    except:
-        csc.versions['pandas'] = None
-    try:
-        import scipy.stats
-        csc.versions['scipy'] = scipy.version.version
-    except:
-        csc.versions['scipy'] = None
-    try:
-        import statsmodels
-        csc.versions['statsmodels'] = statsmodels.version.version
-    except:
-        csc.versions['statsmodels'] = None
-    try:
-        import matplotlib
-        csc.versions['matplotlib'] = matplotlib.__version__
-    except:
-        csc.versions['matplotlib'] = None
-    try:
-        from PyQt5.Qt import PYQT_VERSION_STR
-        csc.versions['pyqt'] = PYQT_VERSION_STR
-        # PyQt style can be checked only if the window is open and the object is available
-        # It is GUI specific
-        #csc.versions['pyqtstyle'] = main_window.style().metaObject().className()
-    except:
-        csc.versions['pyqt'] = None
-        #csc.versions['pyqtstyle'] = None
+    # Read the versions from the package metadata if possible, so that the (sometimes slow) modules are not imported
+    components = [('numpy', 'numpy', 'numpy', '__version__'),
+                  ('pandas', 'pandas', 'pandas', '__version__'),
+                  ('scipy', 'scipy', 'scipy', '__version__'),
+                  ('statsmodels', 'statsmodels', 'statsmodels', '__version__'),
+                  ('matplotlib', 'matplotlib', 'matplotlib', '__version__'),
+                  ('pyqt', 'PyQt5', 'PyQt5.Qt', 'PYQT_VERSION_STR')]
+    for component, distribution, module_name, version_attribute in components:
+        try:
+            from importlib import metadata
+            csc.versions[component] = metadata.version(distribution)
+        except:  # Python before 3.8, or the package was not installed with metadata (e.g., some Linux packages)
+            try:
+                import importlib
+                csc.versions[component] = getattr(importlib.import_module(module_name), version_attribute)
+            except:
+                csc.versions[component] = None
+    # PyQt style can be checked only if the window is open and the object is available
+    # It is GUI specific
+    #csc.versions['pyqtstyle'] = main_window.style().metaObject().className()
 
     # R components
     '''
@@ -114,9 +101,10 @@ def print_p(p):
     return '<i>p</i> &lt; 0.001' if p < 0.001 else '<i>p</i> = %0.3f' % p
 
 
-def precision(data):
+def precision(data, max_precision=17):
     """Compute the maximal decimal precision in the data.
     data: pandas series
+    max_precision: the highest precision returned; with 17 decimals all the digits of a float are shown
 
     returns:
         maximum number of decimals in list, or None if data are not numerical
@@ -129,12 +117,70 @@ def precision(data):
     # Check if data includes numbers (actually only the first item is checked)
     # np.integer should also be included, because in some systems it is not recognised as int
     # or http://stackoverflow.com/questions/4187185/how-can-i-check-if-my-python-object-is-a-number
-    if isinstance(data.iloc[0], (int, float, complex, np.integer)):
-        return max([len(('%d' % x if int(x) == x else '%s' % x).partition('.')[2]) for x in data])
+    if isinstance(data.iloc[0], (int, float, complex, np.integer, np.floating)):
+        values = np.asarray(data)
+        # 32 bit floats are checked at their own precision
+        if values.dtype != np.float32:
+            values = values.astype(float)
+        # Find the smallest number of decimals for each value that keeps the value unchanged; the number of values to
+        # check decreases with every decimal
+        values = values[np.isfinite(values)]
+        for decimals in range(max_precision):
+            values = values[np.round(values, decimals) != values]
+            if len(values) == 0:
+                return decimals
+        return max_precision
     else:
         return None
 
 
+def upcast(data):
+    """Convert the 32 bit float variables to 64 bit floats; calculations should use 64 bit floats.
+    data: pandas data frame or series
+
+    returns:
+        data with the 32 bit float variables converted (the original data, if there are no such variables)
+    """
+    if isinstance(data, pd.Series):
+        return data.astype(float) if data.dtype == np.float32 else data
+    float32_columns = data.select_dtypes(include=[np.float32]).columns
+    return data.astype({column: float for column in float32_columns}) if len(float32_columns) else data
+
+
+class LRUCache:
+    """Dictionary-like storage that keeps only the maxsize most recently used items."""
+
+    def __init__(self, maxsize=64):
+        self.maxsize = maxsize
+        self._items = OrderedDict()
+
+    def __contains__(self, key):
+        return key in self._items
+
+    def __len__(self):
+        return len(self._items)
+
+    def __getitem__(self, key):
+        self._items.move_to_end(key)
+        return self._items[key]
+
+    def __setitem__(self, key, value):
+        self._items[key] = value
+        self._items.move_to_end(key)
+        while len(self._items) > self.maxsize:
+            self._items.popitem(last=False)
+
+    def clear(self):
+        self._items.clear()
+
+    def key_of(self, value):
+        """Return the key of the stored item that is value itself (not only equal to it), or None."""
+        for key, item in self._items.items():
+            if item is value:
+                return key
+        return None
+
+
 def reformat_output(output):
     """Reformat the output to display
     :param output: str - text to reformat
@@ -0,0 +1,289 @@
+# -*- coding: utf-8 -*-
+"""Benchmarks for the computationally demanding parts of CogStat.
+
+Run the script from this directory. Without arguments all benchmarks are run, otherwise only the listed ones, e.g.:
+    python benchmark.py repeated_measures_anova
+
+The running times are printed; the time per case should stay roughly constant if the method scales linearly.
+"""
+
+import os
+import subprocess
+import sys
+import tempfile
+import timeit
+from concurrent.futures import ThreadPoolExecutor
+sys.path.insert(0, os.path.abspath('../..'))
+
+import numpy as np
+import pandas as pd
+from scipy import stats
+
+from cogstat import cogstat as cs
+from cogstat import cogstat_chart as cs_chart
+from cogstat import cogstat_stat as cs_stat
+from cogstat import cogstat_stat_num as cs_stat_num
+
+
+def _time(function, repeat=3):
+    """Return the best running time of the function in seconds."""
+    return min(timeit.repeat(function, number=1, repeat=repeat))
+
+
+def repeated_measures_anova():
+    """Repeated measures ANOVA with increasing number of subjects."""
+    print('Repeated measures ANOVA (3 conditions)')
+    np.random.seed(555)
+    for n in [10**3, 10**4, 10**5, 10**6]:
+        data = pd.DataFrame(np.random.normal(size=(n, 3)), columns=['a', 'b', 'c'])
+        running_time = _time(lambda: cs_stat_num.repeated_measures_anova(data, ['a', 'b', 'c']))
+        print('N = %7d: %8.4f s, %6.3f µs/case' % (n, running_time, running_time / n * 1e6))
+
+
+def split_into_groups():
+    """Splitting the data according to two grouping variables with increasing number of cases."""
+    print('Splitting into groups (2 grouping variables, 10 × 5 levels)')
+    np.random.seed(555)
+    for n in [10**3, 10**4, 10**5, 10**6]:
+        data = pd.DataFrame({'a': np.random.normal(size=n), 'g1': np.random.randint(10, size=n),
+                             'g2': np.random.choice(list('vwxyz'), size=n)})
+        running_time = _time(lambda: cs_stat._split_into_groups(data, 'a', ['g1', 'g2']))
+        print('N = %7d: %8.4f s, %6.3f µs/case' % (n, running_time, running_time / n * 1e6))
+
+
+def nominal_variables():
+    """Memory usage and grouping of nominal string variables with increasing number of cases."""
+    print('Nominal string variables (2 grouping variables, 10 × 5 levels)')
+    np.random.seed(555)
+    for n in [10**4, 10**5, 10**6]:
+        data = cs.CogStatData(data=pd.DataFrame({'a': np.random.normal(size=n),
+                                                 'g1': np.random.choice(['group %d' % i for i in range(10)], n),
+                                                 'g2': np.random.choice(list('vwxyz'), n)}),
+                              measurement_level='int nom nom')
+        memory = data.data_frame.memory_usage(deep=True).sum()
+        running_time = _time(lambda: (cs_stat._split_into_groups(data.data_frame, 'a', ['g1', 'g2']),
+                                      pd.crosstab(data.data_frame['g1'], data.data_frame['g2'])))
+        print('N = %7d: %8.4f s, %6.3f µs/case, %6.1f bytes/case' % (n, running_time, running_time / n * 1e6,
+                                                                     memory / float(n)))
+
+
+def descriptives():
+    """Descriptive statistics of a variable in 10 groups with increasing number of cases."""
+    print('Descriptives (10 groups)')
+    np.random.seed(555)
+    statistics = ['mean', 'std', 'skew', 'kurtosis', 'ptp', 'amin', 'amax', 'lower_quartile', 'median', 'upper_quartile']
+    for n in [10**3, 10**4, 10**5, 10**6]:
+        data = pd.DataFrame({'a': np.random.normal(size=n), 'g': np.random.randint(10, size=n)})
+        running_time = _time(lambda: cs_stat.print_var_stats(data, ['a'], groups=['g'], statistics=statistics))
+        print('N = %7d: %8.4f s, %6.3f µs/case' % (n, running_time, running_time / n * 1e6))
+
+
+def pairwise_ttest():
+    """Pairwise post-hoc t-tests with increasing number of conditions and subjects."""
+    print('Pairwise t-tests')
+    np.random.seed(555)
+    for k in [5, 10, 20, 40]:
+        for n in [10**3, 10**4, 10**5]:
+            var_names = ['v%d' % i for i in range(k)]
+            data = pd.DataFrame(np.random.normal(size=(n, k)), columns=var_names)
+            running_time = _time(lambda: cs_stat_num.pairwise_ttest(data, var_names))
+            print('k = %2d, N = %7d: %8.4f s, %6.3f µs/cell' % (k, n, running_time, running_time / (n * k) * 1e6))
+
+
+def filtering():
+    """Switching the outlier filtering on and off with increasing number of cases."""
+    print('Filtering (5 variables of 20)')
+    np.random.seed(555)
+    for n in [10**4, 10**5, 10**6]:
+        data = cs.CogStatData(data=pd.DataFrame(np.random.normal(size=(n, 20)),
+                                                columns=['v%d' % i for i in range(20)]))
+        for mode in ['2sd', 'mad', 'iqr', 'mahalanobis']:
+            running_time = _time(lambda: (data.filter_outlier(['v0', 'v1', 'v2', 'v3', 'v4'], mode=mode),
+                                          data._filtered_columns(['v0']), data.filter_outlier(None),
+                                          data._filtered_columns(['v0'])))
+            print('%-11s N = %7d: %8.4f s, %6.3f µs/case' % (mode, n, running_time, running_time / n * 1e6))
+
+
+def import_time():
+    """Importing the cogstat module without the GUI in a new process."""
+    print('Importing cogstat (non-Qt backend)')
+    command = [sys.executable, '-c', 'import sys; import cogstat.cogstat; '
+               'print(sorted({module.split(".")[0] for module in sys.modules} & {"statsmodels", "PyQt5"}))']
+    environment = dict(os.environ, MPLBACKEND='agg', PYTHONPATH=os.path.abspath('../..'))
+    loaded_modules = []
+    running_time = _time(lambda: loaded_modules.append(subprocess.check_output(command, env=environment)))
+    print('Import time: %0.2f s, heavy modules loaded: %s' % (running_time, loaded_modules[-1].decode().strip()))
+
+
+def import_data():
+    """Importing long and wide text files with several string variables."""
+    print('Importing text files')
+    np.random.seed(555)
+    words = np.array(['apple', 'pear', 'plum', 'cherry', 'peach'])  # ascii only: all cells have to be checked
+    with tempfile.TemporaryDirectory() as temp_dir:
+        for shape_name, n, str_n in [('long', 10**4, 8), ('long', 10**5, 8), ('long', 10**6, 8),
+                                     ('wide', 10**3, 500), ('wide', 10**4, 500)]:
+            data = pd.DataFrame({'str%d' % i: np.random.choice(words, n) for i in range(str_n)})
+            data['num'] = np.random.normal(size=n)
+            data['percent'] = ['%d%%' % value for value in np.random.randint(100, size=n)]
+            file_name = os.path.join(temp_dir, 'data.csv')
+            data.to_csv(file_name, sep='\t', index=False)
+            running_time = _time(lambda: cs.CogStatData(data=file_name), repeat=1)
+            print('%s, N = %7d, %3d string variables: %8.4f s, %6.3f µs/cell' %
+                  (shape_name, n, str_n, running_time, running_time / (n * (str_n + 2)) * 1e6))
+
+
+def compact_storage():
+    """Memory usage and analysis time of a wide data set with and without the compact storage of numbers."""
+    print('Compact storage (200 integer codes, 200 integer codes with missing values, 10 grouping variables)')
+    np.random.seed(555)
+    for n in [10**4, 10**5]:
+        columns = {'int%d' % i: np.random.randint(1, 8, n) for i in range(200)}
+        columns.update({'missing%d' % i: np.where(np.random.random(n) < 0.05, np.nan, np.random.randint(0, 100, n))
+                        for i in range(200)})
+        columns.update({'group%d' % i: np.random.randint(0, 3, n) for i in range(10)})
+        data = pd.DataFrame(columns)
+        measurement_level = ' '.join(['int'] * 400 + ['nom'] * 10)
+        for compact in [False, True]:
+            cs_data = cs.CogStatData(data=data.copy(), measurement_level=measurement_level, downcast=compact,
+                                     float32=compact)
+            memory = cs_data.data_frame.memory_usage(deep=True).sum()
+            running_time = _time(lambda: [cs_stat.print_var_stats(cs_data.data_frame, ['missing%d' % i],
+                                                                  groups=['group%d' % (i % 10)],
+                                                                  statistics=['mean', 'std', 'median'])
+                                          for i in range(20)])
+            print('N = %6d, %-7s: %7.1f MB, analyses: %8.4f s' % (n, 'compact' if compact else 'default',
+                                                                  memory / 2.0**20, running_time))
+
+
+def chart_rendering():
+    """Creating and rendering charts sequentially and in parallel threads."""
+    print('Chart rendering (histograms with boxplots, 4 threads)')
+    np.random.seed(555)
+    data = pd.DataFrame(np.random.normal(size=(100, 10)), columns=list('abcdefghij'))
+    measurement_levels = {var_name: 'int' for var_name in data.columns}
+
+    def render(var_name):
+        figure = cs_chart.create_histogram_chart(data, measurement_levels, var_name)
+        figure.canvas.draw()
+
+    for chart_n in [10, 40]:
+        var_names = list(data.columns) * (chart_n // len(data.columns))
+        sequential_time = _time(lambda: [render(var_name) for var_name in var_names])
+        with ThreadPoolExecutor(4) as executor:
+            parallel_time = _time(lambda: list(executor.map(render, var_names)))
+        print('%4d charts: sequential %8.4f s, parallel %8.4f s' % (chart_n, sequential_time, parallel_time))
+
+
+def one_way_anova():
+    """One-way ANOVA from the sufficient statistics of the groups with increasing number of cases."""
+    print('One-way ANOVA (50 groups)')
+    np.random.seed(555)
+    for n in [10**4, 10**5, 10**6]:
+        groups = np.random.randint(50, size=n)
+        data = pd.DataFrame({'a': np.random.normal(size=n) + groups / 50.0, 'g': groups})
+        running_time = _time(lambda: cs_stat_num.one_way_anova(cs_stat_num.group_statistics(data, 'a', 'g')))
+        print('N = %7d: %8.4f s, %6.3f µs/case' % (n, running_time, running_time / n * 1e6))
+
+
+def factorial_anova():
+    """Factorial ANOVA from the sufficient statistics of the cells with increasing number of cases.
+
+    The aggregation of the cells is a single pass over the data; the cost of the model does not depend on the number
+    of cases.
+    """
+    print('Three-way factorial ANOVA (4 x 3 x 2 cells)')
+    np.random.seed(555)
+    for n in [10**4, 10**5, 10**6]:
+        data = pd.DataFrame({'g0': np.random.randint(4, size=n), 'g1': np.random.randint(3, size=n),
+                             'g2': np.random.randint(2, size=n)})
+        data['a'] = np.random.normal(size=n) + data['g0'] / 4.0
+        aggregation_time = _time(lambda: cs_stat_num.cell_statistics(data, 'a', ['g0', 'g1', 'g2']))
+        cell_stats = cs_stat_num.cell_statistics(data, 'a', ['g0', 'g1', 'g2'])
+        model_time = _time(lambda: cs_stat_num.factorial_anova(cell_stats))
+        print('N = %7d: aggregation %8.4f s, model %8.4f s' % (n, aggregation_time, model_time))
+
+
+def rank_tests():
+    """Rank-based tests of the same ordinal variable with scipy and with the shared rank cache.
+
+    scipy sorts the data in every test; the rank cache sorts the variable once, and every test ranks the cases from
+    the stored sort order.
+    """
+    print('Spearman, Mann-Whitney and Kruskal-Wallis tests of the same variable')
+    np.random.seed(555)
+    for n in [10**4, 10**5, 10**6]:
+        data = pd.DataFrame({'a': np.random.randint(100, size=n).astype(float), 'b': np.random.normal(size=n),
+                             'g': np.random.randint(3, size=n)})
+
+        def scipy_tests():
+            stats.spearmanr(data['a'], data['b'])
+            stats.mannwhitneyu(data['a'][data['g'] == 0], data['a'][data['g'] == 1], alternative='two-sided')
+            stats.kruskal(*[data['a'][data['g'] == group] for group in range(3)])
+
+        def cached_tests():
+            rank_cache = cs_stat_num.RankCache(data)
+            cs_stat_num.spearman_r(rank_cache.ranks('a'), rank_cache.ranks('b'))
+            two_groups = (data['g'] < 2).values
+            cs_stat_num.mann_whitney_u(rank_cache.ranks('a', two_groups)[two_groups], data['g'].values[two_groups] == 0,
+                                       rank_cache.tie_sizes('a', two_groups))
+            cs_stat_num.kruskal_wallis(rank_cache.ranks('a'), data['g'].values, rank_cache.tie_sizes('a'))
+
+        print('N = %7d: scipy %8.4f s, rank cache %8.4f s' % (n, _time(scipy_tests), _time(cached_tests)))
+
+
+def normality_tests():
+    """Normality check of the groups one by one with charts and of all groups at once without charts."""
+    print('Normality check of 10 groups')
+    np.random.seed(555)
+    data_measlevs = {'a': 'int', 'g': 'nom'}
+    for n in [10**4, 10**5, 10**6]:
+        data = pd.DataFrame({'a': np.random.normal(size=n), 'g': np.random.randint(10, size=n)})
+        group_levels = list(range(10))
+
+        def separate_tests():
+            for group in group_levels:
+                cs_stat.normality_test(data, data_measlevs, 'a', group_name='g', group_value=group, charts=True)
+
+        def group_tests():
+            cs_stat.normality_test_groups(data, data_measlevs, 'a', 'g', group_levels)
+
+        print('N = %7d: separately %8.4f s, at once %8.4f s' % (n, _time(separate_tests, repeat=1), _time(group_tests)))
+
+
+def correlation_matrix():
+    """Correlation matrix of 50 variables with missing values, pair by pair with scipy and with matrix products."""
+    print('Pearson and Spearman correlations of 50 variables')
+    np.random.seed(555)
+    var_names = ['v%d' % i for i in range(50)]
+    for n in [10**3, 10**4, 10**5]:
+        data = pd.DataFrame(np.random.normal(size=(n, len(var_names))), columns=var_names)
+        data = data.mask(np.random.random(size=data.shape) < 0.01)
+
+        def pairwise_tests():
+            for i, x in enumerate(var_names):
+                for y in var_names[i+1:]:
+                    valid = data[[x, y]].dropna()
+                    stats.pearsonr(valid[x], valid[y])
+                    stats.spearmanr(valid[x], valid[y])
+
+        def matrix_tests():
+            values = data.values
+            valid = ~np.isnan(values)
+            r, pair_n = cs_stat_num.pairwise_correlations(values, valid)
+            cs_stat_num.correlation_p(r, pair_n)
+            r, pair_n = cs_stat_num.rank_correlations(cs_stat_num.RankCache(data), var_names)
+            cs_stat_num.correlation_p(r, pair_n)
+
+        print('N = %7d: pair by pair %8.4f s, matrix %8.4f s' % (n, _time(pairwise_tests, repeat=1), _time(matrix_tests)))
+
+
+benchmarks = [repeated_measures_anova, split_into_groups, nominal_variables, descriptives, pairwise_ttest, filtering, import_time, import_data, compact_storage,
+              chart_rendering, one_way_anova, factorial_anova, rank_tests,
+              normality_tests, correlation_matrix]
+
+if __name__ == '__main__':
+    selected_benchmarks = sys.argv[1:]
+    for benchmark in benchmarks:
+        if not selected_benchmarks or benchmark.__name__ in selected_benchmarks:
+            benchmark()
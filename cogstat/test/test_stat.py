@@ -3,11 +3,13 @@
 import unittest
 import os
 import sys
+import tempfile
 sys.path.insert(0, os.path.abspath('../..'))
 print(sys.path)
 import numpy as np
 import pandas as pd
 from cogstat import cogstat as cs
+from cogstat import cogstat_config as csc
 
 print(cs.__file__)
 print(cs.__version__)
@@ -62,6 +64,99 @@ data = cs.CogStatData(data=data_pd, measurement_level=
 class CogStatTestCase(unittest.TestCase):
     """Unit tests for CogStat."""
 
+    def test_import_data_frame(self):
+        """Test that importing a pandas DataFrame does not change it"""
+        data_frame = pd.DataFrame({'x': [1.5, 2.5, 3.5], 's': ['u', 'v', 'u']})
+        imported_data = cs.CogStatData(data=data_frame, measurement_level='int nom')
+        self.assertEqual(str(imported_data.data_frame['s'].dtype), 'category')
+        self.assertEqual(str(data_frame['s'].dtype), 'object')
+        imported_data.data_frame.loc[0, 'x'] = 99
+        self.assertEqual(data_frame.loc[0, 'x'], 1.5)
+
+        # Compact storage
+        data_frame = pd.DataFrame({'i': [1, 2, 3], 'x': [1.5, 2.5, np.nan]})
+        imported_data = cs.CogStatData(data=data_frame, measurement_level='int int', downcast=True, float32=True)
+        self.assertEqual(str(imported_data.data_frame['i'].dtype), 'int8')
+        self.assertEqual(str(imported_data.data_frame['x'].dtype), 'float32')
+        self.assertEqual(str(data_frame['i'].dtype), 'int64')
+        self.assertEqual(str(data_frame['x'].dtype), 'float64')
+
+    def test_filter_outlier(self):
+        """Test outlier filtering"""
+        self.addCleanup(data.filter_outlier, None)  # the other tests use the unfiltered data
+
+        result = data.filter_outlier(['a', 'b'], mode='2sd')
+        self.assertTrue('Filtering based on a (2 SD).' in result[1])
+        self.assertTrue('Cases outside of the range will be excluded: -3.3965  --  9.6841' in result[1])
+        self.assertEqual(sorted(set(range(30)) - set(data.data_frame.index)), [4, 25])
+
+        result = data.filter_outlier(['a', 'b'], mode='mad')
+        self.assertTrue('Filtering based on a (MAD).' in result[1])
+        self.assertTrue('Cases outside of the range will be excluded: -2.9703  --  8.6793' in result[1])
+        self.assertEqual(sorted(set(range(30)) - set(data.data_frame.index)), [2, 4, 5, 7, 9, 11, 13, 14, 20, 23, 25, 28])
+
+        result = data.filter_outlier(['a', 'b'], mode='iqr')
+        self.assertTrue('Filtering based on a (IQR).' in result[1])
+        self.assertTrue('Cases outside of the range will be excluded: -3.0337  --  8.8403' in result[1])
+        self.assertEqual(sorted(set(range(30)) - set(data.data_frame.index)), [2, 4, 5, 7, 11, 14, 23, 25, 28])
+
+        result = data.filter_outlier(['a', 'b'], mode='mahalanobis')
+        self.assertTrue('Filtering based on a, b (Mahalanobis distance).' in result[1])
+        self.assertTrue('Cases with squared Mahalanobis distance above 13.816 will be excluded.' in result[1])
+        self.assertEqual(sorted(set(range(30)) - set(data.data_frame.index)), [4])
+        result = data.explore_variable_pair('a', 'b')
+        self.assertTrue('N of valid pairs: 29' in result[1])
+
+        # Switch off the filtering
+        result = data.filter_outlier(None)
+        self.assertTrue('Filtering is switched off.' in result[1])
+        self.assertEqual(len(data.data_frame), 30)
+        result = data.explore_variable_pair('a', 'b')
+        self.assertTrue('N of valid pairs: 30' in result[1])
+
+    def test_import_text_file_in_chunks(self):
+        """Test that a text file is imported in chunks the same way as at once"""
+        with tempfile.TemporaryDirectory() as temp_dir:
+            file_name = os.path.join(temp_dir, 'data.csv')
+            with open(file_name, 'w') as f:
+                # x: numbers in the first chunks, a string later; y: missing value in a later integer chunk
+                f.write('x\ty\tz\n1\t1\t10%\n2\t2\t20%\n3\t3\t30%\n4\t\t40%\nabc\t5\t50%\n')
+            imported_data = cs.CogStatData(data=file_name)
+            self.addCleanup(setattr, csc, 'import_chunk_size', csc.import_chunk_size)
+            csc.import_chunk_size = 2
+            chunked_data = cs.CogStatData(data=file_name)
+        self.assertEqual(list(chunked_data.data_frame['x'].astype(str)), ['1', '2', '3', '4', 'abc'])
+        self.assertEqual(chunked_data.data_measlevs['x'], 'nom')
+        self.assertEqual(str(chunked_data.data_frame['y'].dtype), 'float64')
+        self.assertEqual(list(chunked_data.data_frame['z']), [0.1, 0.2, 0.3, 0.4, 0.5])
+        pd.testing.assert_frame_equal(chunked_data.data_frame, imported_data.data_frame)
+
+    def test_import_cache_keeps_loaded_data(self):
+        """Test that rewriting an entry of the import cache does not change the data loaded from it earlier"""
+        try:
+            import pyarrow
+        except ImportError:
+            self.skipTest('pyarrow is not available')
+        with tempfile.TemporaryDirectory() as temp_dir:
+            for setting, value in [('import_cache_dir', os.path.join(temp_dir, 'cache')),
+                                   ('import_cache_min_size', 0)]:
+                self.addCleanup(setattr, csc, setting, getattr(csc, setting))
+                setattr(csc, setting, value)
+            file_name = os.path.join(temp_dir, 'data.csv')
+            pd.DataFrame({'a': np.arange(1000), 'b': np.arange(1000) * 0.5}).to_csv(file_name, sep='\t', index=False)
+            cs.CogStatData(data=file_name)
+            cached_data = cs.CogStatData(data=file_name)  # imported from the cache
+            # Other import settings and changed files store new data in the cache
+            cs.CogStatData(data=file_name, downcast=True)
+            pd.DataFrame({'a': np.arange(1000) * 3, 'b': np.arange(1000) * 1.5}).to_csv(file_name, sep='\t',
+                                                                                       index=False)
+            changed_data = cs.CogStatData(data=file_name)
+            cs.CogStatData(data=file_name)
+            self.assertEqual(cached_data.data_frame['a'].sum(), 499500)
+            self.assertEqual(cached_data.data_frame['b'].sum(), 249750)
+            self.assertEqual(changed_data.data_frame['a'].sum(), 1498500)
+            self.assertEqual([name for name in os.listdir(csc.import_cache_dir) if name.endswith('.tmp')], [])
+
     def test_explore_variables(self):
         """Test explore variables"""
 
@@ -146,6 +241,22 @@ class CogStatTestCase(unittest.TestCase):
         self.assertTrue('(4, <i>N</i> = 30) = 8.312' in result[6])
         self.assertTrue('<i>p</i> = 0.081' in result[6])
 
+    def test_explore_correlation_matrix(self):
+        """Test explore correlation matrix"""
+
+        # Int variables
+        result = data.explore_correlation_matrix(['a', 'b', 'e'])
+        self.assertTrue('<td>a</td>      <td>b</td>      <td>30</td>      <td>-0.141</td>      <td>[-0.477, 0.231]</td>'
+                        '      <td>0.456</td>      <td>-0.363</td>      <td>[-0.640, -0.003]</td>      <td>0.048</td>'
+                        in result[4])
+
+        # Ord variables
+        self.addCleanup(data.data_measlevs.__setitem__, 'a', 'int')  # the other tests use a as an interval variable
+        data.data_measlevs['a'] = 'ord'
+        result = data.explore_correlation_matrix(['a', 'b', 'e'])
+        self.assertTrue('<td>a</td>      <td>b</td>      <td>30</td>      <td>-0.363</td>      <td>[-0.640, -0.003]</td>'
+                        '      <td>0.048</td>' in result[4])
+
     def test_compare_variables(self):
         """Test compare variables"""
 
@@ -291,6 +402,22 @@ class CogStatTestCase(unittest.TestCase):
         self.assertTrue('<i>F</i>(2, 21) = 0.185, <i>p</i> = 0.832' in result[7])
         self.assertTrue('<i>F</i>(4, 21) = 1.15, <i>p</i> = 0.363' in result[7])
 
+    def test_compare_groups_factorial(self):
+        """Test compare groups with three grouping variables"""
+
+        # Reference values: statsmodels anova_lm(typ=3)
+        result = data.compare_groups('a', ['i', 'j', 'k'])
+        self.assertTrue('Result of 3-way ANOVA:' in result[7])
+        self.assertTrue('Main effect of j: <i>F</i>(1, 22) = 2.32, <i>p</i> = 0.142' in result[7])
+        self.assertTrue('Interaction of j and k: <i>F</i>(1, 22) = 4.31, <i>p</i> = 0.050' in result[7])
+        self.assertTrue('Interaction of i, j and k: <i>F</i>(1, 22) = 2.27, <i>p</i> = 0.146' in result[7])
+
+        # Empty level combinations (c=1, d=1, i=1; c=2, d=0, i=0; c=2, d=1, i=1); the charts should be created, too
+        result = data.compare_groups('a', ['c', 'd', 'i'])
+        self.assertTrue('Main effect of c: <i>F</i>(2, 15) = 0.824, <i>p</i> = 0.458' in result[7])
+        self.assertTrue('Interaction of d and i: <i>F</i>(2, 15) = 4.19, <i>p</i> = 0.036' in result[7])
+        self.assertTrue('Interaction of c, d and i: <i>F</i>(2, 15) = 0.812, <i>p</i> = 0.463' in result[7])
+
     def test_single_case(self):
 
         # Test for the slope stat